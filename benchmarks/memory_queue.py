@@ -0,0 +1,65 @@
+"""
+Measure the throughput of adding and popping jobs one at a time, with ``MemorySpiderQueue`` and ``SqliteSpiderQueue``.
+
+.. code-block:: shell
+
+   python benchmarks/memory_queue.py
+   python benchmarks/memory_queue.py --jobs 100000
+"""
+
+import argparse
+import tempfile
+import time
+
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks
+
+from scrapyd.config import Config
+from scrapyd.spiderqueue import MemorySpiderQueue, SqliteSpiderQueue
+
+
+@inlineCallbacks
+def run(cls, jobs):
+    with tempfile.TemporaryDirectory() as directory:
+        queue = cls(Config(values={"dbs_dir": directory}), "project")
+
+        # The time to write the buffered journal records is included.
+        sync = queue.q.sync if cls is MemorySpiderQueue else lambda: None
+
+        start = time.perf_counter()
+        for i in range(jobs):
+            queue.add("spider", priority=i % 10, _job=f"{i:032x}", settings={"DOWNLOAD_DELAY": "2"})
+        sync()
+        added = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while queue.pop() is not None:
+            pass
+        sync()
+        popped = time.perf_counter() - start
+
+        # Wait for the snapshot, if any, before the directory is removed.
+        compacting = getattr(queue.q, "compacting", None)
+        if compacting is not None:
+            yield compacting
+
+    return jobs / added, jobs / popped
+
+
+def main(_reactor):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20000)
+    args = parser.parse_args()
+
+    @inlineCallbacks
+    def benchmark():
+        print(f"jobs={args.jobs}")
+        for cls in (MemorySpiderQueue, SqliteSpiderQueue):
+            adds, pops = yield run(cls, args.jobs)
+            print(f"{cls.__name__:>18}: {adds:>10.0f} adds/s {pops:>10.0f} pops/s")
+
+    return benchmark()
+
+
+if __name__ == "__main__":
+    task.react(main)
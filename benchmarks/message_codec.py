@@ -0,0 +1,70 @@
+"""
+Measure the size of a backlog of pending jobs, and the time to list and pop them, for each ``sqlite_codec``.
+
+.. code-block:: shell
+
+   python benchmarks/message_codec.py
+   python benchmarks/message_codec.py --jobs 10000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from scrapyd.sqlite import CODECS, JsonSqlitePriorityQueue
+
+
+def message(i):
+    return {
+        "name": f"spider{i % 20}",
+        "_job": f"{i:032x}",
+        "_version": "1719849600",
+        "_max_proc": 2,
+        "settings": {"DOWNLOAD_DELAY": "2", "LOG_LEVEL": "INFO"},
+        "category": "electronics",
+        "start_url": f"https://example.com/catalog/{i}?page=1&sort=price",
+    }
+
+
+def run(codec, jobs):
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "queue.db")
+        queue = JsonSqlitePriorityQueue(database, codec=codec)
+        queue.put_many([(message(i), i % 10) for i in range(jobs)])
+        queue.conn.execute("VACUUM")
+
+        (row_bytes,) = queue.conn.execute("SELECT SUM(length(message)) FROM queue").fetchone()
+        file_bytes = os.path.getsize(database)
+
+        start = time.perf_counter()
+        for _ in queue:
+            pass
+        listed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while queue.pop_many(100):
+            pass
+        popped = time.perf_counter() - start
+
+        queue.conn.close()
+
+    return row_bytes / jobs, file_bytes, listed, popped
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"jobs={args.jobs}")
+    for codec in CODECS:
+        row_bytes, file_bytes, listed, popped = run(codec, args.jobs)
+        print(
+            f"{codec:>8}: {row_bytes:6.0f} bytes/message {file_bytes / 1e6:7.1f} MB database "
+            f"{listed:6.2f}s list {popped:6.2f}s pop"
+        )
+
+
+if __name__ == "__main__":
+    main()
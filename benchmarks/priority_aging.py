@@ -0,0 +1,78 @@
+"""
+Measure the fairness and latency of ``JsonSqlitePriorityQueue`` with and without priority aging, when a steady stream
+of high-priority jobs uses all the capacity.
+
+Time is simulated: on each tick (one second), jobs are added, and then up to ``--capacity`` jobs are popped. The waits
+are in simulated seconds. The pop times are in real time.
+
+.. code-block:: shell
+
+   python benchmarks/priority_aging.py
+   python benchmarks/priority_aging.py --aging 0 30 300 --high 5 --capacity 4
+"""
+
+import argparse
+import statistics
+import time
+from unittest import mock
+
+from scrapyd.sqlite import JsonSqlitePriorityQueue
+
+
+def percentile(values, fraction):
+    return sorted(values)[int(fraction * (len(values) - 1))] if values else float("nan")
+
+
+def run(aging, ticks, high, low_every, capacity):
+    clock = [0.0]
+    waits = {"high": [], "low": []}
+    pop_times = []
+    with mock.patch("time.time", side_effect=lambda: clock[0]):
+        q = JsonSqlitePriorityQueue(aging=aging)
+        for tick in range(ticks):
+            clock[0] = float(tick)
+            messages = [({"name": "high", "_scheduled": clock[0]}, 10) for _ in range(high)]
+            if tick % low_every == 0:
+                messages.append(({"name": "low", "_scheduled": clock[0]}, 0))
+            q.put_many(messages)
+
+            start = time.perf_counter()
+            popped = q.pop_many(capacity)
+            pop_times.append(time.perf_counter() - start)
+            for message in popped:
+                waits[message["name"]].append(clock[0] - message["_scheduled"])
+
+        pending = {name: 0 for name in waits}
+        for message, _ in q:
+            pending[message["name"]] += 1
+
+    return waits, pending, pop_times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=5000)
+    parser.add_argument("--high", type=int, default=4, help="high-priority (10) jobs added per tick")
+    parser.add_argument("--low-every", type=int, default=10, help="ticks between low-priority (0) jobs")
+    parser.add_argument("--capacity", type=int, default=4, help="jobs popped per tick")
+    parser.add_argument("--aging", type=float, nargs="+", default=[0, 30, 120], help="seconds per priority step")
+    args = parser.parse_args()
+
+    print(f"ticks={args.ticks} high={args.high}/tick low=1/{args.low_every} ticks capacity={args.capacity}/tick")
+    print(f"{'aging':>6} {'class':>5} {'popped':>7} {'pending':>8} {'mean wait':>10} {'p95 wait':>9} {'max wait':>9}")
+    for aging in args.aging:
+        waits, pending, pop_times = run(aging, args.ticks, args.high, args.low_every, args.capacity)
+        for name, values in waits.items():
+            mean = statistics.mean(values) if values else float("nan")
+            print(
+                f"{aging:>6g} {name:>5} {len(values):>7} {pending[name]:>8} {mean:>10.1f} "
+                f"{percentile(values, 0.95):>9.0f} {max(values, default=float('nan')):>9.0f}"
+            )
+        print(
+            f"{'':>6} pop_many: median {statistics.median(pop_times) * 1e6:.0f} us, "
+            f"p99 {percentile(pop_times, 0.99) * 1e6:.0f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
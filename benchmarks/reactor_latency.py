@@ -0,0 +1,99 @@
+"""
+Measure how late the reactor runs a timer while jobs are scheduled and popped, when the disk is slow, for a spider
+queue whose SQL statements run in the reactor thread and for a spider queue whose SQL statements run in a thread.
+
+The slow disk is simulated by sleeping on each commit.
+
+.. code-block:: shell
+
+   python benchmarks/reactor_latency.py
+   python benchmarks/reactor_latency.py --commit-delay 0.05 --jobs 200
+"""
+
+import argparse
+import functools
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from twisted.internet import reactor, task
+from twisted.internet.defer import inlineCallbacks, maybeDeferred
+
+from scrapyd import sqlite
+from scrapyd.config import Config
+from scrapyd.spiderqueue import SqliteSpiderQueue, ThreadedSqliteSpiderQueue
+
+INTERVAL = 0.01
+
+
+class SlowConnection(sqlite3.Connection):
+    delay = 0
+
+    def commit(self):
+        time.sleep(self.delay)
+        super().commit()
+
+    def __exit__(self, *args):
+        time.sleep(self.delay)
+        return super().__exit__(*args)
+
+
+@inlineCallbacks
+def run(cls, jobs):
+    with tempfile.TemporaryDirectory() as directory:
+        queue = cls(Config(values={"dbs_dir": directory}), "project")
+
+        lateness = []
+        expected = [time.perf_counter() + INTERVAL]
+
+        def tick():
+            now = time.perf_counter()
+            lateness.append(now - expected[0])
+            expected[0] = now + INTERVAL
+
+        timer = task.LoopingCall(tick)
+        timer.start(INTERVAL, now=False)
+
+        start = time.perf_counter()
+        # Like a client that schedules jobs, while the poller pops them. Each operation is a separate reactor event.
+        for i in range(jobs):
+            yield task.deferLater(reactor, 0, maybeDeferred, queue.add, "spider", _job=f"{i:032x}")
+            yield task.deferLater(reactor, 0, maybeDeferred, queue.pop)
+        elapsed = time.perf_counter() - start
+
+        timer.stop()
+        queue.q.conn.close()
+
+    lateness.sort()
+    return elapsed, lateness
+
+
+@inlineCallbacks
+def main_deferred(args):
+    SlowConnection.delay = args.commit_delay
+    sqlite.sqlite3.connect = functools.partial(sqlite3.connect, factory=SlowConnection)
+
+    print(f"commit_delay={args.commit_delay}s jobs={args.jobs} timer_interval={INTERVAL}s")
+    for cls in (SqliteSpiderQueue, ThreadedSqliteSpiderQueue):
+        elapsed, lateness = yield run(cls, args.jobs)
+        p99 = lateness[int(len(lateness) * 0.99)] if lateness else 0
+        print(
+            f"{cls.__name__:>26}: {elapsed:6.2f}s elapsed, {len(lateness):>5} ticks, "
+            f"timer lateness median {statistics.median(lateness or [0]) * 1000:7.1f}ms "
+            f"p99 {p99 * 1000:7.1f}ms max {(lateness or [0])[-1] * 1000:7.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--commit-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    main_deferred(args).addErrback(print).addBoth(lambda _: reactor.stop())
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Measure the lookup cost and memory use of the ``SpiderList`` cache, when many versions of many projects are deployed.
+
+Each deployment caches a new version's spider list, like the addversion.json webservice, and is followed by lookups of
+the project's recent versions, like the schedule.json webservice. The ``scrapy list`` process is simulated, so that
+only the cache is measured.
+
+.. code-block:: shell
+
+   python benchmarks/spider_list_cache.py
+   python benchmarks/spider_list_cache.py --maxsize 100 1000 0 --unbounded --deployments 200000
+
+As with the ``spider_list_cache_size`` setting, a ``--maxsize`` of ``0`` disables the cache, so that every lookup
+runs the simulated ``scrapy list`` process. ``--unbounded`` also measures a cache that never evicts.
+"""
+
+import argparse
+import statistics
+import time
+import tracemalloc
+from array import array
+from unittest import mock
+
+from twisted.internet import reactor
+from twisted.internet.error import ProcessDone
+from twisted.python.failure import Failure
+
+from scrapyd.webservice import SpiderList
+
+
+def percentile(values, fraction):
+    return sorted(values)[int(fraction * (len(values) - 1))] if values else float("nan")
+
+
+def spawn(process, *_args, **_kwargs):
+    process.outReceived(b"".join(b"spider%d\n" % i for i in range(10)))
+    process.processEnded(Failure(ProcessDone(0)))
+
+
+def run(maxsize, deployments, projects, lookups, checkpoints):
+    spider_list = SpiderList()
+    spider_list.cache.clear()
+    spider_list.counters.clear()
+    spider_list.maxsize = maxsize
+    results = []
+
+    tracemalloc.start()
+    with mock.patch.object(reactor, "spawnProcess", spawn):
+        lookup_times = array("d")
+        for deployment in range(1, deployments + 1):
+            project = f"project{deployment % projects}"
+            version = f"r{deployment // projects}"
+            spider_list.set(project, version, runner="scrapyd.runner")
+
+            for _ in range(lookups):
+                start = time.perf_counter()
+                spider_list.get(project, version, runner="scrapyd.runner")
+                lookup_times.append(time.perf_counter() - start)
+
+            if deployment in checkpoints:
+                current, _ = tracemalloc.get_traced_memory()
+                results.append((deployment, spider_list.info(), current, lookup_times))
+                lookup_times = array("d")
+    tracemalloc.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deployments", type=int, default=100000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=5, help="lookups per deployment")
+    parser.add_argument("--maxsize", type=int, nargs="+", default=[1000, 0], help="0 disables the cache")
+    parser.add_argument("--unbounded", action="store_true", help="also measure a cache that never evicts")
+    args = parser.parse_args()
+
+    checkpoints = {args.deployments // 100, args.deployments // 10, args.deployments}
+    print(f"deployments={args.deployments} projects={args.projects} lookups={args.lookups}/deployment")
+    print(
+        f"{'maxsize':>8} {'deployed':>9} {'size':>7} {'evictions':>9} {'memory':>9} "
+        f"{'median get':>11} {'p99 get':>8}"
+    )
+    # An unbounded cache is a cache that is larger than the number of deployments.
+    maxsizes = [(maxsize, str(maxsize)) for maxsize in args.maxsize]
+    if args.unbounded:
+        maxsizes.append((args.deployments + 1, "none"))
+    for maxsize, label in maxsizes:
+        for deployment, info, memory, lookup_times in run(
+            maxsize, args.deployments, args.projects, args.lookups, checkpoints
+        ):
+            print(
+                f"{label:>8} {deployment:>9} {info['size']:>7} {info['evictions']:>9} "
+                f"{memory / 2**20:>7.1f}MB {statistics.median(lookup_times) * 1e6:>9.2f}us "
+                f"{percentile(lookup_times, 0.99) * 1e6:>6.2f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure the latency of ``JsonSqlitePriorityQueue.pop`` as the backlog grows. With the (priority, id) index, the
+latency should stay flat.
+
+.. code-block:: shell
+
+   python benchmarks/sqlite_backlog.py
+   python benchmarks/sqlite_backlog.py --backlogs 1000 200000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from scrapyd.sqlite import JsonSqlitePriorityQueue
+
+
+def run(backlog, pops):
+    with tempfile.TemporaryDirectory() as directory:
+        q = JsonSqlitePriorityQueue(os.path.join(directory, "queue.db"), journal_mode="wal", synchronous="normal")
+        with q.conn:
+            q.conn.executemany(
+                f"INSERT INTO {q.table} (priority, message) VALUES (?, ?)",
+                ((i % 10, q.encode({"name": "spider", "_job": f"{i:032x}"})) for i in range(backlog)),
+            )
+
+        start = time.perf_counter()
+        for _ in range(pops):
+            q.pop()
+        return (time.perf_counter() - start) / pops
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pops", type=int, default=500)
+    parser.add_argument("--backlogs", type=int, nargs="+", default=[1000, 10000, 100000, 200000])
+    args = parser.parse_args()
+
+    for backlog in args.backlogs:
+        print(f"{backlog:>8} pending: {run(backlog, args.pops) * 1e6:>8.1f} µs/pop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure the throughput of ``JsonSqlitePriorityQueue.pop`` when many processes share one queue database, like many
+Scrapyd instances sharing a ``dbs_dir`` directory.
+
+.. code-block:: shell
+
+   python benchmarks/sqlite_pop.py
+   python benchmarks/sqlite_pop.py --journal-mode delete --synchronous full
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from scrapyd.sqlite import JsonSqlitePriorityQueue
+
+
+def worker(database, kwargs, barrier, results):
+    q = JsonSqlitePriorityQueue(database, **kwargs)
+    barrier.wait()
+    popped = 0
+    while q.pop() is not None:
+        popped += 1
+    results.put(popped)
+
+
+def run(processes, messages, kwargs):
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "queue.db")
+        q = JsonSqlitePriorityQueue(database, **kwargs)
+        for i in range(messages):
+            q.put({"name": "spider", "_job": f"{i:032x}"}, priority=i % 10)
+
+        barrier = multiprocessing.Barrier(processes + 1)
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=worker, args=(database, kwargs, barrier, results)) for _ in range(processes)
+        ]
+        for process in workers:
+            process.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        popped = sum(results.get() for _ in workers)
+        elapsed = time.perf_counter() - start
+
+        for process in workers:
+            process.join()
+
+    assert popped == messages, f"{popped} messages popped, {messages} expected"
+    return popped / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--journal-mode", default="wal")
+    parser.add_argument("--synchronous", default="normal")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    kwargs = {"journal_mode": args.journal_mode, "synchronous": args.synchronous}
+    print(f"journal_mode={args.journal_mode} synchronous={args.synchronous} messages={args.messages}")
+    for processes in args.processes:
+        print(f"{processes:>3} processes: {run(processes, args.messages, kwargs):>10.0f} pops/s")
+
+
+if __name__ == "__main__":
+    main()
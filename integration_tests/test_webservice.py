@@ -25,12 +25,14 @@ def assert_webservice(method, path, expected, **kwargs):
         ("daemonstatus", "GET"),
         ("addversion", "POST"),
         ("schedule", "POST"),
+        ("schedulebatch", "POST"),
         ("cancel", "POST"),
         ("status", "GET"),
         ("listprojects", "GET"),
         ("listversions", "GET"),
         ("listspiders", "GET"),
         ("listjobs", "GET"),
+        ("exportjobs", "GET"),
         ("delversion", "POST"),
         ("delproject", "POST"),
     ],
@@ -73,7 +75,12 @@ def test_project_directory_traversal(webservice, method, params):
 
 
 def test_daemonstatus():
-    assert_webservice("get", "/daemonstatus.json", {"status": "ok", "running": 0, "pending": 0, "finished": 0})
+    data = req("get", "/daemonstatus.json").json()
+    data.pop("node_name")
+    cache = data.pop("spider_list_cache")
+
+    assert data == {"status": "ok", "running": 0, "pending": 0, "finished": 0}
+    assert cache["maxsize"] == 1000
 
 
 def test_schedule():
@@ -161,6 +168,23 @@ def test_listjobs_nonexistent_project():
     )
 
 
+def test_exportjobs():
+    response = req("get", "/exportjobs.json")
+
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    assert "Content-Length" not in response.headers
+    assert response.content == b""
+
+
+def test_exportjobs_nonexistent_project():
+    assert_webservice(
+        "get",
+        "/exportjobs.json",
+        {"status": "error", "message": "project 'nonexistent' not found"},
+        params={"project": "nonexistent"},
+    )
+
+
 def test_delversion_nonexistent_project():
     assert_webservice(
         "post",
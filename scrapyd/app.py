@@ -35,7 +35,14 @@ def application(config):
 
     # launcher uses jobstorage in initializer, and uses poller and environment.
     launcher = initialize_component(config, "launcher", "scrapyd.launcher.Launcher", app)
+    # poller uses launcher's running processes, with some dispatch policies.
+    poller.processes = launcher.processes
+    # scheduler polls after scheduling, and launcher polls after a process finishes, instead of waiting for timer.
+    scheduler.poller = poller
+    # poller polls only the projects to which scheduler adds jobs, and, every poll rescan interval, all projects.
+    poller.active = scheduler.active
 
+    # timer polls periodically, in case jobs are added to spider queues by other means, like another Scrapyd instance.
     timer = TimerService(poll_interval, poller.poll)
 
     # webroot uses launcher, poller, scheduler and environment.
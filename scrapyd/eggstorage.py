@@ -10,6 +10,15 @@ from scrapyd.exceptions import DirectoryTraversalError, EggNotFoundError, Projec
 from scrapyd.interfaces import IEggStorage
 
 
+def sanitize_version(version):
+    """
+    Return the version, as it appears in an egg's file name, and as :meth:`FilesystemEggStorage.list` returns it.
+
+    .. versionadded:: 1.5.0
+    """
+    return re.sub(r"[^A-Za-z0-9_-]", "_", version)
+
+
 def sorted_versions(versions):
     try:
         return sorted(versions, key=Version)
@@ -19,6 +28,11 @@ def sorted_versions(versions):
 
 @implementer(IEggStorage)
 class FilesystemEggStorage:
+    """
+    .. versionchanged:: 1.5.0
+       :meth:`put` syncs the egg to disk before returning.
+    """
+
     def __init__(self, config):
         self.basedir = config.get("eggs_dir", "eggs")
 
@@ -29,8 +43,21 @@ class FilesystemEggStorage:
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        with open(path, "wb") as f:
+        # Write a temporary file and rename it, so that a partial egg is never read, and sync the egg and the
+        # directory, so that the egg is durably stored once this method returns.
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
             shutil.copyfileobj(eggfile, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        # Windows can't open a directory.
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
     def get(self, project, version=None):
         if version is None:
@@ -68,8 +95,7 @@ class FilesystemEggStorage:
                 raise EggNotFoundError from e
 
     def _egg_path(self, project, version):
-        sanitized_version = re.sub(r"[^A-Za-z0-9_-]", "_", version)
-        return self._get_path(project, f"{sanitized_version}.egg")
+        return self._get_path(project, f"{sanitize_version(version)}.egg")
 
     def _get_path(self, project, *trusted):
         resolvedir = os.path.realpath(self.basedir)
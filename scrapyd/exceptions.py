@@ -33,3 +33,31 @@ class EggNotFoundError(ScrapydError):
 
 class RunnerError(ScrapydError):
     """Raised if the runner returns an error code"""
+
+
+class InvalidOptionError(ConfigError):
+    """Raised if an option isn't one of its allowed values"""
+
+    def __init__(self, option, value, allowed):
+        super().__init__(
+            f"The `{option}` option must be one of {', '.join(allowed)}, not {value!r}. Check and update the "
+            "Scrapyd configuration file."
+        )
+
+
+class UntrustedCodecError(ScrapydError):
+    """Raised if a message is encoded with pickle, and the sqlite_codec setting isn't pickle"""
+
+    def __init__(self):
+        super().__init__(
+            "A pending job is encoded with pickle, but the `sqlite_codec` option isn't `pickle`. Decoding a pickle "
+            "can run arbitrary code. If only trusted Scrapyd instances can write to the database, check and update "
+            "the Scrapyd configuration file."
+        )
+
+
+class InvalidMessageError(ScrapydError):
+    """Raised if a key of a spider queue message has an invalid value"""
+
+    def __init__(self, key, value):
+        super().__init__(f"The `{key}` key of the message is invalid: {value!r}")
@@ -78,14 +78,84 @@ class ISpiderQueue(Interface):
 
         .. versionchanged:: 1.3.0
            Add the ``priority`` parameter.
+        .. versionchanged:: 1.5.0
+           If the ``_dedupe`` spider argument is set, and a message in the queue has the same ``_dedupe`` key, don't
+           add the spider. Instead, raise the priority of the message in the queue to ``priority``, if higher. Return
+           the ``_job`` key of the message in the queue, or ``None`` if unknown.
+
+           If the ``_not_before`` spider argument is set, it is a Unix timestamp before which the message mustn't be
+           popped. If the ``_expires`` spider argument is set, it is a Unix timestamp after which the message mustn't
+           be popped. If the message is a duplicate, the ``_expires`` key of the message in the queue is raised to
+           ``_expires``, if higher.
         """
 
-    def pop():
+    def add_many(spiders):
+        """
+        Add many spiders to the queue, in one operation. ``spiders`` is an iterable of
+        ``(name, priority, spider_args)`` tuples, in which ``spider_args`` is a dict of spider arguments.
+
+        Return a list of the return values of :meth:`~scrapyd.interfaces.ISpiderQueue.add` for each spider, or
+        ``None``.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def pop(skip=None):
         """Pop the next message from the queue. The messages is a dict
         containing a key ``name`` with the spider name and other keys as spider
         attributes.
 
-        This method can return a deferred."""
+        This method can return a deferred.
+
+        .. versionchanged:: 1.5.0
+           Add the ``skip`` parameter. If set, it is a function that accepts a message's spider name and ``_max_proc``
+           key (or ``None``), and returns whether the message is blocked. Pop the next message that isn't blocked, and
+           leave the blocked messages in the queue, in order. Return ``None`` if all messages are blocked.
+
+           ``skip`` is called for messages in the order in which they would be popped. A message for which it returns
+           false is popped."""
+
+    def pop_many(n, skip=None):
+        """
+        Pop up to ``n`` messages from the queue, in one operation, and return a list of the messages, in the order in
+        which :meth:`~scrapyd.interfaces.ISpiderQueue.pop` would return them. ``skip`` is as for ``pop``.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def next_priority():
+        """
+        Return the priority of the message that :meth:`~scrapyd.interfaces.ISpiderQueue.pop` would return, or ``None``
+        if the queue is empty.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def remove_expired():
+        """
+        Remove the messages whose ``_expires`` key (a Unix timestamp) is in the past, and return a list of the removed
+        messages. :meth:`~scrapyd.interfaces.ISpiderQueue.pop` doesn't return these messages.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def next_due():
+        """
+        Return the earliest ``_not_before`` key of the messages that are delayed (whose ``_not_before`` key is in the
+        future), or ``None`` if no message is delayed.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
 
     def list():
         """Return a list with the messages in the queue. Each message is a dict
@@ -94,6 +164,23 @@ class ISpiderQueue(Interface):
 
         This method can return a deferred."""
 
+    def list_page(limit=None, after=None, spider=None, since=None, until=None):
+        """
+        Return a tuple of a list of up to ``limit`` messages (or all messages, if ``limit`` is ``None``), in the order
+        in which they would be popped, and the position after the last message, or ``None`` if there are no more
+        messages. To get the next messages, pass the position as ``after``. The position is JSON-serializable.
+
+        If ``spider`` is set, return only messages whose ``name`` key is ``spider``. If ``since`` or ``until`` (a Unix
+        timestamp) is set, return only messages whose ``_scheduled`` key is at least ``since`` or before ``until``.
+
+        The :ref:`listjobs.json` webservice uses this method, so that a page costs in proportion to its size, rather
+        than to the number of pending jobs.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
     def count():
         """Return the number of spiders in the queue.
 
@@ -104,6 +191,22 @@ class ISpiderQueue(Interface):
         and return the number of removed elements.
         """
 
+    def remove_job(job):
+        """
+        Remove the messages whose ``_job`` key is ``job``, and return the number of removed messages.
+
+        This is equivalent to ``remove(lambda message: message["_job"] == job)``, but can use an index.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def get_job(job):
+        """
+        Return the message whose ``_job`` key is ``job``, or ``None`` if there is no such message.
+
+        .. versionadded:: 1.5.0
+        """
+
     def clear():
         """Clear the queue.
 
@@ -121,6 +224,22 @@ class ISpiderScheduler(Interface):
 
         .. versionchanged:: 1.3.0
            Add the ``priority`` parameter.
+        .. versionchanged:: 1.5.0
+           This method can return a deferred. Return the job ID of the pending job, as returned by
+           :meth:`~scrapyd.interfaces.ISpiderQueue.add`, or ``None``.
+        """
+
+    def schedule_many(project, spiders):
+        """
+        Schedule many spiders for the given project, in one operation. ``spiders`` is an iterable of
+        ``(spider_name, priority, spider_args)`` tuples, in which ``spider_args`` is a dict of spider arguments.
+
+        Return a list of the job IDs of the pending jobs, as returned by
+        :meth:`~scrapyd.interfaces.ISpiderQueue.add_many`, or ``None``.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
         """
 
     def list_projects():
@@ -162,13 +281,72 @@ class IJobStorage(Interface):
     """
 
     def add(job):
-        """Add a finished job in the storage."""
+        """
+        Add a finished job in the storage.
+
+        .. versionchanged:: 1.5.0
+           This method can return a deferred.
+        """
+
+    def add_many(jobs):
+        """
+        Add many finished jobs in the storage, in one operation.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
 
     def list():
-        """Return a list of the finished jobs."""
+        """
+        Return a list of the finished jobs, in reverse order by ``end_time``.
+
+        .. versionchanged:: 1.5.0
+           This method can return a deferred. Scrapyd's webservices and web UI use this method, instead of
+           ``__len__`` and ``__iter__``.
+        """
+
+    def list_page(limit=None, after=None, project=None, spider=None, since=None, until=None, outcome=None):
+        """
+        Return a tuple of a list of up to ``limit`` finished jobs (or all jobs, if ``limit`` is ``None``), in reverse
+        order by ``end_time``, and the position after the last job, or ``None`` if there are no more jobs. To get the
+        next jobs, pass the position as ``after``. The position is JSON-serializable.
+
+        If ``project``, ``spider`` or ``outcome`` is set, return only that project's or spider's jobs, or the jobs with
+        that ``outcome`` attribute. If ``since`` or ``until`` (a datetime) is set, return only jobs whose ``end_time``
+        is at least ``since`` or before ``until``.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def count(outcome=None):
+        """
+        Return the number of finished jobs or, if ``outcome`` is set, the number of jobs with that ``outcome``
+        attribute.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
+
+    def get_job(job, project=None):
+        """
+        Return the finished job whose ID is ``job``, or ``None``. If ``project`` is set, return only the project's job.
+
+        This method can return a deferred.
+
+        .. versionadded:: 1.5.0
+        """
 
     def __len__():
-        """Return a number of the finished jobs."""
+        """
+        Return a number of the finished jobs.
+
+        .. versionchanged:: 1.5.0
+           Scrapyd's webservices use the ``count`` method, instead.
+        """
 
     def __iter__():
         """Iterate over the finished jobs in reverse order by ``end_time``."""
@@ -4,6 +4,7 @@
 """
 
 import datetime
+from collections import Counter
 
 from zope.interface import implementer
 
@@ -12,12 +13,19 @@ from scrapyd.interfaces import IJobStorage
 
 
 class Job:
-    def __init__(self, project, spider, job=None, start_time=None, end_time=None):
+    """
+    .. versionchanged:: 1.5.0
+       Add the ``outcome`` attribute: ``"finished"`` if the job's process ran, or ``"expired"`` if the job expired
+       before it started, in which case the start and end times are the time at which it was removed.
+    """
+
+    def __init__(self, project, spider, job=None, start_time=None, end_time=None, outcome="finished"):
         self.project = project
         self.spider = spider
         self.job = job
         self.start_time = start_time if start_time else datetime.datetime.now()
         self.end_time = end_time if end_time else datetime.datetime.now()
+        self.outcome = outcome
 
     # For equality assertions in tests.
     def __eq__(self, other):
@@ -27,34 +35,90 @@ class Job:
             and self.job == other.job
             and self.start_time == other.start_time
             and self.end_time == other.end_time
+            and self.outcome == other.outcome
         )
 
     # For error messsages in tests.
     def __repr__(self):
+        outcome = "" if self.outcome == "finished" else f", outcome={self.outcome}"
         return (
             f"Job(project={self.project}, spider={self.spider}, job={self.job}, "
-            f"start_time={self.start_time}, end_time={self.end_time})"
+            f"start_time={self.start_time}, end_time={self.end_time}{outcome})"
         )
 
 
 @implementer(IJobStorage)
 class MemoryJobStorage:
     def __init__(self, config):
+        # [(number, job)], in order of addition. The number of a job is the number of jobs added before it, so that
+        # positions in list_page() don't change as jobs are added and removed.
         self.jobs = []
         self.finished_to_keep = config.getint("finished_to_keep", 100)
+        self.added = 0
 
     def add(self, job):
-        self.jobs.append(job)
-        del self.jobs[: -self.finished_to_keep]  # keep last x finished jobs
+        self.add_many([job])
+
+    def add_many(self, jobs):
+        self.jobs.extend(enumerate(jobs, self.added))
+        self.added += len(jobs)
+        if not self.finished_to_keep:
+            return
+        # Keep the last x jobs of each outcome, so that many expired jobs don't remove the jobs that ran.
+        excess = {
+            outcome: count - self.finished_to_keep
+            for outcome, count in Counter(_outcome(job) for _, job in self.jobs).items()
+            if count > self.finished_to_keep
+        }
+        if excess:
+            kept = []
+            for number, job in self.jobs:
+                if excess.get(_outcome(job), 0) > 0:
+                    excess[_outcome(job)] -= 1
+                else:
+                    kept.append((number, job))
+            self.jobs = kept
 
     def list(self):
         return list(self)
 
+    def count(self, outcome=None):
+        if outcome is None:
+            return len(self)
+        return sum(1 for _, job in self.jobs if _outcome(job) == outcome)
+
+    def get_job(self, job, project=None):
+        for finished in self:
+            if finished.job == job and (project is None or finished.project == project):
+                return finished
+        return None
+
+    def list_page(self, limit=None, after=None, project=None, spider=None, since=None, until=None, outcome=None):
+        # Jobs are listed in reverse order of addition, like __iter__. The position is the number of the last job.
+        page = []
+        position = self.added if after is None else after
+        for number, job in reversed(self.jobs):
+            if after is not None and number >= after:
+                continue
+            if (
+                (project is None or job.project == project)
+                and (spider is None or job.spider == spider)
+                and (since is None or job.end_time >= since)
+                and (until is None or job.end_time < until)
+                and (outcome is None or _outcome(job) == outcome)
+            ):
+                if limit is not None and len(page) == limit:
+                    return page, position
+                page.append(job)
+                position = number
+        return page, None
+
     def __len__(self):
         return len(self.jobs)
 
     def __iter__(self):
-        yield from reversed(self.jobs)
+        for _, job in reversed(self.jobs):
+            yield job
 
 
 @implementer(IJobStorage)
@@ -64,15 +128,74 @@ class SqliteJobStorage:
         self.finished_to_keep = config.getint("finished_to_keep", 100)
 
     def add(self, job):
-        self.jobs.add(job)
+        self.add_many([job])
+
+    def add_many(self, jobs):
+        self.jobs.add_many(jobs)
         self.jobs.clear(self.finished_to_keep)
 
     def list(self):
-        return list(self)
+        return [self._job(*row) for row in self.jobs]
+
+    def count(self, outcome=None):
+        return self.jobs.count(outcome)
+
+    def get_job(self, job, project=None):
+        row = self.jobs.get(job, project)
+        return None if row is None else self._job(*row)
+
+    def list_page(self, limit=None, after=None, project=None, spider=None, since=None, until=None, outcome=None):
+        rows, position = self.jobs.list_page(limit, after, project, spider, since, until, outcome)
+        return [self._job(*row) for row in rows], position
 
     def __len__(self):
         return len(self.jobs)
 
     def __iter__(self):
-        for project, spider, job, start_time, end_time in self.jobs:
-            yield Job(project=project, spider=spider, job=job, start_time=start_time, end_time=end_time)
+        for row in self.jobs:
+            yield self._job(*row)
+
+    def _job(self, project, spider, job, start_time, end_time, outcome):
+        return Job(project=project, spider=spider, job=job, start_time=start_time, end_time=end_time, outcome=outcome)
+
+
+@implementer(IJobStorage)
+class ThreadedSqliteJobStorage(SqliteJobStorage):
+    """
+    Like ``SqliteJobStorage``, but the ``add``, ``add_many``, ``list``, ``list_page``, ``count`` and ``get_job``
+    methods run SQL statements in a thread, instead of in the reactor thread, and return deferreds. ``len()`` and
+    iteration also run SQL statements in the thread, and block until they end.
+
+    .. versionadded:: 1.5.0
+    """
+
+    def add(self, job):
+        # SqliteJobStorage.add() calls self.add_many(), which would return a deferred in the thread.
+        return sqlite.defer_to_thread(super().add_many, [job])
+
+    def add_many(self, jobs):
+        return sqlite.defer_to_thread(super().add_many, jobs)
+
+    def list(self):
+        return sqlite.defer_to_thread(super().list)
+
+    def list_page(self, limit=None, after=None, project=None, spider=None, since=None, until=None, outcome=None):
+        return sqlite.defer_to_thread(super().list_page, limit, after, project, spider, since, until, outcome)
+
+    def count(self, outcome=None):
+        return sqlite.defer_to_thread(super().count, outcome)
+
+    def get_job(self, job, project=None):
+        return sqlite.defer_to_thread(super().get_job, job, project)
+
+    # The connection is used only by the SQLite thread.
+    def __len__(self):
+        return sqlite.call_in_thread(super().__len__)
+
+    def __iter__(self):
+        return iter(sqlite.call_in_thread(super().list))
+
+
+def _outcome(job):
+    # Jobs from custom job storage can lack the attribute.
+    return getattr(job, "outcome", "finished")
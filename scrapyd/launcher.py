@@ -1,14 +1,16 @@
 import datetime
 import multiprocessing
 import sys
+import time
 from itertools import chain
 
 from twisted.application.service import Service
-from twisted.internet import defer, error, protocol, reactor
+from twisted.internet import defer, error, protocol, reactor, task
 from twisted.logger import Logger
 
 from scrapyd import __version__
 from scrapyd.interfaces import IEnvironment, IJobStorage, IPoller
+from scrapyd.jobstorage import Job
 
 log = Logger()
 
@@ -28,6 +30,12 @@ def get_crawl_args(message):
 
 
 class Launcher(Service):
+    """
+    .. versionchanged:: 1.5.0
+       Every :ref:`poll_interval` seconds, remove expired pending jobs from the spider queues, and add them to job
+       storage, with an ``"expired"`` outcome.
+    """
+
     name = "launcher"
 
     def __init__(self, config, app):
@@ -36,10 +44,13 @@ class Launcher(Service):
         self.max_proc = self._get_max_proc(config)
         self.runner = config.get("runner", "scrapyd.runner")
         self.app = app
+        self.expire_interval = config.getfloat("poll_interval", 5)
+        self._expiry = task.LoopingCall(self.expire)
 
     def startService(self):
         for slot in range(self.max_proc):
             self._get_message(slot)
+        self._expiry.start(self.expire_interval, now=False)
         log.info(
             "Scrapyd {version} started: max_proc={max_proc!r}, runner={runner!r}",
             version=__version__,
@@ -48,12 +59,46 @@ class Launcher(Service):
             log_system="Launcher",
         )
 
+    def stopService(self):
+        if self._expiry.running:
+            self._expiry.stop()
+        return super().stopService()
+
+    @defer.inlineCallbacks
+    def expire(self):
+        """Remove expired pending jobs from the spider queues, and add them to job storage."""
+        queues = self.app.getComponent(IPoller).queues
+        for project in list(queues):
+            try:
+                messages = yield defer.maybeDeferred(queues[project].remove_expired)
+                if not messages:
+                    continue
+                now = datetime.datetime.now()
+                yield defer.maybeDeferred(
+                    self.finished.add_many,
+                    [Job(project, message["name"], message.get("_job"), now, now, "expired") for message in messages],
+                )
+            except Exception:  # noqa: BLE001 # the timer stops if the call fails
+                log.failure(
+                    "Failed to expire pending jobs: project={project!r}", project=project, log_system="Launcher"
+                )
+                continue
+            log.info(
+                "Expired {count} pending jobs: project={project!r} jobs={jobs!r}",
+                count=len(messages),
+                project=project,
+                jobs=[message.get("_job") for message in messages],
+                log_system="Launcher",
+            )
+
     def _get_message(self, slot):
         poller = self.app.getComponent(IPoller)
         poller.next().addCallback(self._spawn_process, slot)
 
     def _spawn_process(self, message, slot):
         project = message["_project"]
+        # The time at which the job was scheduled isn't a spider argument.
+        scheduled = message.pop("_scheduled", None)
         environ = self.app.getComponent(IEnvironment)
         message.setdefault("settings", {})
         message["settings"].update(environ.get_settings(message))
@@ -67,11 +112,27 @@ class Launcher(Service):
         reactor.spawnProcess(process, sys.executable, args=args, env=env)
         self.processes[slot] = process
 
+        if scheduled is not None:
+            process.latency = max(time.time() - scheduled, 0)
+            log.info(
+                "Process spawned {latency:.3f}s after scheduling: project={project!r} spider={spider!r} job={job!r}",
+                latency=process.latency,
+                project=process.project,
+                spider=process.spider,
+                job=process.job,
+                log_system="Launcher",
+            )
+
     def _process_finished(self, _, slot):
         process = self.processes.pop(slot)
         process.end_time = datetime.datetime.now()
-        self.finished.add(process)
+        # If job storage returns a deferred, the slot is re-registered without waiting for the job to be stored.
+        defer.maybeDeferred(self.finished.add, process).addErrback(
+            lambda failure: log.failure("Failed to store finished job", failure, log_system="Launcher")
+        )
         self._get_message(slot)
+        # Start a pending job in the freed slot now, instead of on the next poll interval.
+        self.app.getComponent(IPoller).poll()
 
     def _get_max_proc(self, config):
         max_proc = config.getint("max_proc", 0)
@@ -94,6 +155,8 @@ class ScrapyProcessProtocol(protocol.ProcessProtocol):
         self.job = job
         self.start_time = datetime.datetime.now()
         self.end_time = None
+        # The number of seconds between scheduling the job and spawning the process, if known.
+        self.latency = None
         self.env = env
         self.args = args
         self.deferred = defer.Deferred()
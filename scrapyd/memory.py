@@ -0,0 +1,455 @@
+import heapq
+import json
+import os
+import re
+import time
+from itertools import count
+
+from twisted.internet import reactor, threads
+from twisted.logger import Logger
+
+log = Logger()
+
+# json.dumps() creates an encoder on each call, if options are set.
+encode = json.JSONEncoder(separators=(",", ":")).encode
+
+# Queues that are shared by the instances with the same directory and name, by absolute path and name. Like shared
+# SQLite connections, so that, for example, the scheduler's and the poller's spider queues contain the same messages.
+queues = {}
+
+
+def initialize(config, name):
+    dbs_dir = config.get("dbs_dir", "dbs")
+    if dbs_dir == ":memory:":
+        directory = None
+    else:
+        if not os.path.exists(dbs_dir):
+            os.makedirs(dbs_dir)
+        directory = os.path.abspath(dbs_dir)
+
+    key = (directory, name)
+    if key not in queues:
+        queues[key] = JournaledPriorityQueue(directory, name, aging=config.getfloat("sqlite_priority_aging", 0))
+    return queues[key]
+
+
+class JournaledPriorityQueue:
+    """
+    In-memory priority queue, with the same methods as :class:`~scrapyd.sqlite.JsonSqlitePriorityQueue`.
+
+    Messages are stored in a heap, in descending rank and, within a rank, in insertion order. As in
+    :class:`~scrapyd.sqlite.JsonSqlitePriorityQueue`, if ``aging`` is set, a message's rank is its priority minus the
+    number of the ``aging``-second bucket in which it was due, and its effective priority increases by 1 every
+    ``aging`` seconds. Otherwise, its rank is its priority. If a message is a dict, it is indexed by its ``_job`` and
+    ``_dedupe`` keys. Messages that are removed, and items of messages whose priority is raised, remain in the heap
+    until they reach the top, or until the heap is rebuilt.
+
+    As in :meth:`~scrapyd.sqlite.JsonSqlitePriorityQueue.put_many`, a message with the same ``_dedupe`` key as a
+    message in the queue isn't added. Instead, the priority and ``_expires`` key of the message in the queue are
+    raised, if lower.
+
+    As in :class:`~scrapyd.sqlite.JsonSqlitePriorityQueue`, a message whose ``_not_before`` key is in the future is
+    delayed. It is stored in another heap, in ascending ``_not_before`` order, and is moved to the priority heap once
+    it is due. A message whose ``_expires`` key is in the past isn't popped, and is indexed in a third heap, in
+    ascending ``_expires`` order, for :meth:`remove_expired`.
+
+    If ``directory`` is set, changes are recorded in a journal file in that directory. Records are buffered in memory,
+    and at most ``sync_interval`` seconds after a change, they are appended to the journal as one line, which is
+    flushed and synced to disk. If the process or machine crashes, changes since the last sync are lost. Once the
+    journal has more than ``compact_records`` records, and more than twice as many records as messages, the messages
+    are written to a snapshot file in a thread, and a new journal is started. At initialization, the queue is rebuilt
+    from the snapshot and journals.
+
+    .. versionadded:: 1.5.0
+    """
+
+    sync_interval = 1.0
+    compact_records = 10000
+
+    def __init__(self, directory=None, name="queue", *, aging=0):
+        self.directory = directory
+        self.name = name
+        self.aging = aging
+
+        self.messages = {}  # {sequence number: (priority, message, time at which it was due)}
+        self.heap = []  # [(-rank, sequence number)]
+        self.jobs = {}  # {job: {sequence number: None}}, like an ordered set
+        self.dedupe = {}  # {dedupe key: sequence number}
+        self.delayed = []  # [(not before, sequence number)]
+        self.held = set()  # {sequence number}, of the messages in the delayed heap
+        self.expiring = []  # [(expires, sequence number)]
+        self.sequence = count()
+
+        self.generation = 0
+        self.journal = None
+        self.buffer = []  # records that aren't written to the journal
+        self.records = 0
+        self.compacting = None
+        self._sync_call = None
+
+        if directory is not None:
+            self._recover()
+            reactor.addSystemEventTrigger("before", "shutdown", self.sync)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def put(self, message, priority=0.0):
+        return self.put_many([(message, priority)])[0]
+
+    def put_many(self, messages):
+        now = time.time()
+        jobs = []
+        for message, priority in messages:
+            keys = _keys(message)
+            sequence = self.dedupe.get(keys.get("_dedupe"))
+            if sequence is not None:
+                current_priority, current_message, _ = self.messages[sequence]
+                expires = _later(_get(current_message, "_expires"), keys.get("_expires"))
+                if priority > current_priority or expires != _get(current_message, "_expires"):
+                    raised = max(priority, current_priority)
+                    self._raise(sequence, raised, expires)
+                    self._log(["^", sequence, raised, expires])
+                jobs.append(_get(self.messages[sequence][1], "_job"))
+                continue
+            sequence = next(self.sequence)
+            enqueued = max(now, keys.get("_not_before") or now)
+            self._insert(sequence, priority, message, enqueued)
+            self._log(["+", sequence, priority, message, enqueued])
+            jobs.append(keys.get("_job"))
+        return jobs
+
+    def next_priority(self):
+        self._release()
+        self._discard_removed()
+        return -self.heap[0][0] + self._bucket(time.time()) if self.heap else None
+
+    def next_due(self):
+        self._release()
+        while self.delayed and self.delayed[0][1] not in self.held:
+            heapq.heappop(self.delayed)
+        return self.delayed[0][0] if self.delayed else None
+
+    def remove_expired(self):
+        now = time.time()
+        sequences = []
+        while self.expiring and self.expiring[0][0] <= now:
+            expires, sequence = heapq.heappop(self.expiring)
+            # The item is outdated if the message is removed, or if its expiry is extended.
+            if sequence in self.messages and _get(self.messages[sequence][1], "_expires") == expires:
+                sequences.append(sequence)
+        return self._delete_many(sequences)
+
+    def pop(self, skip=None):
+        messages = self.pop_many(1, skip)
+        return messages[0] if messages else None
+
+    def pop_many(self, n, skip=None):
+        self._release()
+        now = time.time()
+        popped = []
+        skipped = []
+        while self.heap and len(popped) < n:
+            item = heapq.heappop(self.heap)
+            sequence = item[1]
+            # An expired message remains in the queue until remove_expired() is called.
+            if self._removed(item) or self._expired(sequence, now):
+                continue
+            if skip is not None and skip(*self._columns(self.messages[sequence][1])):
+                skipped.append(item)
+                continue
+            popped.append(sequence)
+
+        for item in skipped:
+            heapq.heappush(self.heap, item)
+
+        return self._delete_many(popped)
+
+    def remove(self, func):
+        return len(
+            self._delete_many([sequence for sequence, (_, message, _) in self.messages.items() if func(message)])
+        )
+
+    def remove_job(self, job):
+        return len(self._delete_many(list(self.jobs.get(job, ()))))
+
+    def get_job(self, job):
+        sequences = self.jobs.get(job)
+        return self.messages[next(iter(sequences))][1] if sequences else None
+
+    def clear(self):
+        self._clear()
+        self._log(["0"])
+
+    def list_page(self, limit=None, after=None, spider=None, since=None, until=None):
+        """Like :meth:`~scrapyd.sqlite.JsonSqlitePriorityQueue.list_page`, but without an index."""
+
+        def match(message):
+            scheduled = _get(message, "_scheduled")
+            return (
+                (spider is None or _get(message, "name") == spider)
+                and (since is None or (scheduled is not None and scheduled >= since))
+                and (until is None or (scheduled is not None and scheduled < until))
+            )
+
+        keys = (
+            key
+            for key in ((-self._rank(sequence), sequence) for sequence in self.messages)
+            if (after is None or key > tuple(after)) and match(self.messages[key[1]][1])
+        )
+        # One more message is selected, to know whether there are more messages.
+        keys = sorted(keys) if limit is None else heapq.nsmallest(limit + 1, keys)
+        if limit is not None and len(keys) > limit:
+            del keys[limit:]
+            position = list(keys[-1])
+        else:
+            position = None
+
+        return [self.messages[sequence][1] for _, sequence in keys], position
+
+    def __iter__(self):
+        return (
+            (self.messages[sequence][1], self.messages[sequence][0])
+            for _, sequence in sorted((-self._rank(sequence), sequence) for sequence in self.messages)
+        )
+
+    def sync(self):
+        """Write the buffered records to the journal, flush it and sync it to disk."""
+        if self._sync_call is not None:
+            if self._sync_call.active():
+                self._sync_call.cancel()
+            self._sync_call = None
+        if self.buffer:
+            if self.journal is None:
+                self.journal = open(self._journal_path(self.generation), "a", encoding="utf-8")  # noqa: SIM115
+            # The records are encoded together, as one line, which is faster than encoding each record as it's logged.
+            self.journal.write(encode(self.buffer) + "\n")
+            self.buffer.clear()
+        if self.journal is not None:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """
+        Start a new journal, and write the messages to a snapshot in a thread. Return a deferred that fires once the
+        snapshot is written and the previous journals are removed.
+        """
+        self.sync()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.generation += 1
+        self.records = 0
+
+        generation = self.generation
+        # The messages aren't changed after they are added, so they can be serialized in another thread, and buffered
+        # records can be encoded later.
+        self.compacting = threads.deferToThread(self._write_snapshot, generation, list(self.messages.items()))
+        self.compacting.addCallback(lambda _: self._remove_journals(generation))
+        self.compacting.addErrback(lambda failure: log.failure("Failed to compact the journal", failure))
+        self.compacting.addBoth(self._compacted)
+        return self.compacting
+
+    def _compacted(self, result):
+        self.compacting = None
+        return result
+
+    def _columns(self, message):
+        if isinstance(message, dict):
+            return message.get("name"), message.get("_max_proc")
+        return None, None
+
+    def _bucket(self, timestamp):
+        # Like JsonSqlitePriorityQueue._bucket().
+        return int(timestamp / self.aging) if self.aging else 0
+
+    def _rank(self, sequence):
+        priority, _, enqueued = self.messages[sequence]
+        return priority - self._bucket(enqueued)
+
+    def _insert(self, sequence, priority, message, enqueued):
+        self.messages[sequence] = (priority, message, enqueued)
+        keys = _keys(message)
+        not_before = keys.get("_not_before")
+        if not_before is not None and not_before > time.time():
+            heapq.heappush(self.delayed, (not_before, sequence))
+            self.held.add(sequence)
+        else:
+            heapq.heappush(self.heap, (self._bucket(enqueued) - priority, sequence))
+        if (job := keys.get("_job")) is not None:
+            self.jobs.setdefault(job, {})[sequence] = None
+        if (key := keys.get("_dedupe")) is not None:
+            self.dedupe[key] = sequence
+        if (expires := keys.get("_expires")) is not None:
+            heapq.heappush(self.expiring, (expires, sequence))
+
+    def _raise(self, sequence, priority, expires=None):
+        # The message's previous heap item is discarded when it reaches the top. See _removed().
+        current, message, enqueued = self.messages[sequence]
+        if expires != _get(message, "_expires"):
+            # The message is copied, instead of changed, in case a snapshot is being written in another thread.
+            message = {**message, "_expires": expires}
+            heapq.heappush(self.expiring, (expires, sequence))
+        self.messages[sequence] = (priority, message, enqueued)
+        # A delayed message is added to the priority heap, with its rank at that time, once it is due.
+        if priority != current and sequence not in self.held:
+            heapq.heappush(self.heap, (-self._rank(sequence), sequence))
+
+    def _release(self):
+        # Move the delayed messages that are due to the priority heap.
+        now = time.time()
+        while self.delayed and self.delayed[0][0] <= now:
+            sequence = heapq.heappop(self.delayed)[1]
+            if sequence in self.held:
+                self.held.remove(sequence)
+                heapq.heappush(self.heap, (-self._rank(sequence), sequence))
+
+    def _delete(self, sequence):
+        _, message, _ = self.messages.pop(sequence)
+        self.held.discard(sequence)
+        if (job := _get(message, "_job")) is not None:
+            sequences = self.jobs[job]
+            del sequences[sequence]
+            if not sequences:
+                del self.jobs[job]
+        if (key := _get(message, "_dedupe")) is not None:
+            del self.dedupe[key]
+        return message
+
+    def _delete_many(self, sequences):
+        messages = [self._delete(sequence) for sequence in sequences]
+        if sequences:
+            self._log(["-", *sequences])
+        # Rebuild the heap if most of its items are removed messages.
+        if len(self.heap) > 2 * len(self.messages) + 64:
+            self.heap = [(-self._rank(sequence), sequence) for sequence in self.messages if sequence not in self.held]
+            heapq.heapify(self.heap)
+        if len(self.expiring) > 2 * len(self.messages) + 64:
+            self.expiring = [
+                (expires, sequence)
+                for sequence, (_, message, _) in self.messages.items()
+                if (expires := _get(message, "_expires")) is not None
+            ]
+            heapq.heapify(self.expiring)
+        return messages
+
+    def _clear(self):
+        self.messages.clear()
+        self.heap.clear()
+        self.jobs.clear()
+        self.dedupe.clear()
+        self.delayed.clear()
+        self.held.clear()
+        self.expiring.clear()
+
+    def _removed(self, item):
+        # An item is outdated if its message is removed, or if its message's priority is raised.
+        rank, sequence = item
+        return sequence not in self.messages or self._rank(sequence) != -rank
+
+    def _expired(self, sequence, now):
+        expires = _get(self.messages[sequence][1], "_expires")
+        return expires is not None and expires <= now
+
+    def _discard_removed(self):
+        now = time.time()
+        while self.heap and (self._removed(self.heap[0]) or self._expired(self.heap[0][1], now)):
+            heapq.heappop(self.heap)
+
+    def _replay(self, record):
+        if record[0] == "+":
+            self._insert(*record[1:])
+        elif record[0] == "-":
+            for sequence in record[1:]:
+                if sequence in self.messages:
+                    self._delete(sequence)
+        elif record[0] == "^":
+            if record[1] in self.messages:
+                self._raise(*record[1:])
+        elif record[0] == "0":
+            self._clear()
+
+    def _log(self, record):
+        if self.directory is None:
+            return
+
+        self.buffer.append(record)
+        self.records += 1
+
+        if self._sync_call is None:
+            self._sync_call = reactor.callLater(self.sync_interval, self.sync)
+        if self.compacting is None and self.records > max(self.compact_records, 2 * len(self.messages)):
+            self.compact()
+
+    def _recover(self):
+        generation = 0
+        snapshot_path = self._snapshot_path()
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, encoding="utf-8") as f:
+                generation = json.loads(f.readline())[0]
+                for line in f:
+                    self._insert(*json.loads(line))
+
+        journals = sorted(number for number in self._journals() if number >= generation)
+        for number in journals:
+            with open(self._journal_path(number), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records = json.loads(line)
+                    except ValueError:
+                        break  # the process crashed while writing the records
+                    for record in records:
+                        self._replay(record)
+
+        self.sequence = count(max(self.messages, default=-1) + 1)
+
+        # Write a snapshot, so that new records aren't appended after a partial record, and so that the journals can be
+        # removed. Sequence numbers of removed messages can then be reused.
+        if journals:
+            self.generation = journals[-1] + 1
+            self._write_snapshot(self.generation, list(self.messages.items()))
+        else:
+            self.generation = generation
+        # Journals can remain if the process crashed after writing a snapshot.
+        self._remove_journals(self.generation)
+
+    def _write_snapshot(self, generation, messages):
+        path = self._snapshot_path()
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(f"[{generation}]\n")
+            for sequence, (priority, message, enqueued) in messages:
+                f.write(encode([sequence, priority, message, enqueued]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # The snapshot replaces the previous snapshot only once it is complete.
+        os.replace(f"{path}.tmp", path)
+
+    def _remove_journals(self, generation):
+        for number in self._journals():
+            if number < generation:
+                os.remove(self._journal_path(number))
+
+    def _journals(self):
+        pattern = re.compile(rf"{re.escape(self.name)}\.journal\.(\d+)")
+        return [int(match[1]) for filename in os.listdir(self.directory) if (match := pattern.fullmatch(filename))]
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, f"{self.name}.snapshot")
+
+    def _journal_path(self, generation):
+        return os.path.join(self.directory, f"{self.name}.journal.{generation}")
+
+
+def _get(message, key):
+    return message.get(key) if isinstance(message, dict) else None
+
+
+def _keys(message):
+    # A message that isn't a dict has no keys. Faster than calling _get() for each key.
+    return message if isinstance(message, dict) else {}
+
+
+def _later(expires, other):
+    # Like ifnull(max(expires, other), expires) in SQLite. A message without an expiry doesn't expire, and an expiry
+    # isn't removed by a duplicate without an expiry.
+    return expires if expires is None or other is None else max(expires, other)
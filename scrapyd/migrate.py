@@ -0,0 +1,36 @@
+import argparse
+
+from scrapyd.config import Config
+from scrapyd.spiderqueue import import_spider_queues, reencode_spider_queues
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m scrapyd.migrate",
+        description="Move pending jobs to the SharedSqliteSpiderQueue database. Scrapyd must not be running.",
+    )
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        help="encode pending jobs with the codec of the sqlite_codec setting, instead of moving pending jobs to the "
+        "SharedSqliteSpiderQueue database",
+    )
+    parser.add_argument(
+        "--unpickle",
+        action="store_true",
+        help="with --reencode, decode pending jobs that are encoded with pickle, even if the sqlite_codec setting "
+        "isn't pickle. Decoding a pickle can run arbitrary code: use only if the database is trusted",
+    )
+    args = parser.parse_args()
+
+    config = Config()
+    if args.reencode:
+        for project, count in reencode_spider_queues(config, unpickle=args.unpickle).items():
+            print(f"{project}: {count} pending jobs encoded")
+    else:
+        for project, count in import_spider_queues(config).items():
+            print(f"{project}: {count} pending jobs moved")
+
+
+if __name__ == "__main__":
+    main()
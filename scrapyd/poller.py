@@ -1,31 +1,300 @@
-from twisted.internet.defer import DeferredQueue, inlineCallbacks, maybeDeferred
+import heapq
+import math
+import time
+from collections import Counter
+from itertools import count
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredQueue, inlineCallbacks, maybeDeferred, succeed
 from zope.interface import implementer
 
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.interfaces import IPoller
 from scrapyd.utils import get_spider_queues
 
+DISPATCH_POLICIES = ("project", "priority", "fair")
+
 
 @implementer(IPoller)
 class QueuePoller:
+    """
+    .. versionchanged:: 1.5.0
+       Add the ``processes`` attribute. The default :ref:`application` sets it to the launcher's running processes, by
+       slot. Some dispatch policies and the per-project and per-spider ``max_proc`` limits use it.
+
+       Add the ``active`` attribute: the projects to which jobs were added since the last poll. The default
+       :ref:`application` sets it to the scheduler's ``active`` attribute, to which the scheduler adds the projects to
+       which it adds jobs. A poll moves these projects to the ``ready`` attribute: the projects whose spider queues
+       might have pending jobs. A poll visits only the ready projects, and removes the projects without pending jobs.
+       Jobs can be added by other means, like another Scrapyd instance, so all projects are made ready once every
+       :ref:`poll_rescan_interval`.
+
+       With the ``priority`` :ref:`dispatch_policy`, the heap of each project's next priority is kept across polls.
+       A poll queries the next priority of the projects to which jobs were added, and of the projects whose jobs it
+       pops, instead of every ready project. The heap is rebuilt when all projects are made ready.
+
+       Add the ``due`` attribute: the time at which the next delayed job is due, by project, for the projects whose
+       pending jobs are all delayed. The poller polls at the earliest time, instead of waiting for the timer.
+    """
+
     def __init__(self, config):
         self.config = config
+        self.dispatch_policy = config.get("dispatch_policy", "project")
+        if self.dispatch_policy not in DISPATCH_POLICIES:
+            raise InvalidOptionError("dispatch_policy", self.dispatch_policy, DISPATCH_POLICIES)
+        # ConfigParser lowercases option names, so project and spider names are compared in lowercase.
+        self.weights = {project: float(weight) for project, weight in config.items("project_weights", default=[])}
+        self.project_max_proc = {
+            project: int(value) for project, value in config.items("project_max_proc", default=[])
+        }
+        self.spider_max_proc = {spider: int(value) for spider, value in config.items("spider_max_proc", default=[])}
+        self.processes = {}
+        self.rescan_interval = config.getfloat("poll_rescan_interval", 60)
+        self.active = set()
+        self.ready = set()
+        self.due = {}
+        # For the "priority" policy. See _poll_priority().
+        self.aging = config.getfloat("sqlite_priority_aging", 0)
+        self.heap = []
+        self.entries = {}
+        self._sequence = count()
+        self.wakeup = None
+        self._rescanned = None
+        self._polling = False
+        self._repoll = False
         self.update_projects()
         self.dq = DeferredQueue()
 
-    @inlineCallbacks
     def poll(self):
-        for project, queue in self.queues.items():
-            while (yield maybeDeferred(queue.count)):
-                # If the "waiting" backlog is empty (that is, if the maximum number of Scrapy processes are running):
-                if not self.dq.waiting:
-                    return
-                message = (yield maybeDeferred(queue.pop)).copy()
-                # The message can be None if, for example, two Scrapyd instances share a spider queue database.
-                if message is not None:
-                    message["_project"] = project
-                    message["_spider"] = message.pop("name")
-                    # Pop a dummy item from the "waiting" backlog. and fire the message's callbacks.
-                    self.dq.put(message)
+        # Polling is triggered by events (like scheduling a job), as well as by a timer. If the maximum number of
+        # Scrapy processes are running, there's nothing to do.
+        if not self.dq.waiting:
+            return succeed(None)
+        # If spider queues return deferreds, a poll can be requested while another is in progress. Polls don't overlap,
+        # so that limits are counted correctly. Instead, the requested poll runs after the poll in progress.
+        if self._polling:
+            self._repoll = True
+            return succeed(None)
+
+        self._polling = True
+        if self.dispatch_policy == "priority":
+            deferred = self._poll_priority()
+        elif self.dispatch_policy == "fair":
+            deferred = self._poll_fair()
+        else:
+            deferred = self._poll_project()
+        return deferred.addBoth(self._polled)
+
+    def _polled(self, result):
+        self._polling = False
+        if self._repoll:
+            self._repoll = False
+            self.poll()
+        return result
+
+    def _rescan(self):
+        # Return whether to make all projects ready, in case jobs were added by other means.
+        now = time.monotonic()
+        if self._rescanned is None or now - self._rescanned >= self.rescan_interval:
+            self._rescanned = now
+            return True
+        return False
+
+    def _active_projects(self):
+        if self._rescan():
+            self.ready.update(self.queues)
+        self.ready.update(self.active)
+        self.active.clear()
+        # The projects are visited in the order of the queues, so that the "project" policy's order doesn't change.
+        return [project for project in self.queues if project in self.ready]
+
+    @inlineCallbacks
+    def _next_priority(self, project):
+        # If a job is added to the project while the query is in progress (if the spider queue returns deferreds), the
+        # project is in the active set, and is made ready again by the next poll.
+        priority = yield maybeDeferred(self.queues[project].next_priority)
+        if priority is not None:
+            self.ready.add(project)
+            return priority
+        self.ready.discard(project)
+        # If the project has no jobs to pop, it might have delayed jobs.
+        if (due := (yield maybeDeferred(self.queues[project].next_due))) is not None:
+            self.due[project] = due
+            self._set_wakeup()
+        return priority
+
+    def _set_wakeup(self):
+        if self.wakeup is not None and self.wakeup.active():
+            self.wakeup.cancel()
+        self.wakeup = None
+        if self.due:
+            self.wakeup = reactor.callLater(max(min(self.due.values()) - time.time(), 0), self._wake)
+
+    def _wake(self):
+        # Activate the projects whose delayed jobs are due, and poll.
+        self.wakeup = None
+        now = time.time()
+        for project, due in list(self.due.items()):
+            if due <= now:
+                del self.due[project]
+                self.active.add(project)
+        self._set_wakeup()
+        self.poll()
+
+    @inlineCallbacks
+    def _poll_project(self):
+        running = self._running()
+        for project in self._active_projects():
+            queue = self.queues[project]
+            # If the "waiting" backlog is empty (that is, if the maximum number of Scrapy processes are running):
+            if not self.dq.waiting:
+                return
+            if self._project_blocked(project, running):
+                continue
+            # Fill as many free slots as possible from this project, in one operation. Fewer messages are returned if
+            # the queue has fewer pending jobs that aren't blocked.
+            n = len(self.dq.waiting)
+            messages = yield maybeDeferred(queue.pop_many, n, self._skip(project, running))
+            for message in messages:
+                self._dispatch(project, message)
+            if len(messages) < n:
+                yield self._next_priority(project)
+
+    @inlineCallbacks
+    def _poll_priority(self):
+        # A heap of each project's next priority, which is kept across polls. The next priority is queried only for the
+        # projects to which jobs were added and for the projects whose messages are popped, except when all projects
+        # are made ready, in which case the heap is rebuilt. Among projects with the same priority, the sequence number
+        # takes turns.
+        running = self._running()
+        if self._rescan():
+            self.heap = []
+            self.entries = {}
+            projects = list(self.queues)
+        else:
+            projects = [project for project in self.queues if project in self.active]
+        self.active.clear()
+        for project in projects:
+            if (entry := (yield self._entry(project))) is not None:
+                heapq.heappush(self.heap, entry)
+
+        # The entries of projects that are blocked in this poll, which are pushed back after.
+        held = []
+        while self.heap and self.dq.waiting:
+            entry = heapq.heappop(self.heap)
+            project = entry[2]
+            # A project's entry is replaced by pushing a new entry. The replaced entry is skipped.
+            if self.entries.get(project) != entry[1]:
+                continue
+            if project not in self.queues:
+                del self.entries[project]
+                continue
+            if self._project_blocked(project, running):
+                held.append(entry)
+                continue
+            message = yield maybeDeferred(self.queues[project].pop, self._skip(project, running))
+            # The message can be None if all pending jobs are blocked or if, for example, two Scrapyd instances share
+            # a spider queue database.
+            if message is not None:
+                self._dispatch(project, message)
+            if (entry := (yield self._entry(project))) is not None:
+                if message is None or self._project_blocked(project, running):
+                    held.append(entry)
+                else:
+                    heapq.heappush(self.heap, entry)
+
+        for entry in held:
+            heapq.heappush(self.heap, entry)
+
+    @inlineCallbacks
+    def _entry(self, project):
+        # Return the project's heap entry, or None if it has no messages to pop. An effective priority increases with
+        # time if sqlite_priority_aging is set, by the same amount for every message. So that entries that are pushed
+        # at different times can be compared, the entry has the priority minus the number of aging intervals since the
+        # epoch, like the rank column of JsonSqlitePriorityQueue.
+        self.entries.pop(project, None)
+        priority = yield self._next_priority(project)
+        if priority is None:
+            return None
+        if self.aging:
+            priority -= int(time.time() / self.aging)
+        sequence = self.entries[project] = next(self._sequence)
+        return (-priority, sequence, project)
+
+    @inlineCallbacks
+    def _poll_fair(self):
+        # Each free slot goes to the project with pending jobs that has the fewest running jobs relative to its weight
+        # (like the D'Hondt method), so that, over time, each project occupies a share of slots in proportion to its
+        # weight. Among projects with the same share, the sequence number takes turns.
+        running = self._running()
+        heap = []
+        sequence = count()
+        for project in self._active_projects():
+            if self._project_blocked(project, running):
+                continue
+            if (yield self._next_priority(project)) is not None:
+                heapq.heappush(heap, (self._share(project, running[project] + 1), next(sequence), project))
+
+        while heap and self.dq.waiting:
+            _, _, project = heapq.heappop(heap)
+            queue = self.queues[project]
+            message = yield maybeDeferred(queue.pop, self._skip(project, running))
+            # The message can be None if all pending jobs are blocked or if, for example, two Scrapyd instances share
+            # a spider queue database.
+            if message is None:
+                continue
+            self._dispatch(project, message)
+            if self._project_blocked(project, running):
+                continue
+            if (yield self._next_priority(project)) is not None:
+                heapq.heappush(heap, (self._share(project, running[project] + 1), next(sequence), project))
+
+    def _share(self, project, running):
+        weight = self.weights.get(project.lower(), 1.0)
+        # A project with a weight of 0 runs jobs only if no other project has pending jobs.
+        return running / weight if weight > 0 else math.inf
+
+    def _running(self):
+        # The number of running jobs, by project and by (project, spider).
+        running = Counter()
+        for process in self.processes.values():
+            running[process.project] += 1
+            running[(process.project, process.spider)] += 1
+        return running
+
+    def _project_blocked(self, project, running):
+        max_proc = self.project_max_proc.get(project.lower())
+        return max_proc is not None and running[project] >= max_proc
+
+    def _skip(self, project, running):
+        # Return a function for the skip parameter of ISpiderQueue.pop and ISpiderQueue.pop_many. A message that isn't
+        # skipped is popped, so it is counted as running, in order for limits to apply within one pop_many call.
+        def skip(spider, max_proc):
+            if self._project_blocked(project, running):
+                return True
+            # The lower of the configured limit and the job's limit applies.
+            limits = [limit for limit in (self.spider_max_proc.get(f"{project}.{spider}".lower()), max_proc) if limit]
+            if limits and running[(project, spider)] >= min(limits):
+                return True
+            running[project] += 1
+            running[(project, spider)] += 1
+            return False
+
+        return skip
+
+    def _dispatch(self, project, message):
+        message = message.copy()
+        message.pop("_max_proc", None)
+        message.pop("_dedupe", None)
+        message.pop("_expires", None)
+        not_before = message.pop("_not_before", None)
+        # The launcher logs the time between scheduling and starting a job. For a delayed job, it's from when it's due.
+        if not_before is not None and message.get("_scheduled") is not None:
+            message["_scheduled"] = max(message["_scheduled"], not_before)
+        message["_project"] = project
+        message["_spider"] = message.pop("name")
+        # Pop a dummy item from the "waiting" backlog. and fire the message's callbacks.
+        self.dq.put(message)
 
     def next(self):
         """
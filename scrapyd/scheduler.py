@@ -1,20 +1,90 @@
+import hashlib
+import json
+import time
+
+from twisted.internet.defer import maybeDeferred
 from zope.interface import implementer
 
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.interfaces import ISpiderScheduler
 from scrapyd.utils import get_spider_queues
 
+DEDUPE_POLICIES = ("off", "spider_args")
+# The spider arguments that don't distinguish a job from another job, under the "spider_args" policy.
+DEDUPE_IGNORED = ("_job", "_max_proc", "_scheduled", "_not_before", "_expires")
+
 
 @implementer(ISpiderScheduler)
 class SpiderScheduler:
+    """
+    .. versionchanged:: 1.5.0
+       Add the ``poller`` attribute. If set (as by the default :ref:`application`), the poller is polled after jobs are
+       scheduled, so that the jobs start immediately if there's capacity. The time at which a job was scheduled is
+       added to its message, in the ``_scheduled`` key. The ``schedule`` and ``schedule_many`` methods return a
+       deferred that fires once the jobs are added to the spider queue.
+
+       Add the ``active`` attribute: the projects to which jobs are added. The default :ref:`application` shares it
+       with the poller, so that the poller polls only projects that might have pending jobs.
+
+       If a project's policy in the ``[project_dedupe]`` section is ``spider_args``, and the ``_dedupe`` spider
+       argument isn't set, it is set to a hash of the spider name and spider arguments (including the ``_version`` and
+       ``settings`` arguments), so that a job isn't scheduled if the same job is pending. The ``schedule`` and
+       ``schedule_many`` methods return the job IDs of the pending jobs.
+
+       If a project has a default in the ``[project_expires_after]`` section, and the ``_expires`` spider argument
+       isn't set, it is set to that number of seconds after the job is due.
+    """
+
     def __init__(self, config):
         self.config = config
+        self.poller = None
+        self.active = set()
+        self.dedupe = {project: policy.lower() for project, policy in config.items("project_dedupe", default=[])}
+        for project, policy in self.dedupe.items():
+            if policy not in DEDUPE_POLICIES:
+                raise InvalidOptionError(f"project_dedupe.{project}", policy, DEDUPE_POLICIES)
+        self.expires_after = {
+            project: float(seconds) for project, seconds in config.items("project_expires_after", default=[])
+        }
         self.update_projects()
 
     def schedule(self, project, spider_name, priority=0.0, **spider_args):
-        self.queues[project].add(spider_name, priority=priority, **spider_args)
+        return maybeDeferred(
+            self.queues[project].add,
+            spider_name,
+            priority=priority,
+            **self._spider_args(project, spider_name, spider_args, time.time()),
+        ).addCallback(self._poll, project)
+
+    def schedule_many(self, project, spiders):
+        now = time.time()
+        return maybeDeferred(
+            self.queues[project].add_many,
+            [
+                (spider_name, priority, self._spider_args(project, spider_name, spider_args, now))
+                for spider_name, priority, spider_args in spiders
+            ],
+        ).addCallback(self._poll, project)
 
     def list_projects(self):
         return list(self.queues)
 
     def update_projects(self):
         self.queues = get_spider_queues(self.config)
+
+    def _spider_args(self, project, spider_name, spider_args, now):
+        # The time at which the job was scheduled is the server's, not the caller's.
+        spider_args = {**spider_args, "_scheduled": now}
+        expires_after = self.expires_after.get(project.lower())
+        if "_expires" not in spider_args and expires_after is not None:
+            spider_args["_expires"] = spider_args.get("_not_before", now) + expires_after
+        if "_dedupe" not in spider_args and self.dedupe.get(project.lower(), "off") != "off":
+            key = [spider_name, {key: value for key, value in spider_args.items() if key not in DEDUPE_IGNORED}]
+            spider_args["_dedupe"] = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return spider_args
+
+    def _poll(self, result, project):
+        self.active.add(project)
+        if self.poller is not None:
+            self.poller.poll()
+        return result
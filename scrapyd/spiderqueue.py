@@ -1,21 +1,43 @@
+import os
+
 from zope.interface import implementer
 
-from scrapyd import sqlite
+from scrapyd import memory, sqlite
 from scrapyd.interfaces import ISpiderQueue
+from scrapyd.utils import get_project_list, get_spider_queues
+
+SHARED_DATABASE = "spiderqueue"
 
 
 @implementer(ISpiderQueue)
 class SqliteSpiderQueue:
     def __init__(self, config, project, table="spider_queue"):
-        self.q = sqlite.initialize(sqlite.JsonSqlitePriorityQueue, config, project, table)
+        self.q = sqlite.initialize(
+            sqlite.JsonSqlitePriorityQueue, config, project, table, aging=config.getfloat("sqlite_priority_aging", 0)
+        )
 
     def add(self, name, priority=0.0, **spider_args):
         message = spider_args.copy()
         message["name"] = name
-        self.q.put(message, priority=priority)
+        return self.q.put(message, priority=priority)
+
+    def add_many(self, spiders):
+        return self.q.put_many(({**spider_args, "name": name}, priority) for name, priority, spider_args in spiders)
+
+    def pop(self, skip=None):
+        return self.q.pop(skip)
+
+    def pop_many(self, n, skip=None):
+        return self.q.pop_many(n, skip)
+
+    def next_priority(self):
+        return self.q.next_priority()
+
+    def next_due(self):
+        return self.q.next_due()
 
-    def pop(self):
-        return self.q.pop()
+    def remove_expired(self):
+        return self.q.remove_expired()
 
     def count(self):
         return len(self.q)
@@ -23,8 +45,144 @@ class SqliteSpiderQueue:
     def list(self):
         return [message for message, _ in self.q]
 
+    def list_page(self, limit=None, after=None, spider=None, since=None, until=None):
+        return self.q.list_page(limit, after, spider, since, until)
+
     def remove(self, func):
         return self.q.remove(func)
 
+    def remove_job(self, job):
+        return self.q.remove_job(job)
+
+    def get_job(self, job):
+        return self.q.get_job(job)
+
     def clear(self):
         self.q.clear()
+
+
+@implementer(ISpiderQueue)
+class SharedSqliteSpiderQueue(SqliteSpiderQueue):
+    """
+    Like ``SqliteSpiderQueue``, but the spider queues of all projects are stored in one SQLite database, and share one
+    connection.
+
+    .. versionadded:: 1.5.0
+    """
+
+    def __init__(self, config, project, table="spider_queue"):
+        self.q = sqlite.initialize(
+            sqlite.JsonSqlitePriorityQueue,
+            config,
+            SHARED_DATABASE,
+            table,
+            project=project,
+            shared=True,
+            aging=config.getfloat("sqlite_priority_aging", 0),
+        )
+
+
+@implementer(ISpiderQueue)
+class ThreadedSqliteSpiderQueue(SqliteSpiderQueue):
+    """
+    Like ``SqliteSpiderQueue``, but SQL statements run in a thread, instead of in the reactor thread, and all methods
+    return deferreds. A slow disk then delays only the jobs, instead of every request and process.
+
+    .. versionadded:: 1.5.0
+    """
+
+    def add(self, name, priority=0.0, **spider_args):
+        return sqlite.defer_to_thread(super().add, name, priority=priority, **spider_args)
+
+    def add_many(self, spiders):
+        return sqlite.defer_to_thread(super().add_many, spiders)
+
+    def pop(self, skip=None):
+        return sqlite.defer_to_thread(super().pop, skip)
+
+    def pop_many(self, n, skip=None):
+        return sqlite.defer_to_thread(super().pop_many, n, skip)
+
+    def next_priority(self):
+        return sqlite.defer_to_thread(super().next_priority)
+
+    def next_due(self):
+        return sqlite.defer_to_thread(super().next_due)
+
+    def remove_expired(self):
+        return sqlite.defer_to_thread(super().remove_expired)
+
+    def count(self):
+        return sqlite.defer_to_thread(super().count)
+
+    def list(self):
+        return sqlite.defer_to_thread(super().list)
+
+    def list_page(self, limit=None, after=None, spider=None, since=None, until=None):
+        return sqlite.defer_to_thread(super().list_page, limit, after, spider, since, until)
+
+    def remove(self, func):
+        return sqlite.defer_to_thread(super().remove, func)
+
+    def remove_job(self, job):
+        return sqlite.defer_to_thread(super().remove_job, job)
+
+    def get_job(self, job):
+        return sqlite.defer_to_thread(super().get_job, job)
+
+    def clear(self):
+        return sqlite.defer_to_thread(super().clear)
+
+
+@implementer(ISpiderQueue)
+class MemorySpiderQueue(SqliteSpiderQueue):
+    """
+    Like ``SqliteSpiderQueue``, but pending jobs are stored in memory, and changes are written to a journal in the
+    :ref:`dbs_dir` directory, which is synced to disk every second. If the process or machine crashes, the pending jobs
+    that were scheduled or removed in the last second are lost. Priorities age as in ``SqliteSpiderQueue``.
+
+    .. versionadded:: 1.5.0
+    """
+
+    def __init__(self, config, project):
+        self.q = memory.initialize(config, project)
+
+
+def import_spider_queues(config, table="spider_queue"):
+    """
+    Move the pending jobs in the databases of ``SqliteSpiderQueue`` to the database of ``SharedSqliteSpiderQueue``,
+    and return the number of moved jobs, by project. Scrapyd must not be running.
+
+    Each project's jobs are moved in one transaction, with their priorities and the times from which they age. If the
+    import is interrupted, run it again: jobs that were already moved aren't moved twice.
+
+    .. versionadded:: 1.5.0
+    """
+    dbs_dir = config.get("dbs_dir", "dbs")
+    moved = {}
+    for project in get_project_list(config):
+        database = os.path.join(dbs_dir, f"{project}.db")
+        if not os.path.exists(database):
+            continue
+
+        # Add the columns that earlier versions lack to the source database.
+        SqliteSpiderQueue(config, project, table).q.conn.close()
+        # If the project is named like the shared database, its jobs are the rows without a project in that database,
+        # and are renamed to the project.
+        moved[project] = SharedSqliteSpiderQueue(config, project, table).q.move_from(database)
+    return moved
+
+
+def reencode_spider_queues(config, *, unpickle=False):
+    """
+    Encode the pending jobs in SQLite spider queues with the codec of the :ref:`sqlite_codec` setting, and return the
+    number of encoded jobs, by project. If ``unpickle`` is true, jobs that are encoded with pickle are decoded, even if
+    the setting isn't ``pickle``.
+
+    .. versionadded:: 1.5.0
+    """
+    return {
+        project: queue.q.reencode(unpickle=unpickle)
+        for project, queue in get_spider_queues(config).items()
+        if isinstance(getattr(queue, "q", None), sqlite.JsonSqlitePriorityQueue)
+    }
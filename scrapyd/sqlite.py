@@ -1,13 +1,146 @@
+import functools
 import json
 import os
+import pickle
 import sqlite3
+import threading
+import time
 from datetime import datetime
+from itertools import islice
 
+from twisted.internet import reactor, threads
+from twisted.logger import Logger
+from twisted.python.threadpool import ThreadPool
 
-# The database argument is "jobs" (in SqliteJobStorage), or a project (in SqliteSpiderQueue) from get_spider_queues(),
-# which gets projects from get_project_list(), which gets projects from egg storage. We check for directory traversal
-# in egg storage, instead.
-def initialize(cls, config, database, table):
+from scrapyd.exceptions import InvalidMessageError, InvalidOptionError, UntrustedCodecError
+
+log = Logger()
+
+PRAGMAS = {
+    "journal_mode": ("delete", "truncate", "persist", "memory", "wal", "off"),
+    "synchronous": ("off", "normal", "full", "extra"),
+}
+
+
+class JsonCodec:
+    """
+    Encode messages as JSON, escaping non-ASCII characters. Earlier versions encoded messages this way.
+
+    .. versionadded:: 1.5.0
+    """
+
+    # If false, messages are encoded whole, so that earlier versions can read them.
+    columns = False
+
+    def encode(self, obj):
+        return json.dumps(obj).encode("ascii")
+
+    def decode(self, data):
+        return json.loads(data.decode("ascii"))
+
+
+class PickleCodec:
+    """
+    Encode messages with :mod:`pickle` protocol 4, which is smaller and faster to decode than JSON. Unlike the format
+    of the :mod:`marshal` module, a pickle protocol doesn't change between Python versions. The databases in the
+    :ref:`dbs_dir` directory must be trusted. Messages are unpickled only by instances whose codec is this codec.
+
+    .. versionadded:: 1.5.0
+    """
+
+    # If true, the keys that are copied to columns are removed from the message before it's encoded.
+    columns = True
+    # The PROTO opcode and protocol number, with which protocol 4 pickles start. A JSON document starts with ASCII.
+    prefix = b"\x80\x04"
+
+    def encode(self, obj):
+        # Protocol 4 is readable by Python 3.4 and later.
+        return pickle.dumps(obj, 4)
+
+    def decode(self, data):
+        return pickle.loads(data)  # noqa: S301 # only if sqlite_codec is pickle. See SqliteMixin.decode().
+
+
+CODECS = {"json": JsonCodec(), "pickle": PickleCodec()}
+
+# The message keys that JsonSqlitePriorityQueue copies to the job, spider, max_proc, version, not_before, expires,
+# scheduled and dedupe columns. The dedupe key is last, for JsonSqlitePriorityQueue.put_many().
+COLUMNS = ("_job", "name", "_max_proc", "_version", "_not_before", "_expires", "_scheduled", "_dedupe")
+# The columns from which JsonSqlitePriorityQueue._decode() decodes a message.
+MESSAGE = "message, job, spider, max_proc, version, not_before, expires, scheduled, dedupe"
+# The condition on the not_before and expires columns of the messages that can be popped. The parameters are the
+# current time, twice.
+DUE = "(not_before IS NULL OR not_before <= ?) AND (expires IS NULL OR expires > ?)"
+# The rank of a message, like JsonSqlitePriorityQueue._bucket(). The parameter is the aging interval, or NULL.
+RANK = "priority - ifnull(CAST(enqueued / ? AS integer), 0)"
+# The columns that JsonSqlitePriorityQueue adds to tables created by earlier versions, and the indexes it drops.
+MIGRATED_COLUMNS = (
+    ("job", "text"),
+    ("spider", "text"),
+    ("project", "text"),
+    ("max_proc", "integer"),
+    ("version", "text"),
+    ("dedupe", "text"),
+    ("not_before", "real"),
+    ("expires", "real"),
+    ("enqueued", "real"),
+    ("rank", "real"),
+    ("scheduled", "real"),
+)
+DROPPED_INDEXES = ("priority_id", "job", "project_priority_id")
+
+# Connections that are shared by the instances with the same database, by absolute path. See SqliteMixin.
+connections = {}
+# Values that are cached by the instances with the same connection, by absolute path. See SqliteMixin.
+caches = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_threadpool():
+    # One thread runs the SQL statements of all threaded implementations, so that a connection is never used by two
+    # threads at once, and so that operations run in the order in which they are called.
+    threadpool = ThreadPool(minthreads=1, maxthreads=1, name="scrapyd.sqlite")
+    threadpool.start()
+    reactor.addSystemEventTrigger("during", "shutdown", threadpool.stop)
+    return threadpool
+
+
+def defer_to_thread(func, *args, **kwargs):
+    """
+    Call ``func`` in the SQLite thread, instead of in the reactor thread, and return a deferred that fires with its
+    return value.
+
+    .. versionadded:: 1.5.0
+    """
+    return threads.deferToThreadPool(reactor, get_threadpool(), func, *args, **kwargs)
+
+
+def call_in_thread(func, *args, **kwargs):
+    """
+    Call ``func`` in the SQLite thread, and block until it returns, for methods that can't return a deferred, like
+    ``__len__``. Return its return value, or raise its exception.
+
+    .. versionadded:: 1.5.0
+    """
+    done = threading.Event()
+    results = []
+
+    def on_result(success, result):
+        results.append((success, result))
+        done.set()
+
+    get_threadpool().callInThreadWithCallback(on_result, func, *args, **kwargs)
+    done.wait()
+    success, result = results[0]
+    if not success:
+        result.raiseException()
+    return result
+
+
+# The database argument is "jobs" (in SqliteJobStorage), "spiderqueue" (in SharedSqliteSpiderQueue) or a project (in
+# SqliteSpiderQueue) from get_spider_queues(), which gets projects from get_project_list(), which gets projects from
+# egg storage. We check for directory traversal in egg storage, instead.
+def initialize(cls, config, database, table, **kwargs):
     dbs_dir = config.get("dbs_dir", "dbs")
     if dbs_dir == ":memory:":
         connection_string = dbs_dir
@@ -16,83 +149,562 @@ def initialize(cls, config, database, table):
             os.makedirs(dbs_dir)
         connection_string = os.path.join(dbs_dir, f"{database}.db")
 
-    return cls(connection_string, table)
+    return cls(
+        connection_string,
+        table,
+        journal_mode=config.get("sqlite_journal_mode", "wal"),
+        synchronous=config.get("sqlite_synchronous", "normal"),
+        codec=config.get("sqlite_codec", "json"),
+        **kwargs,
+    )
 
 
 class SqliteMixin:
-    def __init__(self, database, table):
+    def __init__(self, database, table, *, journal_mode=None, synchronous=None, codec="json", shared=False):
         self.database = database or ":memory:"
         self.table = table
-        # Regarding check_same_thread, see http://twistedmatrix.com/trac/ticket/4040
-        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        if codec not in CODECS:
+            raise InvalidOptionError("sqlite_codec", codec, tuple(CODECS))
+        self.codec = CODECS[codec]
+        # Decoding a pickle can run arbitrary code, so only an instance that opted into pickle decodes pickles.
+        self.unpickle = codec == "pickle"
+
+        # If shared, instances with the same database use one connection, instead of one connection (and one file
+        # descriptor) each. An in-memory database is then shared, too.
+        key = self.database if self.database == ":memory:" else os.path.abspath(self.database)
+        if shared and key in connections:
+            self.conn = connections[key]
+        else:
+            # Regarding check_same_thread, see http://twistedmatrix.com/trac/ticket/4040
+            self.conn = sqlite3.connect(self.database, check_same_thread=False)
+            if shared:
+                connections[key] = self.conn
+                caches[key] = {}
+        # Values that are derived from the database, like row counts. Like the connection, they are shared if shared.
+        self.cache = caches[key] if shared else {}
+
+        # An in-memory database ignores journal_mode, and keeps its "memory" journal mode.
+        for pragma, value in (("journal_mode", journal_mode), ("synchronous", synchronous)):
+            if value:
+                # PRAGMA statements don't accept parameters, so the value is checked against the allowed values.
+                if value.lower() not in PRAGMAS[pragma]:
+                    raise InvalidOptionError(f"sqlite_{pragma}", value, PRAGMAS[pragma])
+                self.conn.execute(f"PRAGMA {pragma} = {value}")
 
     def __len__(self):
         return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
 
+    def sync_cache(self):
+        """Clear the cache if another connection (for example, in another process) committed changes."""
+        # PRAGMA data_version is read from the database header. Unlike COUNT(*), it doesn't scan the table. It changes
+        # only if another connection commits. This connection's changes update the cache instead.
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.cache.get("data_version") != data_version:
+            self.cache.clear()
+            self.cache["data_version"] = data_version
+
     def encode(self, obj):
-        return sqlite3.Binary(json.dumps(obj).encode("ascii"))
+        return sqlite3.Binary(self.codec.encode(obj))
 
-    def decode(self, obj):
-        return json.loads(bytes(obj).decode("ascii"))
+    def decode(self, obj, *, unpickle=None):
+        # Messages can be encoded by different codecs, if the codec setting changed. A database can be shared by many
+        # Scrapyd instances, so a pickle is decoded only if this instance (or the caller) trusts the database.
+        data = bytes(obj)
+        if data.startswith(PickleCodec.prefix):
+            if not (self.unpickle if unpickle is None else unpickle):
+                raise UntrustedCodecError
+            return CODECS["pickle"].decode(data)
+        return CODECS["json"].decode(data)
 
 
 class JsonSqlitePriorityQueue(SqliteMixin):
     """
     SQLite priority queue. It relies on SQLite concurrency support for providing atomic inter-process operations.
 
+    If a message is a dict (like a spider queue message), its ``_job``, ``name``, ``_max_proc``, ``_version``,
+    ``_not_before``, ``_expires``, ``_scheduled`` and ``_dedupe`` keys are copied to the ``job``, ``spider``,
+    ``max_proc``, ``version``, ``not_before``, ``expires``, ``scheduled`` and ``dedupe`` columns, so that messages can
+    be found without decoding every message. With a binary codec, the keys are removed from the encoded message, to
+    save space.
+
+    The ``dedupe`` column has a unique index: a message with the same ``_dedupe`` key as a message in the queue isn't
+    inserted. See :meth:`put_many`.
+
+    A message whose ``_not_before`` key (a Unix timestamp) is in the future is delayed: it isn't popped, and its
+    priority isn't returned by :meth:`next_priority`, until then. It is counted by ``len()``.
+
+    A message whose ``_expires`` key (a Unix timestamp) is in the past is expired: it isn't popped, and is counted by
+    ``len()`` until :meth:`remove_expired` is called.
+
+    If ``project`` is set, the queue contains only the messages in the table whose ``project`` column has that value,
+    so that many projects can share a table.
+
+    If ``aging`` is set, a message's effective priority increases by 1 every ``aging`` seconds after it is due, so that
+    messages with low priorities aren't starved by a steady stream of messages with high priorities. Time is divided
+    into buckets of ``aging`` seconds, and a message's ``rank`` column is its priority minus the number of the bucket
+    in which it was due. The effective priority is the rank plus the number of the current bucket. Since the current
+    bucket is the same for every message, messages are popped in order of rank, using an index, without recomputing
+    effective priorities. :meth:`next_priority` returns the effective priority.
+
+    The number of messages is counted once, and then kept up-to-date by this instance's operations. It is counted again
+    if another connection changes the database.
+
     .. versionadded:: 1.0.0
+    .. versionchanged:: 1.5.0
+       Add the ``aging`` parameter.
     """
 
-    def __init__(self, database=None, table="queue"):
-        super().__init__(database, table)
+    def __init__(self, database=None, table="queue", *, project=None, aging=0, **kwargs):
+        super().__init__(database, table, **kwargs)
+        self.project = project
+        self.aging = aging
 
         self.conn.execute(
-            f"CREATE TABLE IF NOT EXISTS {table} (id integer PRIMARY KEY, priority real key, message blob)"
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(id integer PRIMARY KEY, priority real key, message blob, job text, spider text, project text, "
+            "max_proc integer, version text, dedupe text, not_before real, expires real, enqueued real, rank real, "
+            "scheduled real)"
         )
-
-    def put(self, message, priority=0.0):
+        self._migrate()
+        # Messages are popped in descending rank (which is the priority, without aging) and, within a rank, in
+        # insertion order. This index avoids sorting the table on each pop. Databases created by earlier versions gain
+        # the index here.
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_project_rank_id ON {table} (project, rank DESC, id)")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_job_project ON {table} (job, project)")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_spider ON {table} (spider)")
+        # For list_page(spider=...).
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_project_spider_rank_id ON {table} (project, spider, rank DESC, id)"
+        )
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_project_not_before ON {table} (project, not_before) "
+            "WHERE not_before IS NOT NULL"
+        )
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_project_expires ON {table} (project, expires) "
+            "WHERE expires IS NOT NULL"
+        )
+        # A unique index treats NULL values as distinct, so the project column, which is NULL unless the table is
+        # shared, is indexed as an empty string. A message without a _dedupe key is never a duplicate.
         self.conn.execute(
-            f"INSERT INTO {self.table} (priority, message) VALUES (?, ?)",
-            (priority, self.encode(message)),
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_project_dedupe ON {table} (ifnull(project, ''), dedupe) "
+            "WHERE dedupe IS NOT NULL"
         )
         self.conn.commit()
 
-    def pop(self):
-        row = self.conn.execute(f"SELECT id, message FROM {self.table} ORDER BY priority DESC LIMIT 1").fetchone()
-        if row is None:
+    def _migrate(self):
+        # Tables created by earlier versions lack some columns or have old indexes, and the ranks depend on the aging
+        # interval, which can change between runs. Queues are constructed often (for example, by get_spider_queues()
+        # for every project, on every deployment), so the schema and the aging interval in use are read first, and
+        # the write lock is taken only if a change is needed.
+        if not self._needs_migration():
+            return
+
+        # The write lock is taken before reading again, so that only one of many processes opening the database makes
+        # the changes.
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({self.table})")}
+            for column, type_ in MIGRATED_COLUMNS:
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {column} {type_}")
+            # Messages added by earlier versions age from now.
+            if "enqueued" not in columns:
+                self.conn.execute(f"UPDATE {self.table} SET enqueued = ?", (time.time(),))
+            # Earlier versions encoded messages whole, as JSON, or copied fewer keys to columns. With a binary codec,
+            # the copied keys are in the columns, not in the message.
+            if "job" not in columns or "version" not in columns or "scheduled" not in columns:
+                self.conn.executemany(
+                    f"UPDATE {self.table} SET job = ?, spider = ?, max_proc = ?, version = ?, not_before = ?, "
+                    "expires = ?, scheduled = ?, dedupe = ? WHERE id = ?",
+                    (
+                        (*self._columns(self._decode(*row[1:])), row[0])
+                        for row in self.conn.execute(f"SELECT id, {MESSAGE} FROM {self.table}").fetchall()
+                    ),
+                )
+            # Indexes that include the project column replace these indexes. The index on the rank replaces the index
+            # on the priority.
+            for index in DROPPED_INDEXES:
+                self.conn.execute(f"DROP INDEX IF EXISTS {self.table}_{index}")
+            # The ranks of all projects' messages are recomputed, since the aging interval is stored per table.
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table}_meta (key text PRIMARY KEY, value) WITHOUT ROWID"
+            )
+            if self._stored_aging() != (self.aging or 0):
+                self.conn.execute(
+                    f"UPDATE {self.table} SET rank = {RANK} WHERE rank IS NOT {RANK}",
+                    (self.aging or None, self.aging or None),
+                )
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table}_meta (key, value) VALUES ('aging', ?)", (self.aging or 0,)
+                )
+
+    def _needs_migration(self):
+        columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({self.table})")}
+        if any(column not in columns for column, _ in MIGRATED_COLUMNS):
+            return True
+        names = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master")}
+        if any(f"{self.table}_{index}" in names for index in DROPPED_INDEXES):
+            return True
+        return f"{self.table}_meta" not in names or self._stored_aging() != (self.aging or 0)
+
+    def _stored_aging(self):
+        # The aging interval with which the ranks were computed, or None if unknown.
+        row = self.conn.execute(f"SELECT value FROM {self.table}_meta WHERE key = 'aging'").fetchone()
+        return None if row is None else row[0]
+
+    def _columns(self, message):
+        if isinstance(message, dict):
+            return tuple(message.get(key) for key in COLUMNS)
+        return (None,) * len(COLUMNS)
+
+    def _encode(self, message):
+        if self.codec.columns and isinstance(message, dict):
+            message = {key: value for key, value in message.items() if key not in COLUMNS}
+        return self.encode(message)
+
+    def _decode(self, message, *columns, unpickle=None):
+        # The arguments are the message column and the columns in COLUMNS, in order.
+        message = self.decode(message, unpickle=unpickle)
+        if isinstance(message, dict):
+            for key, value in zip(COLUMNS, columns):
+                if value is not None:
+                    message[key] = value
+        return message
+
+    def __len__(self):
+        self.sync_cache()
+        key = (self.table, self.project)
+        if key not in self.cache:
+            self.cache[key] = self.conn.execute(
+                f"SELECT COUNT(*) FROM {self.table} WHERE project IS ?", (self.project,)
+            ).fetchone()[0]
+        return self.cache[key]
+
+    def _count(self, delta):
+        # Operations that change the number of messages call this method after committing. If another connection
+        # committed in the meantime, the next call to __len__ clears the cache, so an outdated count isn't returned.
+        key = (self.table, self.project)
+        if key in self.cache:
+            self.cache[key] += delta
+
+    def put(self, message, priority=0.0):
+        return self.put_many([(message, priority)])[0]
+
+    def put_many(self, messages):
+        """
+        Insert ``(message, priority)`` pairs in one transaction, and return a list of the ``_job`` key of each message
+        (or ``None``).
+
+        If a message's ``_dedupe`` key is the same as a message's in the queue (including a message inserted earlier in
+        the same call), the message isn't inserted. Instead, the priority and ``_expires`` key of the message in the
+        queue are raised to the message's, if higher, and the ``_job`` key of the message in the queue is returned.
+
+        If a message's ``_max_proc`` key isn't a positive integer, raise
+        :exc:`~scrapyd.exceptions.InvalidMessageError`, and insert no message.
+        """
+        jobs = []
+        inserted = 0
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = []
+            for message, priority in messages:
+                columns = self._columns(message)
+                # The poller compares the max_proc column to numbers of running jobs.
+                max_proc = columns[COLUMNS.index("_max_proc")]
+                if max_proc is not None and (type(max_proc) is not int or max_proc < 1):
+                    raise InvalidMessageError("_max_proc", max_proc)
+                if columns[-1] is not None:
+                    # Insert the previous messages, in order, so that this message can be a duplicate of any of them.
+                    inserted += self._insert(rows)
+                    rows = []
+                    row = self.conn.execute(
+                        f"SELECT id, job FROM {self.table} WHERE ifnull(project, '') = ? AND dedupe = ?",
+                        (self.project or "", columns[-1]),
+                    ).fetchone()
+                    if row is not None:
+                        # A message without an expiry doesn't expire, and an expiry isn't removed by a duplicate
+                        # without an expiry. The multi-argument max() returns NULL if an argument is NULL. The rank
+                        # is raised as much as the priority. (The expressions use the row's values before the update.)
+                        self.conn.execute(
+                            f"UPDATE {self.table} SET priority = max(priority, ?), rank = rank + max(priority, ?) - "
+                            "priority, expires = ifnull(max(expires, ?), expires) WHERE id = ?",
+                            (priority, priority, columns[COLUMNS.index("_expires")], row[0]),
+                        )
+                        jobs.append(row[1])
+                        continue
+                # A delayed message ages from the time at which it's due.
+                enqueued = max(now, columns[COLUMNS.index("_not_before")] or now)
+                rows.append(
+                    (
+                        priority,
+                        self._encode(message),
+                        *columns,
+                        self.project,
+                        enqueued,
+                        priority - self._bucket(enqueued),
+                    )
+                )
+                jobs.append(columns[0])
+            inserted += self._insert(rows)
+        self._count(inserted)
+        return jobs
+
+    def _insert(self, rows):
+        if not rows:
+            return 0
+        return self.conn.executemany(
+            f"INSERT INTO {self.table} "
+            "(priority, message, job, spider, max_proc, version, not_before, expires, scheduled, dedupe, project, "
+            "enqueued, rank) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        ).rowcount
+
+    def next_priority(self):
+        """
+        Return the effective priority of the next message to pop, or ``None`` if no message can be popped. Without
+        aging, this is its priority.
+        """
+        if not len(self):
+            return None
+        # The index on the rank is read in order until a message is due, instead of reading every message.
+        now = time.time()
+        row = self.conn.execute(
+            f"SELECT rank FROM {self.table} WHERE project IS ? AND {DUE} ORDER BY rank DESC, id LIMIT 1",
+            (self.project, now, now),
+        ).fetchone()
+        return None if row is None else row[0] + self._bucket(now)
+
+    def next_due(self):
+        """Return the ``_not_before`` key of the next delayed message to become due, or ``None``."""
+        if not len(self):
             return None
-        _id, message = row
+        return self.conn.execute(
+            f"SELECT min(not_before) FROM {self.table} WHERE project IS ? AND not_before > ?",
+            (self.project, time.time()),
+        ).fetchone()[0]
 
-        # If a row vanished, try again.
-        if not self.conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (_id,)).rowcount:
-            self.conn.rollback()
-            return self.pop()
+    def remove_expired(self):
+        """Delete the expired messages in one transaction, and return them."""
+        if not len(self):
+            return []
 
-        self.conn.commit()
-        return self.decode(message)
+        # The launcher calls this method for every project on every poll interval. Avoid taking the write lock if no
+        # message has expired, like most queues, most of the time. The index on the expiry is read.
+        now = time.time()
+        if (
+            self.conn.execute(
+                f"SELECT 1 FROM {self.table} WHERE project IS ? AND expires <= ? LIMIT 1", (self.project, now)
+            ).fetchone()
+            is None
+        ):
+            return []
+
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                f"SELECT {MESSAGE} FROM {self.table} WHERE project IS ? AND expires <= ? ORDER BY expires, id",
+                (self.project, now),
+            ).fetchall()
+            if rows:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE project IS ? AND expires <= ?", (self.project, now))
+        self._count(-len(rows))
+
+        return self._decode_deleted(rows)
+
+    def _now(self):
+        # The parameters of the DUE condition.
+        now = time.time()
+        return now, now
+
+    def _bucket(self, timestamp):
+        # The number of aging intervals since the epoch. int() truncates like CAST in SQLite. See RANK.
+        return int(timestamp / self.aging) if self.aging else 0
+
+    def pop(self, skip=None):
+        """
+        Pop the message with the highest priority. If ``skip`` is set, pop the first message for whose ``spider`` and
+        ``max_proc`` columns ``skip(spider, max_proc)`` is false, and leave the skipped messages in the queue.
+        """
+        messages = self.pop_many(1, skip)
+        return messages[0] if messages else None
+
+    def pop_many(self, n, skip=None):
+        """Pop up to ``n`` messages in one transaction, in the order in which ``pop`` would pop them."""
+        # Avoid taking the write lock if the queue is empty, like most queues, most of the time.
+        if not len(self):
+            return []
+
+        # BEGIN IMMEDIATE takes the write lock before reading, so that no other connection (for example, another
+        # Scrapyd instance sharing the database) can delete the rows between the SELECT and the DELETE.
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            cursor = self.conn.execute(
+                f"SELECT id, {MESSAGE} FROM {self.table} WHERE project IS ? AND {DUE} ORDER BY rank DESC, id"
+                f"{'' if skip else ' LIMIT ?'}",
+                (self.project, *self._now()) if skip else (self.project, *self._now(), n),
+            )
+            # The rows are read from the index one at a time, until enough messages aren't skipped. The skip function
+            # is called with the spider and max_proc columns.
+            rows = list(islice((row for row in cursor if skip is None or not skip(*row[3:5])), n))
+            cursor.close()
+
+            self.conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", ((row[0],) for row in rows))
+        self._count(-len(rows))
+
+        return self._decode_deleted(row[1:] for row in rows)
+
+    def _decode_deleted(self, rows):
+        # The rows are deleted. A message that is encoded with pickle, which this instance doesn't decode, is logged
+        # and dropped, instead of raising, so that the other messages aren't lost, and so that it doesn't block the
+        # queue.
+        messages = []
+        for row in rows:
+            if not self.unpickle and bytes(row[0]).startswith(PickleCodec.prefix):
+                log.error(
+                    "Removed a pending job that is encoded with pickle, since sqlite_codec isn't pickle: job={job!r}",
+                    job=row[1],
+                    log_system="sqlite",
+                )
+                continue
+            messages.append(self._decode(*row))
+        return messages
 
     def remove(self, func):
-        deleted = 0
-        for _id, message in self.conn.execute(f"SELECT id, message FROM {self.table}"):
-            if func(self.decode(message)):
-                # If a row vanished, try again.
-                if not self.conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (_id,)).rowcount:
-                    self.conn.rollback()
-                    return self.remove(func)
-                deleted += 1
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            ids = [
+                (row[0],)
+                for row in self.conn.execute(
+                    f"SELECT id, {MESSAGE} FROM {self.table} WHERE project IS ?", (self.project,)
+                ).fetchall()
+                if func(self._decode(*row[1:]))
+            ]
+            self.conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", ids)
+        self._count(-len(ids))
 
-        self.conn.commit()
+        return len(ids)
+
+    def remove_job(self, job):
+        """Delete the messages whose ``_job`` key is ``job``, and return the number of deleted messages."""
+        with self.conn:
+            deleted = self.conn.execute(
+                f"DELETE FROM {self.table} WHERE job = ? AND project IS ?", (job, self.project)
+            ).rowcount
+        self._count(-deleted)
         return deleted
 
+    def get_job(self, job):
+        """Return a message whose ``_job`` key is ``job``, or ``None``."""
+        row = self.conn.execute(
+            f"SELECT {MESSAGE} FROM {self.table} WHERE job = ? AND project IS ? LIMIT 1", (job, self.project)
+        ).fetchone()
+        return None if row is None else self._decode(*row)
+
     def clear(self):
-        self.conn.execute(f"DELETE FROM {self.table}")
+        self.conn.execute(f"DELETE FROM {self.table} WHERE project IS ?", (self.project,))
         self.conn.commit()
+        self.cache[(self.table, self.project)] = 0
+
+    def move_from(self, database):
+        """
+        Move the messages of the queue without a project in the same table of another database (like a database of
+        ``SqliteSpiderQueue``) to this queue, in one transaction, and return the number of moved messages. Messages
+        keep their priorities and the times from which they age.
+
+        A message whose ``_job`` or ``_dedupe`` key is the same as a message's in this queue isn't inserted, so that
+        moving again, for example if the source database wasn't cleared, doesn't duplicate messages.
+
+        If ``database`` is this instance's database, the messages without a project are moved to this queue.
+        """
+        # The messages are copied with their columns, without decoding, since the codec of each message is detected.
+        # The rank is recalculated, in case the aging intervals differ.
+        same = os.path.abspath(database) == os.path.abspath(self.database)
+        schema = "main" if same else "source"
+        if not same:
+            self.conn.execute("ATTACH DATABASE ? AS source", (database,))
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute(
+                    f"INSERT OR IGNORE INTO main.{self.table} "
+                    "(priority, message, job, spider, max_proc, version, not_before, expires, scheduled, dedupe, "
+                    "project, enqueued, rank) "
+                    "SELECT priority, message, job, spider, max_proc, version, not_before, expires, scheduled, "
+                    f"dedupe, ?, enqueued, {RANK} FROM {schema}.{self.table} AS s WHERE s.project IS NULL "
+                    f"AND (s.job IS NULL OR NOT EXISTS (SELECT 1 FROM main.{self.table} AS m WHERE m.job = s.job "
+                    "AND m.project IS ?)) ORDER BY s.id",
+                    (self.project, self.aging or None, self.project),
+                )
+                moved = self.conn.execute(f"DELETE FROM {schema}.{self.table} WHERE project IS NULL").rowcount
+        finally:
+            if not same:
+                self.conn.execute("DETACH DATABASE source")
+        # The number of inserted messages isn't known, if some were duplicates.
+        self.cache.pop((self.table, self.project), None)
+        return moved
+
+    def reencode(self, *, unpickle=False):
+        """
+        Encode the messages with this instance's codec, and return the number of messages. If ``unpickle`` is true,
+        messages that are encoded with pickle are decoded, even if this instance's codec isn't pickle.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                f"SELECT id, {MESSAGE} FROM {self.table} WHERE project IS ?", (self.project,)
+            ).fetchall()
+            self.conn.executemany(
+                f"UPDATE {self.table} SET message = ? WHERE id = ?",
+                ((self._encode(self._decode(*row[1:], unpickle=unpickle or None)), row[0]) for row in rows),
+            )
+        return len(rows)
+
+    def list_page(self, limit=None, after=None, spider=None, since=None, until=None):
+        """
+        Return up to ``limit`` messages, in the order in which they would be popped, and the position after the last
+        message, or ``None`` if there are no more messages. To get the next messages, pass the position as ``after``.
+
+        If ``spider`` is set, return only messages whose ``name`` key is ``spider``. If ``since`` or ``until`` is set,
+        return only messages whose ``_scheduled`` key is at least ``since`` or before ``until``.
+        """
+        conditions = ["project IS ?"]
+        params = [self.project]
+        if after is not None:
+            # "rank <= ?" lets SQLite start reading the index on the rank at the position.
+            conditions.append("rank <= ? AND (rank < ? OR id > ?)")
+            params.extend((after[0], after[0], after[1]))
+        if spider is not None:
+            conditions.append("spider = ?")
+            params.append(spider)
+        if since is not None:
+            conditions.append("scheduled >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("scheduled < ?")
+            params.append(until)
+
+        # One more row is read, to know whether there are more messages.
+        rows = self.conn.execute(
+            f"SELECT id, rank, {MESSAGE} FROM {self.table} WHERE {' AND '.join(conditions)} ORDER BY rank DESC, id"
+            f"{'' if limit is None else ' LIMIT ?'}",
+            params if limit is None else (*params, limit + 1),
+        ).fetchall()
+        if limit is not None and len(rows) > limit:
+            del rows[limit:]
+            position = [rows[-1][1], rows[-1][0]]
+        else:
+            position = None
+
+        return [self._decode(*row[2:]) for row in rows], position
 
     def __iter__(self):
         return (
-            (self.decode(message), priority)
-            for message, priority in self.conn.execute(
-                f"SELECT message, priority FROM {self.table} ORDER BY priority DESC"
+            (self._decode(*row[:-1]), row[-1])
+            for row in self.conn.execute(
+                f"SELECT {MESSAGE}, priority FROM {self.table} WHERE project IS ? ORDER BY rank DESC, id",
+                (self.project,),
             )
         )
 
@@ -103,44 +715,186 @@ class SqliteFinishedJobs(SqliteMixin):
 
     .. versionadded:: 1.3.0
        Job storage was previously in-memory only.
+    .. versionchanged:: 1.5.0
+       Add the ``outcome`` column, and the ``add_many``, ``count``, ``get`` and ``list_page`` methods.
     """
 
-    def __init__(self, database=None, table="finished_jobs"):
-        super().__init__(database, table)
+    def __init__(self, database=None, table="finished_jobs", **kwargs):
+        super().__init__(database, table, **kwargs)
 
         self.conn.execute(
             f"CREATE TABLE IF NOT EXISTS {table} "
-            "(id integer PRIMARY KEY, project text, spider text, job text, start_time datetime, end_time datetime)"
+            "(id integer PRIMARY KEY, project text, spider text, job text, start_time datetime, end_time datetime, "
+            "outcome text DEFAULT 'finished')"
         )
+        # Tables created by earlier versions lack the outcome column. Their jobs finished.
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if "outcome" not in {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN outcome text DEFAULT 'finished'")
+            # For list_page(), with and without a project.
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_end_time ON {table} (end_time)")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_project_end_time ON {table} (project, end_time)")
+            # For count(), clear() and list_page(), by outcome.
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_outcome_end_time ON {table} (outcome, end_time)")
+            # For get().
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_job ON {table} (job)")
 
     def add(self, job):
-        self.conn.execute(
-            f"INSERT INTO {self.table} (project, spider, job, start_time, end_time) VALUES (?, ?, ?, ?, ?)",
-            (job.project, job.spider, job.job, job.start_time, job.end_time),
-        )
-        self.conn.commit()
+        self.add_many([job])
+
+    def add_many(self, jobs):
+        """Insert the jobs in one transaction."""
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {self.table} (project, spider, job, start_time, end_time, outcome) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        job.project,
+                        job.spider,
+                        job.job,
+                        job.start_time,
+                        job.end_time,
+                        getattr(job, "outcome", "finished"),
+                    )
+                    for job in jobs
+                ),
+            )
 
     def clear(self, finished_to_keep=None):
-        where = ""
-        if finished_to_keep:
-            limit = len(self) - finished_to_keep
-            if limit <= 0:
-                return  # nothing to delete
-            where = f"WHERE id <= (SELECT max(id) FROM (SELECT id FROM {self.table} ORDER BY end_time LIMIT {limit}))"
-
-        self.conn.execute(f"DELETE FROM {self.table} {where}")
+        """
+        Delete all jobs or, if ``finished_to_keep`` is set, all but the last ``finished_to_keep`` jobs of each outcome,
+        so that many expired jobs don't delete the jobs that ran.
+        """
+        if not finished_to_keep:
+            self.conn.execute(f"DELETE FROM {self.table}")
+        else:
+            for outcome, count in self.conn.execute(
+                f"SELECT outcome, COUNT(*) FROM {self.table} GROUP BY outcome"
+            ).fetchall():
+                if count > finished_to_keep:
+                    self.conn.execute(
+                        f"DELETE FROM {self.table} WHERE id IN "
+                        f"(SELECT id FROM {self.table} WHERE outcome IS ? ORDER BY end_time, id LIMIT ?)",
+                        (outcome, count - finished_to_keep),
+                    )
         self.conn.commit()
 
+    def count(self, outcome=None):
+        """Return the number of jobs or, if ``outcome`` is set, the number of jobs with that outcome."""
+        if outcome is None:
+            return len(self)
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table} WHERE outcome = ?", (outcome,)).fetchone()[0]
+
+    def list_page(self, limit=None, after=None, project=None, spider=None, since=None, until=None, outcome=None):
+        """
+        Return up to ``limit`` jobs, in reverse order by ``end_time``, like ``__iter__``, and the position after the
+        last job, or ``None`` if there are no more jobs. To get the next jobs, pass the position as ``after``.
+
+        If ``project``, ``spider`` or ``outcome`` is set, return only that project's or spider's jobs, or the jobs with
+        that outcome. If ``since`` or ``until`` (a datetime) is set, return only jobs whose ``end_time`` is at least
+        ``since`` or before ``until``.
+        """
+        conditions = []
+        params = []
+        if after is not None:
+            # "end_time <= ?" lets SQLite start reading the index on the end time at the position.
+            conditions.append("end_time <= ? AND (end_time < ? OR id < ?)")
+            params.extend((after[0], after[0], after[1]))
+        for condition, value in (
+            ("project = ?", project),
+            ("spider = ?", spider),
+            ("end_time >= ?", since),
+            ("end_time < ?", until),
+            ("outcome = ?", outcome),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+
+        # One more row is read, to know whether there are more jobs.
+        rows = self.conn.execute(
+            f"SELECT id, project, spider, job, start_time, end_time, outcome FROM {self.table} "
+            f"{'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY end_time DESC, id DESC"
+            f"{'' if limit is None else ' LIMIT ?'}",
+            params if limit is None else (*params, limit + 1),
+        ).fetchall()
+        if limit is not None and len(rows) > limit:
+            del rows[limit:]
+            position = [rows[-1][5], rows[-1][0]]
+        else:
+            position = None
+
+        return [self._job(*row[1:]) for row in rows], position
+
+    def get(self, job, project=None):
+        """
+        Return the last job whose ID is ``job``, or ``None``. If ``project`` is set, return only that project's job.
+        """
+        row = self.conn.execute(
+            f"SELECT project, spider, job, start_time, end_time, outcome FROM {self.table} WHERE job = ? "
+            f"{'' if project is None else 'AND project = ? '}ORDER BY end_time DESC LIMIT 1",
+            (job,) if project is None else (job, project),
+        ).fetchone()
+        return None if row is None else self._job(*row)
+
+    def _job(self, project, spider, job, start_time, end_time, outcome):
+        return (
+            project,
+            spider,
+            job,
+            datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S.%f"),
+            datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S.%f"),
+            outcome,
+        )
+
     def __iter__(self):
         return (
-            (
-                project,
-                spider,
-                job,
-                datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S.%f"),
-                datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S.%f"),
-            )
-            for project, spider, job, start_time, end_time in self.conn.execute(
-                f"SELECT project, spider, job, start_time, end_time FROM {self.table} ORDER BY end_time DESC"
+            self._job(*row)
+            for row in self.conn.execute(
+                f"SELECT project, spider, job, start_time, end_time, outcome FROM {self.table} ORDER BY end_time DESC"
             )
         )
+
+
+class SqliteSpiderLists(SqliteMixin):
+    """
+    SQLite cache of ``scrapy list`` output, by project and version. The SHA-256 digest of the egg and the runner module
+    are stored with the output, which is used only if both are the same.
+
+    .. versionadded:: 1.5.0
+    """
+
+    def __init__(self, database=None, table="spider_lists", **kwargs):
+        super().__init__(database, table, **kwargs)
+
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(project text NOT NULL, version text NOT NULL, digest text NOT NULL, runner text NOT NULL, "
+            "spiders text NOT NULL, PRIMARY KEY (project, version))"
+        )
+        self.conn.commit()
+
+    def get(self, project, version, digest, runner):
+        """Return the spider names, or ``None`` if they aren't cached for this egg and runner."""
+        row = self.conn.execute(
+            f"SELECT spiders FROM {self.table} WHERE project = ? AND version = ? AND digest = ? AND runner = ?",
+            (project, version, digest, runner),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, project, version, digest, runner, spiders):
+        with self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (project, version, digest, runner, spiders) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (project, version, digest, runner, json.dumps(spiders)),
+            )
+
+    def delete(self, project, version=None):
+        with self.conn:
+            if version is None:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE project = ?", (project,))
+            else:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE project = ? AND version = ?", (project, version))
@@ -1,25 +1,45 @@
 from __future__ import annotations
 
+import base64
 import functools
+import hashlib
 import json
+import math
 import os
+import random
 import sys
+import time
 import traceback
 import uuid
 import zipfile
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime
 from io import BytesIO
-from subprocess import PIPE, Popen
 from typing import ClassVar
 
+from twisted.internet import protocol, reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, inlineCallbacks, maybeDeferred, succeed
+from twisted.internet.error import ProcessDone
+from twisted.internet.interfaces import IPushProducer
 from twisted.logger import Logger
-from twisted.web import error, http, resource
+from twisted.python.failure import Failure
+from twisted.web import error, http, resource, server
+from zope.interface import implementer
 
+from scrapyd.eggstorage import sanitize_version
 from scrapyd.exceptions import EggNotFoundError, ProjectNotFoundError, RunnerError
 from scrapyd.utils import job_items_url, job_log_url
 
 log = Logger()
 
+# The values of the spider_discovery setting.
+SPIDER_DISCOVERY = ("sync", "background")
+
+# Keys of a pending job's message that Scrapyd sets from validated parameters, which a spider argument can't set.
+RESERVED_ARGS = ("_job", "_version", "_max_proc", "_scheduled", "_dedupe", "_not_before", "_expires")
+# Keys of a pending job's message that aren't spider arguments.
+PENDING_IGNORED = ("name", *RESERVED_ARGS, "settings")
+
 
 def param(
     decoded: str,
@@ -60,19 +80,236 @@ def param(
     return decorator
 
 
-class SpiderList:
-    cache: ClassVar = defaultdict(dict)
+def get_timestamp(name, value):
+    """
+    Return the Unix timestamp of ``value``, or ``None``.
 
-    def get(self, project, version, *, runner):
-        """Return the ``scrapy list`` output for the project and version, using a cache if possible."""
+    ``value`` is a Unix timestamp, or an ISO 8601 date and time (in local time, if it has no time zone).
+    """
+    if value is None:
+        return None
+    try:
+        timestamp = float(value)
+    except ValueError:
         try:
-            return self.cache[project][version]
-        except KeyError:
-            return self.set(project, version, runner=runner)
+            # Python 3.10 and earlier don't accept the "Z" suffix.
+            timestamp = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError as e:
+            raise error.Error(code=http.OK, message=b"%b is invalid: %b" % (name.encode(), str(e).encode())) from e
+    if not math.isfinite(timestamp):
+        raise error.Error(code=http.OK, message=b"%b is invalid: %b" % (name.encode(), value.encode()))
+    return timestamp
 
-    def set(self, project, version, *, runner):
-        """Calculate, cache and return the ``scrapy list`` output for the project and version, bypassing the cache."""
 
+def get_not_before(not_before, jitter):
+    """
+    Return the Unix timestamp before which a job mustn't start, or ``None``.
+
+    ``not_before`` is a number of seconds from now, or an ISO 8601 date and time (in local time, if it has no time
+    zone). If ``jitter`` is set, a random number of seconds, up to ``jitter``, is added, to spread out jobs that are
+    scheduled for the same time.
+    """
+    if jitter is not None and not (math.isfinite(jitter) and jitter >= 0):
+        raise error.Error(code=http.OK, message=b"jitter is invalid: %r" % jitter)
+    if not_before is None and not jitter:
+        return None
+
+    now = time.time()
+    if not_before is None:
+        timestamp = now
+    else:
+        try:
+            timestamp = now + float(not_before)
+        except ValueError:
+            timestamp = get_timestamp("not_before", not_before)
+        if not math.isfinite(timestamp):
+            raise error.Error(code=http.OK, message=b"not_before is invalid: %b" % str(not_before).encode())
+
+    if jitter:
+        timestamp += random.uniform(0, jitter)  # noqa: S311 # not for cryptography
+    return timestamp
+
+
+def get_expires(not_before, expires_after):
+    """
+    Return the Unix timestamp after which a pending job is removed, or ``None``.
+
+    ``expires_after`` is a number of seconds after the job is due.
+    """
+    if expires_after is None:
+        return None
+    if not (math.isfinite(expires_after) and expires_after > 0):
+        raise error.Error(code=http.OK, message=b"expires_after is invalid: %r" % expires_after)
+    return (time.time() if not_before is None else not_before) + expires_after
+
+
+def pending_job(project, message):
+    """Return the JSON-serializable representation of a pending job."""
+    return {
+        "project": project,
+        "spider": message["name"],
+        "id": message["_job"],
+        "version": message.get("_version"),
+        "settings": message.get("settings", {}),
+        "args": {k: v for k, v in message.items() if k not in PENDING_IGNORED},
+    }
+
+
+def finished_job(job):
+    """Return the JSON-serializable representation of a finished job."""
+    return {
+        "project": job.project,
+        "spider": job.spider,
+        "id": job.job,
+        "start_time": str(job.start_time),
+        "end_time": str(job.end_time),
+        "log_url": job_log_url(job),
+        "items_url": job_items_url(job),
+    }
+
+
+def expired_job(job):
+    """Return the JSON-serializable representation of a job that expired before it started. It has no log or items."""
+    return {
+        "project": job.project,
+        "spider": job.spider,
+        "id": job.job,
+        "end_time": str(job.end_time),
+    }
+
+
+class SpiderListProtocol(protocol.ProcessProtocol):
+    """Collect the output of a ``scrapy list`` process, and fire a deferred with the spider names when it ends."""
+
+    def __init__(self):
+        self.deferred = Deferred()
+        self.stdout = BytesIO()
+        self.stderr = BytesIO()
+
+    def outReceived(self, data):
+        self.stdout.write(data)
+
+    def errReceived(self, data):
+        self.stderr.write(data)
+
+    def processEnded(self, status):
+        stdout = self.stdout.getvalue()
+        if status.check(ProcessDone):
+            self.deferred.callback(stdout.decode().splitlines())
+        else:
+            self.deferred.errback(RunnerError((self.stderr.getvalue() or stdout).decode()))
+
+
+class SpiderList:
+    """
+    .. versionchanged:: 1.5.0
+       The methods return deferreds, instead of blocking until ``scrapy list`` ends. Add ``eggstorage`` and ``store``
+       parameters. The cache holds at most ``maxsize`` outputs, and evicts the least recently used. Add the
+       :meth:`discover` method.
+    """
+
+    # The output of "scrapy list", by project and version, from the least to the most recently used.
+    cache: ClassVar = OrderedDict()
+    # The number of cache hits, misses and evictions.
+    counters: ClassVar = Counter()
+    # The deferreds waiting for a "scrapy list" process to end, by project and version, and by project, egg digest and
+    # runner, if known. The output depends on the egg's contents, not its version, so a call for the default version
+    # can wait for a process that lists the same egg under its version.
+    running: ClassVar = {}
+    running_digests: ClassVar = {}
+    # The status of the calls to discover(), by project and version, from the least to the most recent.
+    statuses: ClassVar = OrderedDict()
+    maxsize = 1000
+    # Limits the number of processes that discover() runs at once.
+    workers = DeferredSemaphore(2)
+
+    def get(self, project, version, *, runner, eggstorage=None, store=None):
+        """
+        Return a deferred that fires with the ``scrapy list`` output for the project and version, using a cache if
+        possible. If the output is being calculated, wait for it, instead of running ``scrapy list`` again.
+
+        If ``eggstorage`` and ``store`` (a :class:`~scrapyd.sqlite.SqliteSpiderLists`) are set, the output is also
+        cached in ``store``, with the SHA-256 digest of the egg, so that the cache survives restarts.
+        """
+        if (project, version) in self.cache:
+            self.counters["hits"] += 1
+            self.cache.move_to_end((project, version))
+            return succeed(self.cache[(project, version)])
+
+        self.counters["misses"] += 1
+        if (project, version) in self.running:
+            return self._wait(self.running[(project, version)])
+
+        key = self._key(project, version, runner, eggstorage, store)
+        if key is not None:
+            # For example, if the default version is being discovered.
+            if (project, key[2], key[3]) in self.running_digests:
+                return self._wait(self.running_digests[(project, key[2], key[3])])
+            if (spiders := store.get(*key)) is not None:
+                self._cache(project, version, spiders)
+                return succeed(spiders)
+
+        return self._run(project, version, runner, key, store)
+
+    def set(self, project, version, *, runner, eggstorage=None, store=None):
+        """
+        Return a deferred that fires with the ``scrapy list`` output for the project and version, bypassing the cache,
+        and cache the output.
+        """
+        return self._run(project, version, runner, self._key(project, version, runner, eggstorage, store), store)
+
+    def discover(self, project, version, *, runner, eggstorage=None, store=None):
+        """
+        Like :meth:`set`, but run at most ``workers`` processes at once, and record the status of the call, which is
+        returned by :meth:`discovered`. Calls to :meth:`get` for the project and version wait for the output, including
+        while the process waits for a worker.
+
+        Return a deferred that fires with the output, or ``None`` if ``scrapy list`` failed.
+        """
+        status = {"status": "running"}
+        self.statuses.pop((project, version), None)
+        self.statuses[(project, version)] = status
+        while len(self.statuses) > max(self.maxsize, 1):
+            self.statuses.popitem(last=False)
+        # The default version is about to change.
+        self.cache.pop((project, None), None)
+
+        key = self._key(project, version, runner, eggstorage, store)
+        deferred = self._run(project, version, runner, key, store, self.workers)
+        return deferred.addCallbacks(
+            self._discovered, self._undiscovered, callbackArgs=(status,), errbackArgs=(project, version, status)
+        )
+
+    def discovered(self, project):
+        """Return the status of the calls to :meth:`discover` for the project's versions, by version."""
+        return {version: dict(status) for (name, version), status in self.statuses.items() if name == project}
+
+    def delete(self, project, version=None, *, store=None):
+        if version is None:
+            for cache in (self.cache, self.running, self.statuses):
+                for key in [key for key in cache if key[0] == project]:
+                    del cache[key]
+            if store is not None:
+                store.delete(project)
+            return
+
+        # The version can have been requested as written in the egg's file name, in which egg storage replaces some
+        # characters, like "1_0" for "1.0".
+        versions = {version, sanitize_version(version)}
+        # Evict the return value of version=None calls, since we can't determine whether this version is the default
+        # version (in which case we would pop it) or not (in which case we would keep it).
+        for cache in (self.cache, self.running, self.statuses):
+            cache.pop((project, None), None)
+            for name in versions:
+                cache.pop((project, name), None)
+
+        # The store is keyed by the version that egg storage returned: the requested version or, for version=None
+        # calls, the version in the egg's file name. Both are evicted.
+        if store is not None:
+            for name in versions:
+                store.delete(project, name)
+
+    def _run(self, project, version, runner, key, store, workers=None):
         env = os.environ.copy()
         env["PYTHONIOENCODING"] = "UTF-8"
         env["SCRAPY_PROJECT"] = project
@@ -80,36 +317,139 @@ class SpiderList:
         if version:
             env["SCRAPYD_EGG_VERSION"] = version
 
-        args = [sys.executable, "-m", runner, "list", "-s", "LOG_STDOUT=0"]
-        process = Popen(args, stdout=PIPE, stderr=PIPE, env=env)
-        stdout, stderr = process.communicate()
-        if process.returncode:
-            raise RunnerError((stderr or stdout or b"").decode())
+        # If a process is running for the same project and version, for example, to list the spiders of an egg that
+        # has since been replaced, then its output isn't cached, and calls to get() wait for this process instead.
+        waiters = self.running[(project, version)] = []
+        if key is not None:
+            self.running_digests[(project, key[2], key[3])] = waiters
 
-        spiders = stdout.decode().splitlines()
+        # Wait before spawning the process, in case it ends synchronously.
+        deferred = self._wait(waiters)
+        args = [sys.executable, "-m", runner, "list", "-s", "LOG_STDOUT=0"]
+        if workers is None:
+            self._spawn(args, env, project, version, waiters, key, store)
+        else:
+            workers.run(self._spawn, args, env, project, version, waiters, key, store)
+        return deferred
 
+    def _spawn(self, args, env, project, version, waiters, key, store):
+        process = SpiderListProtocol()
+        process.deferred.addBoth(self._finished, project, version, waiters, key, store)
+        try:
+            reactor.spawnProcess(process, sys.executable, args=args, env=env)
+        except Exception:  # noqa: BLE001
+            process.deferred.errback()
+        # The deferred fires after the waiters, when the process ends.
+        return process.deferred
+
+    def _key(self, project, version, runner, eggstorage, store):
+        # Return the arguments to the store's get() and set() methods, or None if the output isn't stored.
+        if eggstorage is None or store is None:
+            return None
+
+        version, egg = eggstorage.get(project, version)
+        # For example, if the project is in the [settings] section, instead of in egg storage.
+        if egg is None:
+            return None
+
+        digest = hashlib.sha256()
+        with egg:
+            for chunk in iter(functools.partial(egg.read, 65536), b""):
+                digest.update(chunk)
+        return project, version, digest.hexdigest(), runner
+
+    def _cache(self, project, version, spiders):
         # Note: If the cache is empty, that doesn't mean that this is the project's only version; it simply means that
         # this is the first version called in this Scrapyd process.
 
         # Evict the return value of version=None calls, since we can't determine whether this version is the default
         # version (in which case we would overwrite it) or not (in which case we would keep it).
-        self.cache[project].pop(None, None)
-        self.cache[project][version] = spiders
+        self.cache.pop((project, None), None)
+        self.cache[(project, version)] = spiders
+        self.cache.move_to_end((project, version))
+        while self.cache and len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def info(self):
+        """Return the size, maximum size, and number of hits, misses and evictions of the cache."""
+        return {
+            "size": len(self.cache),
+            "maxsize": self.maxsize,
+            "hits": self.counters["hits"],
+            "misses": self.counters["misses"],
+            "evictions": self.counters["evictions"],
+        }
+
+    def _discovered(self, spiders, status):
+        status.update(status="finished", spiders=len(spiders))
         return spiders
 
-    def delete(self, project, version=None):
-        if version is None:
-            self.cache.pop(project, None)
-        else:
-            # Evict the return value of version=None calls, since we can't determine whether this version is the
-            # default version (in which case we would pop it) or not (in which case we would keep it).
-            self.cache[project].pop(None, None)
-            self.cache[project].pop(version, None)
+    def _undiscovered(self, failure, project, version, status):
+        log.failure(
+            "Spider discovery failed: project={project!r} version={version!r}",
+            failure,
+            project=project,
+            version=version,
+        )
+        status.update(status="failed", message=str(failure.value))
+
+    def _wait(self, waiters):
+        deferred = Deferred()
+        waiters.append(deferred)
+        return deferred
+
+    def _finished(self, result, project, version, waiters, key, store):
+        # Cache the output, unless the cache was evicted or another process was started while this process ran.
+        if key is not None and self.running_digests.get((project, key[2], key[3])) is waiters:
+            del self.running_digests[(project, key[2], key[3])]
+        if self.running.get((project, version)) is waiters:
+            del self.running[(project, version)]
+            if not isinstance(result, Failure):
+                self._cache(project, version, result)
+                if key is not None:
+                    store.set(*key, result)
+
+        for deferred in waiters:
+            if isinstance(result, Failure):
+                deferred.errback(result)
+            else:
+                deferred.callback(result)
 
 
 spider_list = SpiderList()
 
 
+@implementer(IPushProducer)
+class Backpressure:
+    """
+    A push producer that lets a coroutine write a streaming response at the pace at which the client reads it.
+
+    The transport pauses the producer when its write buffer is full, and resumes it when the buffer is empty.
+    """
+
+    def __init__(self):
+        self.stopped = False
+        self._resumed = None
+
+    def wait(self):
+        """Return a deferred that fires when the producer is resumed or stopped, or ``None`` if it isn't paused."""
+        return self._resumed
+
+    def pauseProducing(self):
+        if self._resumed is None:
+            self._resumed = Deferred()
+
+    def resumeProducing(self):
+        resumed, self._resumed = self._resumed, None
+        if resumed is not None:
+            resumed.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+
 # WebserviceResource
 class WsResource(resource.Resource):
     """
@@ -127,24 +467,65 @@ class WsResource(resource.Resource):
         try:
             obj = super().render(txrequest)
         except Exception as e:  # noqa: BLE001
-            log.failure("")
+            obj = self._error(txrequest, e)
+
+        # A render method returns NOT_DONE_YET if it writes the response itself, like a streaming response.
+        if obj is server.NOT_DONE_YET:
+            return obj
+
+        # A render method returns a deferred if it uses components that return deferreds. The deferred has fired
+        # already if the components don't return deferreds.
+        if isinstance(obj, Deferred):
+            obj.addErrback(self._failure, txrequest)
+            if not obj.called:
+                obj.addCallback(self._finish, txrequest)
+                return server.NOT_DONE_YET
+            obj = obj.result
+
+        return self._content(txrequest, obj)
+
+    def _error(self, txrequest, e):
+        log.failure("")
+
+        if isinstance(e, error.Error):
+            txrequest.setResponseCode(int(e.status))
+
+        if self.root.debug:
+            return traceback.format_exc().encode()
+
+        message = e.message.decode() if isinstance(e, error.Error) else f"{type(e).__name__}: {e}"
+        return {"node_name": self.root.nodename, "status": "error", "message": message}
 
-            if isinstance(e, error.Error):
-                txrequest.setResponseCode(int(e.status))
+    def _failure(self, failure, txrequest):
+        try:
+            failure.raiseException()
+        except Exception as e:  # noqa: BLE001
+            return self._error(txrequest, e)
 
-            if self.root.debug:
-                return traceback.format_exc().encode()
+    def _finish(self, obj, txrequest):
+        content = self._content(txrequest, obj)
+        # The client can disconnect before the deferred fires.
+        if txrequest.channel is not None:
+            txrequest.write(content)
+            txrequest.finish()
 
-            message = e.message.decode() if isinstance(e, error.Error) else f"{type(e).__name__}: {e}"
-            obj = {"node_name": self.root.nodename, "status": "error", "message": message}
+    def _content(self, txrequest, obj):
+        if isinstance(obj, bytes):  # a traceback, in debug mode
+            return obj
 
         content = b"" if obj is None else self.json_encoder.encode(obj).encode() + b"\n"
-        txrequest.setHeader("Content-Type", "application/json")
+        self._headers(txrequest, "application/json")
+        txrequest.setHeader("Content-Length", str(len(content)))
+        return content
+
+    def _headers(self, txrequest, content_type):
+        txrequest.setHeader("Content-Type", content_type)
         txrequest.setHeader("Access-Control-Allow-Origin", "*")
         txrequest.setHeader("Access-Control-Allow-Methods", "GET, POST, PATCH, PUT, DELETE")
         txrequest.setHeader("Access-Control-Allow-Headers", " X-Requested-With")
-        txrequest.setHeader("Content-Length", str(len(content)))
-        return content
+
+    def _spider_list_kwargs(self):
+        return {"runner": self.root.runner, "eggstorage": self.root.eggstorage, "store": self.root.spider_lists}
 
     def render_OPTIONS(self, txrequest):
         methods = ["OPTIONS", "HEAD"]
@@ -159,12 +540,17 @@ class WsResource(resource.Resource):
 class DaemonStatus(WsResource):
     """
     .. versionadded:: 1.2.0
+    .. versionchanged:: 1.5.0
+       Add ``spider_list_cache`` to the response.
     """
 
+    @inlineCallbacks
     def render_GET(self, txrequest):
-        pending = sum(queue.count() for queue in self.root.poller.queues.values())
+        pending = 0
+        for queue in self.root.poller.queues.values():
+            pending += yield maybeDeferred(queue.count)
         running = len(self.root.launcher.processes)
-        finished = len(self.root.launcher.finished)
+        finished = yield maybeDeferred(self.root.launcher.finished.count, "finished")
 
         return {
             "node_name": self.root.nodename,
@@ -172,6 +558,7 @@ class DaemonStatus(WsResource):
             "pending": pending,
             "running": running,
             "finished": finished,
+            "spider_list_cache": spider_list.info(),
         }
 
 
@@ -181,31 +568,72 @@ class Schedule(WsResource):
        Add ``_version`` and ``jobid`` parameters.
     .. versionchanged:: 1.3.0
        Add ``priority`` parameter.
+    .. versionchanged:: 1.5.0
+       Add ``_max_proc``, ``dedupe_key``, ``not_before``, ``jitter`` and ``expires_after`` parameters. If the job is a
+       duplicate of a pending job, respond with the pending job's ID.
     """
 
     @param("project")
     @param("spider")
     @param("_version", dest="version", required=False, default=None)
     # See https://github.com/scrapy/scrapyd/pull/215
-    @param("jobid", required=False, default=lambda: uuid.uuid1().hex)
+    @param("jobid", required=False, default=None)
     @param("priority", required=False, default=0, type=float)
+    @param("_max_proc", dest="max_proc", required=False, default=None, type=int)
+    @param("dedupe_key", required=False, default=None)
+    @param("not_before", required=False, default=None)
+    @param("jitter", required=False, default=None, type=float)
+    @param("expires_after", required=False, default=None, type=float)
     @param("setting", required=False, default=list, multiple=True)
-    def render_POST(self, txrequest, project, spider, version, jobid, priority, setting):
+    @inlineCallbacks
+    def render_POST(
+        self,
+        txrequest,
+        project,
+        spider,
+        version,
+        jobid,
+        priority,
+        max_proc,
+        dedupe_key,
+        not_before,
+        jitter,
+        expires_after,
+        setting,
+    ):
+        if max_proc is not None and max_proc < 1:
+            raise error.Error(code=http.OK, message=b"_max_proc is invalid: %d" % max_proc)
+        not_before = get_not_before(not_before, jitter)
+        expires = get_expires(not_before, expires_after)
+
         if project not in self.root.poller.queues:
             raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
 
         if version and self.root.eggstorage.get(project, version) == (None, None):
             raise error.Error(code=http.OK, message=b"version '%b' not found" % version.encode())
 
-        spiders = spider_list.get(project, version, runner=self.root.runner)
+        spiders = yield spider_list.get(project, version, **self._spider_list_kwargs())
         if spider not in spiders:
             raise error.Error(code=http.OK, message=b"spider '%b' not found" % spider.encode())
 
+        # Reserved keys are set from the validated parameters, not from the remaining parameters.
         args = {key.decode(): values[0].decode() for key, values in txrequest.args.items()}
+        for key in RESERVED_ARGS:
+            args.pop(key, None)
         if version is not None:
             args["_version"] = version
-
-        self.root.scheduler.schedule(
+        if max_proc is not None:
+            args["_max_proc"] = max_proc
+        if dedupe_key := dedupe_key or jobid:
+            args["_dedupe"] = dedupe_key
+        if not_before is not None:
+            args["_not_before"] = not_before
+        if expires is not None:
+            args["_expires"] = expires
+
+        jobid = jobid or uuid.uuid1().hex
+        pending = yield maybeDeferred(
+            self.root.scheduler.schedule,
             project,
             spider,
             priority=priority,
@@ -213,7 +641,97 @@ class Schedule(WsResource):
             _job=jobid,
             **args,
         )
-        return {"node_name": self.root.nodename, "status": "ok", "jobid": jobid}
+        return {"node_name": self.root.nodename, "status": "ok", "jobid": pending or jobid}
+
+
+class ScheduleBatch(WsResource):
+    """
+    .. versionadded:: 1.5.0
+    """
+
+    @param("jobs", type=json.loads)
+    @inlineCallbacks
+    def render_POST(self, txrequest, jobs):
+        if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+            raise error.Error(code=http.OK, message=b"jobs is invalid: expected a JSON array of JSON objects")
+
+        # Validate all jobs before scheduling any, and run "scrapy list" once per project and version.
+        spiders = {}
+        batches = defaultdict(list)
+        indexes = defaultdict(list)
+        jobids = []
+        for job in jobs:
+            project = self._get(job, "project", str, required=True)
+            spider = self._get(job, "spider", str, required=True)
+            version = self._get(job, "_version", str)
+            jobid = self._get(job, "jobid", str)
+            dedupe_key = self._get(job, "dedupe_key", str) or jobid
+            jobid = jobid or uuid.uuid1().hex
+            priority = self._get(job, "priority", (int, float)) or 0
+            max_proc = self._get(job, "_max_proc", int)
+            settings = self._get(job, "settings", dict) or {}
+            args = self._get(job, "args", dict) or {}
+            # Keys like _max_proc are set from the validated keys of the job, not from the spider arguments.
+            if reserved := [key for key in args if key.startswith("_")]:
+                raise error.Error(
+                    code=http.OK, message=b"args is invalid: '%b' key is reserved" % reserved[0].encode()
+                )
+            not_before = get_not_before(
+                self._get(job, "not_before", (int, float, str)), self._get(job, "jitter", (int, float))
+            )
+            expires = get_expires(not_before, self._get(job, "expires_after", (int, float)))
+
+            if max_proc is not None and max_proc < 1:
+                raise error.Error(code=http.OK, message=b"_max_proc is invalid: %d" % max_proc)
+
+            if (project, version) not in spiders:
+                if project not in self.root.poller.queues:
+                    raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
+
+                if version and self.root.eggstorage.get(project, version) == (None, None):
+                    raise error.Error(code=http.OK, message=b"version '%b' not found" % version.encode())
+
+                spiders[(project, version)] = yield spider_list.get(project, version, **self._spider_list_kwargs())
+
+            if spider not in spiders[(project, version)]:
+                raise error.Error(code=http.OK, message=b"spider '%b' not found" % spider.encode())
+
+            spider_args = {**args, "settings": settings, "_job": jobid}
+            if version is not None:
+                spider_args["_version"] = version
+            if max_proc is not None:
+                spider_args["_max_proc"] = max_proc
+            if dedupe_key:
+                spider_args["_dedupe"] = dedupe_key
+            if not_before is not None:
+                spider_args["_not_before"] = not_before
+            if expires is not None:
+                spider_args["_expires"] = expires
+
+            batches[project].append((spider, float(priority), spider_args))
+            indexes[project].append(len(jobids))
+            jobids.append(jobid)
+
+        for project, spiders_to_schedule in batches.items():
+            pending = yield maybeDeferred(self.root.scheduler.schedule_many, project, spiders_to_schedule)
+            # If a job is a duplicate of a pending job, respond with the pending job's ID.
+            for index, job in zip(indexes[project], pending or ()):
+                jobids[index] = job or jobids[index]
+
+        return {"node_name": self.root.nodename, "status": "ok", "jobids": jobids}
+
+    @staticmethod
+    def _get(job, key, types, *, required=False):
+        if key not in job:
+            if required:
+                raise error.Error(code=http.OK, message=b"'%b' key is required" % key.encode())
+            return None
+
+        value = job[key]
+        # bool is a subclass of int, but isn't a valid priority or maximum.
+        if not isinstance(value, types) or isinstance(value, bool):
+            raise error.Error(code=http.OK, message=b"%b is invalid: %b" % (key.encode(), json.dumps(value).encode()))
+        return value
 
 
 class Cancel(WsResource):
@@ -223,13 +741,14 @@ class Cancel(WsResource):
     # https://cygwin.com/cygwin-ug-net/kill.html
     # https://github.com/scrapy/scrapy/blob/06f9c28/tests/test_crawler.py#L886
     @param("signal", required=False, default="INT" if sys.platform != "win32" else "BREAK")
+    @inlineCallbacks
     def render_POST(self, txrequest, project, job, signal):
         if project not in self.root.poller.queues:
             raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
 
         prevstate = None
 
-        if self.root.poller.queues[project].remove(lambda message: message["_job"] == job):
+        if (yield maybeDeferred(self.root.poller.queues[project].remove_job, job)):
             prevstate = "pending"
 
         for process in self.root.launcher.processes.values():
@@ -241,9 +760,16 @@ class Cancel(WsResource):
 
 
 class AddVersion(WsResource):
+    """
+    .. versionchanged:: 1.5.0
+       If :ref:`spider_discovery` is ``background``, respond once the egg is stored, with ``"spiders": null`` and
+       ``"discovery": "running"``.
+    """
+
     @param("project")
     @param("version")
     @param("egg", type=bytes)
+    @inlineCallbacks
     def render_POST(self, txrequest, project, version, egg):
         if not zipfile.is_zipfile(BytesIO(egg)):
             raise error.Error(
@@ -253,7 +779,18 @@ class AddVersion(WsResource):
         self.root.eggstorage.put(BytesIO(egg), project, version)
         self.root.update_projects()
 
-        spiders = spider_list.set(project, version, runner=self.root.runner)
+        if self.root.spider_discovery == "background":
+            spider_list.discover(project, version, **self._spider_list_kwargs())
+            return {
+                "node_name": self.root.nodename,
+                "status": "ok",
+                "project": project,
+                "version": version,
+                "spiders": None,
+                "discovery": "running",
+            }
+
+        spiders = yield spider_list.set(project, version, **self._spider_list_kwargs())
 
         return {
             "node_name": self.root.nodename,
@@ -271,10 +808,18 @@ class ListProjects(WsResource):
 
 
 class ListVersions(WsResource):
+    """
+    .. versionchanged:: 1.5.0
+       If :ref:`spider_discovery` is ``background``, add ``discovery`` to the response.
+    """
+
     @param("project")
     def render_GET(self, txrequest, project):
         versions = self.root.eggstorage.list(project)
-        return {"node_name": self.root.nodename, "status": "ok", "versions": versions}
+        response = {"node_name": self.root.nodename, "status": "ok", "versions": versions}
+        if self.root.spider_discovery == "background":
+            response["discovery"] = spider_list.discovered(project)
+        return response
 
 
 class ListSpiders(WsResource):
@@ -285,6 +830,7 @@ class ListSpiders(WsResource):
 
     @param("project")
     @param("_version", dest="version", required=False, default=None)
+    @inlineCallbacks
     def render_GET(self, txrequest, project, version):
         if project not in self.root.poller.queues:
             raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
@@ -292,7 +838,7 @@ class ListSpiders(WsResource):
         if version and self.root.eggstorage.get(project, version) == (None, None):
             raise error.Error(code=http.OK, message=b"version '%b' not found" % version.encode())
 
-        spiders = spider_list.get(project, version, runner=self.root.runner)
+        spiders = yield spider_list.get(project, version, **self._spider_list_kwargs())
 
         return {"node_name": self.root.nodename, "status": "ok", "spiders": spiders}
 
@@ -304,6 +850,7 @@ class Status(WsResource):
 
     @param("job")
     @param("project", required=False)
+    @inlineCallbacks
     def render_GET(self, txrequest, job, project):
         queues = self.root.poller.queues
         if project is not None and project not in queues:
@@ -311,10 +858,11 @@ class Status(WsResource):
 
         result = {"node_name": self.root.nodename, "status": "ok", "currstate": None}
 
-        for finished in self.root.launcher.finished:
-            if (project is None or finished.project == project) and finished.job == job:
-                result["currstate"] = "finished"
-                return result
+        finished = yield maybeDeferred(self.root.launcher.finished.get_job, job, project)
+        if finished is not None:
+            # "finished" or "expired".
+            result["currstate"] = getattr(finished, "outcome", "finished")
+            return result
 
         for process in self.root.launcher.processes.values():
             if (project is None or process.project == project) and process.job == job:
@@ -322,10 +870,9 @@ class Status(WsResource):
                 return result
 
         for queue_name in queues if project is None else [project]:
-            for message in queues[queue_name].list():
-                if message["_job"] == job:
-                    result["currstate"] = "pending"
-                    return result
+            if (yield maybeDeferred(queues[queue_name].get_job, job)) is not None:
+                result["currstate"] = "pending"
+                return result
 
         return result
 
@@ -341,56 +888,263 @@ class ListJobs(WsResource):
     .. versionchanged:: 1.4.0
        Add ``log_url`` and ``items_url`` to finished jobs in the response.
     .. versionchanged:: 1.5.0
-       Add ``version``, ``settings`` and ``args`` to pending jobs in the response.
+       Add ``version``, ``settings`` and ``args`` to pending jobs in the response. Add ``expired`` jobs to the
+       response. Add ``state``, ``spider``, ``since``, ``until``, ``limit`` and ``cursor`` parameters.
     """
 
+    # Finished and expired jobs are both in job storage, with different outcomes.
+    states = ("pending", "running", "finished", "expired")
+
     @param("project", required=False)
-    def render_GET(self, txrequest, project):
+    @param("state", required=False)
+    @param("spider", required=False)
+    @param("since", required=False)
+    @param("until", required=False)
+    @param("limit", required=False, type=int)
+    @param("cursor", required=False)
+    @inlineCallbacks
+    def render_GET(self, txrequest, project, state, spider, since, until, limit, cursor):
         queues = self.root.poller.queues
         if project is not None and project not in queues:
             raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
-
-        return {
+        if state is not None and state not in self.states:
+            raise error.Error(code=http.OK, message=b"state is invalid: %b" % state.encode())
+        if limit is not None and limit < 1:
+            raise error.Error(code=http.OK, message=b"limit is invalid: %d" % limit)
+        since = get_timestamp("since", since)
+        until = get_timestamp("until", until)
+
+        # The cursor is the state, project and backend-specific position at which to continue.
+        states = self.states if state is None else (state,)
+        if cursor is None:
+            state, start, after = states[0], None, None
+        else:
+            state, start, after = self._decode_cursor(cursor)
+            if state not in states:
+                raise error.Error(code=http.OK, message=b"cursor is invalid: %b" % cursor.encode())
+
+        jobs = {}
+        remaining = limit
+        next_cursor = None
+        for name in states[states.index(state) :]:
+            if name == "pending":
+                page, next_cursor = yield self._pending(remaining, start, after, project, spider, since, until)
+            elif remaining == 0:
+                page, next_cursor = [], (name, None, None)
+            else:
+                if name == "running":
+                    page, after = self._running(remaining, after, project, spider, since, until)
+                else:
+                    page, after = yield maybeDeferred(
+                        self.root.launcher.finished.list_page,
+                        remaining,
+                        after,
+                        project,
+                        spider,
+                        None if since is None else datetime.fromtimestamp(since),
+                        None if until is None else datetime.fromtimestamp(until),
+                        name,
+                    )
+                next_cursor = None if after is None else (name, None, after)
+            jobs[name] = page
+            if remaining is not None:
+                remaining -= len(page)
+            if next_cursor is not None:
+                break
+            after = None
+
+        response = {
             "node_name": self.root.nodename,
             "status": "ok",
-            "pending": [
-                {
-                    "project": queue_name,
-                    "spider": message["name"],
-                    "id": message["_job"],
-                    "version": message.get("_version"),
-                    "settings": message.get("settings", {}),
-                    "args": {k: v for k, v in message.items() if k not in ("name", "_job", "_version", "settings")},
-                }
-                for queue_name in (queues if project is None else [project])
-                for message in queues[queue_name].list()
-            ],
-            "running": [
-                process.asdict()
-                for process in self.root.launcher.processes.values()
-                if project is None or process.project == project
-            ],
-            "finished": [
-                {
-                    "project": finished.project,
-                    "spider": finished.spider,
-                    "id": finished.job,
-                    "start_time": str(finished.start_time),
-                    "end_time": str(finished.end_time),
-                    "log_url": job_log_url(finished),
-                    "items_url": job_items_url(finished),
-                }
-                for finished in self.root.launcher.finished
-                if project is None or finished.project == project
-            ],
+            "pending": [pending_job(queue_name, message) for queue_name, message in jobs.get("pending", [])],
+            "running": [process.asdict() for process in jobs.get("running", [])],
+            "finished": [finished_job(finished) for finished in jobs.get("finished", [])],
+            "expired": [expired_job(expired) for expired in jobs.get("expired", [])],
         }
+        if limit is not None:
+            response["next_cursor"] = None if next_cursor is None else self._encode_cursor(*next_cursor)
+        return response
+
+    @inlineCallbacks
+    def _pending(self, limit, start, after, project, spider, since, until):
+        # Pending jobs are listed by project, in alphabetical order, and then in the order in which they would start.
+        queues = self.root.poller.queues
+        page = []
+        for queue_name in sorted(queues) if project is None else [project]:
+            if start is not None and queue_name < start:
+                continue
+            if limit is not None and len(page) == limit:
+                return page, ("pending", queue_name, None)
+            messages, after = yield maybeDeferred(
+                queues[queue_name].list_page, None if limit is None else limit - len(page), after, spider, since, until
+            )
+            page.extend((queue_name, message) for message in messages)
+            if after is not None:
+                return page, ("pending", queue_name, after)
+        return page, None
+
+    def _running(self, limit, after, project, spider, since, until):
+        # Running jobs are few (at most max_proc), so they are filtered and sorted in memory, by start time.
+        processes = sorted(
+            (
+                process
+                for process in self.root.launcher.processes.values()
+                if (project is None or process.project == project)
+                and (spider is None or process.spider == spider)
+                and (since is None or process.start_time.timestamp() >= since)
+                and (until is None or process.start_time.timestamp() < until)
+                and (after is None or [str(process.start_time), process.job] > after)
+            ),
+            key=lambda process: (str(process.start_time), process.job),
+        )
+        if limit is not None and len(processes) > limit:
+            del processes[limit:]
+            return processes, [str(processes[-1].start_time), processes[-1].job]
+        return processes, None
+
+    @staticmethod
+    def _encode_cursor(state, project, after):
+        return base64.urlsafe_b64encode(json.dumps([state, project, after]).encode()).decode()
+
+    @classmethod
+    def _decode_cursor(cls, cursor):
+        try:
+            state, project, after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError) as e:
+            raise error.Error(code=http.OK, message=b"cursor is invalid: %b" % cursor.encode()) from e
+        if state not in cls.states or not isinstance(project, (str, type(None))) or not cls._valid_after(state, after):
+            raise error.Error(code=http.OK, message=b"cursor is invalid: %b" % cursor.encode())
+        return state, project, after
+
+    @staticmethod
+    def _valid_after(state, after):
+        # The positions that _pending(), _running() and list_page() return, so that a crafted position can't cause a
+        # TypeError when it's compared with a job.
+        def number(value):
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+        if after is None:
+            return True
+        if not isinstance(after, list):
+            # MemoryJobStorage's position is the number of a job.
+            return state in ("finished", "expired") and number(after)
+        try:
+            key, tiebreaker = after
+        except ValueError:
+            return False
+        if state == "pending":  # [rank, id] or [-rank, sequence number]
+            return number(key) and number(tiebreaker)
+        if state == "running":  # [start time, job]
+            return isinstance(key, str) and isinstance(tiebreaker, str)
+        return isinstance(key, str) and number(tiebreaker)  # [end time, id]
+
+
+class ExportJobs(ListJobs):
+    """
+    .. versionadded:: 1.5.0
+    """
+
+    # The number of jobs to read from storage at a time.
+    chunk_size = 1000
+
+    @param("project", required=False)
+    @param("state", required=False)
+    @param("spider", required=False)
+    @param("since", required=False)
+    @param("until", required=False)
+    def render_GET(self, txrequest, project, state, spider, since, until):
+        if project is not None and project not in self.root.poller.queues:
+            raise error.Error(code=http.OK, message=b"project '%b' not found" % project.encode())
+        if state is not None and state not in self.states:
+            raise error.Error(code=http.OK, message=b"state is invalid: %b" % state.encode())
+        since = get_timestamp("since", since)
+        until = get_timestamp("until", until)
+
+        # The response is written as the jobs are read, without Content-Length, so that memory use doesn't grow with
+        # the number of jobs.
+        self._headers(txrequest, "application/x-ndjson")
+        producer = Backpressure()
+        txrequest.registerProducer(producer, streaming=True)
+        # The client can disconnect before the response is written.
+        txrequest.notifyFinish().addErrback(lambda _: producer.stopProducing())
+
+        readers = []
+        for name in self.states if state is None else (state,):
+            readers.extend((name, reader) for reader in self._readers(name, project, spider, since, until))
+        self._export(txrequest, producer, readers)
+        return server.NOT_DONE_YET
+
+    @inlineCallbacks
+    def _export(self, txrequest, producer, readers):
+        try:
+            for state, reader in readers:
+                after = None
+                while True:
+                    yield producer.wait()
+                    if producer.stopped:
+                        return
+                    jobs, after = yield maybeDeferred(reader, after)
+                    if producer.stopped:
+                        return
+                    if jobs:
+                        txrequest.write(
+                            b"".join(
+                                self.json_encoder.encode({"state": state, **job}).encode() + b"\n" for job in jobs
+                            )
+                        )
+                    if after is None:
+                        break
+        except Exception:  # noqa: BLE001
+            log.failure("")
+            # Close the connection without ending the response, so that the client doesn't mistake it for complete.
+            txrequest.unregisterProducer()
+            txrequest.loseConnection()
+        else:
+            txrequest.unregisterProducer()
+            txrequest.finish()
+
+    def _readers(self, state, project, spider, since, until):
+        # A reader returns a chunk of jobs, and the position at which to continue, or None.
+        if state == "pending":
+            queues = self.root.poller.queues
+            return [
+                functools.partial(self._read_pending, queue_name, spider, since, until)
+                for queue_name in (sorted(queues) if project is None else [project])
+            ]
+        if state == "running":
+            return [functools.partial(self._read_running, project, spider, since, until)]
+        return [functools.partial(self._read_finished, state, project, spider, since, until)]
+
+    @inlineCallbacks
+    def _read_pending(self, project, spider, since, until, after):
+        queue = self.root.poller.queues[project]
+        messages, after = yield maybeDeferred(queue.list_page, self.chunk_size, after, spider, since, until)
+        return [pending_job(project, message) for message in messages], after
+
+    def _read_running(self, project, spider, since, until, after):
+        processes, after = self._running(self.chunk_size, after, project, spider, since, until)
+        return [process.asdict() for process in processes], after
+
+    @inlineCallbacks
+    def _read_finished(self, outcome, project, spider, since, until, after):
+        rows, after = yield maybeDeferred(
+            self.root.launcher.finished.list_page,
+            self.chunk_size,
+            after,
+            project,
+            spider,
+            None if since is None else datetime.fromtimestamp(since),
+            None if until is None else datetime.fromtimestamp(until),
+            outcome,
+        )
+        return [(finished_job if outcome == "finished" else expired_job)(job) for job in rows], after
 
 
 class DeleteProject(WsResource):
     @param("project")
     def render_POST(self, txrequest, project):
         self._delete_version(project)
-        spider_list.delete(project)
+        spider_list.delete(project, store=self.root.spider_lists)
         return {"node_name": self.root.nodename, "status": "ok"}
 
     def _delete_version(self, project, version=None):
@@ -409,5 +1163,5 @@ class DeleteVersion(DeleteProject):
     @param("version")
     def render_POST(self, txrequest, project, version):
         self._delete_version(project, version)
-        spider_list.delete(project, version)
+        spider_list.delete(project, version, store=self.root.spider_lists)
         return {"node_name": self.root.nodename, "status": "ok"}
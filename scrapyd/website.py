@@ -1,15 +1,20 @@
 import socket
 from datetime import datetime, timedelta
+from functools import cached_property
 from html import escape
 from urllib.parse import quote, urlparse
 
 from scrapy.utils.misc import load_object
 from twisted.application.service import IServiceCollection
+from twisted.internet.defer import DeferredSemaphore, inlineCallbacks, maybeDeferred
 from twisted.python import filepath
-from twisted.web import resource, static
+from twisted.web import resource, server, static
 
+from scrapyd import sqlite
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.interfaces import IEggStorage, IPoller, ISpiderScheduler
 from scrapyd.utils import job_items_url, job_log_url
+from scrapyd.webservice import SPIDER_DISCOVERY, spider_list
 
 
 class PrefixHeaderMixin:
@@ -138,6 +143,12 @@ class Root(resource.Resource):
         self.prefix_header = config.get("prefix_header")
         self.local_items = items_dir and (urlparse(items_dir).scheme.lower() in ["", "file"])
         self.nodename = config.get("node_name", socket.gethostname())
+        self.config = config
+        spider_list.maxsize = config.getint("spider_list_cache_size", 1000)
+        self.spider_discovery = config.get("spider_discovery", "sync")
+        if self.spider_discovery not in SPIDER_DISCOVERY:
+            raise InvalidOptionError("spider_discovery", self.spider_discovery, SPIDER_DISCOVERY)
+        spider_list.workers = DeferredSemaphore(config.getint("spider_discovery_workers", 2))
 
         self.putChild(b"", Home(self, self.local_items))
         if logs_dir:
@@ -153,6 +164,12 @@ class Root(resource.Resource):
         self.poller.update_projects()
         self.scheduler.update_projects()
 
+    @cached_property
+    def spider_lists(self):
+        # The output of "scrapy list", by project and version, which is kept across restarts. The database is opened
+        # on first use, so that it isn't created if no spiders are listed.
+        return sqlite.initialize(sqlite.SqliteSpiderLists, self.config, "spiderlists", "spider_lists")
+
     @property
     def launcher(self):
         app = IServiceCollection(self.app, self.app)
@@ -319,8 +336,7 @@ class Jobs(PrefixHeaderMixin, resource.Resource):
                     "Cancel": cancel_button(project=project, jobid=message["_job"], base_path=self.base_path),
                 }
             )
-            for project, queue in self.root.poller.queues.items()
-            for message in queue.list()
+            for project, message in self.pending
         )
 
     def prep_tab_running(self):
@@ -351,17 +367,49 @@ class Jobs(PrefixHeaderMixin, resource.Resource):
                     "Start": microsec_trunc(job.start_time),
                     "Runtime": microsec_trunc(job.end_time - job.start_time),
                     "Finish": microsec_trunc(job.end_time),
-                    "Log": f'<a href="{self.base_path}{job_log_url(job)}">Log</a>',
-                    "Items": f'<a href="{self.base_path}{job_items_url(job)}">Items</a>',
+                    # A job that expired before it started has no log or items.
+                    **(
+                        {"Log": "Expired"}
+                        if getattr(job, "outcome", "finished") == "expired"
+                        else {
+                            "Log": f'<a href="{self.base_path}{job_log_url(job)}">Log</a>',
+                            "Items": f'<a href="{self.base_path}{job_items_url(job)}">Items</a>',
+                        }
+                    ),
                 }
             )
-            for job in self.root.launcher.finished
+            for job in self.finished
         )
 
     def render(self, txrequest):
+        # Spider queues and job storage can return deferreds. The deferred has fired already if they don't.
+        deferred = self.get_jobs()
+        if deferred.called:
+            return deferred.addCallback(self.prep_response, txrequest).result
+
+        deferred.addCallback(self.prep_response, txrequest).addCallback(self._finish, txrequest)
+        deferred.addErrback(txrequest.processingFailed)
+        return server.NOT_DONE_YET
+
+    @inlineCallbacks
+    def get_jobs(self):
+        pending = []
+        for project, queue in self.root.poller.queues.items():
+            pending.extend((project, message) for message in (yield maybeDeferred(queue.list)))
+        finished = yield maybeDeferred(self.root.launcher.finished.list)
+        return pending, finished
+
+    def prep_response(self, jobs, txrequest):
+        self.pending, self.finished = jobs
         self.base_path = self.get_base_path(txrequest)
         doc = self.prep_doc()
         txrequest.setHeader("Content-Type", "text/html; charset=utf-8")
         doc = doc.encode()
         txrequest.setHeader("Content-Length", str(len(doc)))
         return doc
+
+    def _finish(self, doc, txrequest):
+        # The client can disconnect before the deferred fires.
+        if txrequest.channel is not None:
+            txrequest.write(doc)
+            txrequest.finish()
@@ -2,6 +2,9 @@ import io
 import os.path
 import pkgutil
 
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
 
 def get_egg_data(basename):
     return pkgutil.get_data("tests", f"fixtures/{basename}.egg")
@@ -13,3 +16,16 @@ def has_settings():
 
 def root_add_version(root, project, version, basename):
     root.eggstorage.put(io.BytesIO(get_egg_data(basename)), project, version)
+
+
+def get_result(value):
+    """Return the result of a deferred that has fired, or the value if it isn't a deferred."""
+    if not isinstance(value, Deferred):
+        return value
+
+    results = []
+    value.addBoth(results.append)
+    assert results, "the deferred has not fired"
+    if isinstance(results[0], Failure):
+        results[0].raiseException()
+    return results[0]
@@ -8,7 +8,7 @@ from twisted.web.test.requesthelper import DummyChannel
 
 from scrapyd import Config
 from scrapyd.app import application
-from scrapyd.webservice import spider_list
+from scrapyd.webservice import SpiderList, spider_list
 from scrapyd.website import Root
 from tests import root_add_version
 
@@ -18,6 +18,11 @@ BASEDIR = os.path.abspath(os.path.dirname(__file__))
 @pytest.fixture(autouse=True)
 def _clear_spider_list_cache():
     spider_list.cache.clear()
+    spider_list.counters.clear()
+    spider_list.running.clear()
+    spider_list.running_digests.clear()
+    spider_list.statuses.clear()
+    spider_list.maxsize = SpiderList.maxsize
 
 
 @pytest.fixture()
@@ -1,6 +1,7 @@
 import io
 import os.path
 from contextlib import closing
+from unittest.mock import MagicMock
 
 import pytest
 from zope.interface import implementer
@@ -140,6 +141,20 @@ def test_get_many(eggstorage, version, expected):
     assert (version, data) == expected
 
 
+def test_put_durable(eggstorage, monkeypatch):
+    fsync = MagicMock(wraps=os.fsync)
+    monkeypatch.setattr("os.fsync", fsync)
+    eggstorage.put(io.BytesIO(b"egg01"), "mybot", "01")
+    eggstorage.put(io.BytesIO(b"egg02"), "mybot", "01")
+
+    version, data = eggstorage.get("mybot", "01")
+    with closing(data):
+        assert data.read() == b"egg02"
+    assert os.listdir(os.path.join(eggstorage.basedir, "mybot")) == ["01.egg"]
+    # The egg, and the directory if supported.
+    assert fsync.call_count == (4 if hasattr(os, "O_DIRECTORY") else 2)
+
+
 @pytest.mark.parametrize(
     ("versions", "expected"),
     [(["ddd", "abc", "bcaa"], ["abc", "bcaa", "ddd"]), (["9", "2", "200", "3", "4"], ["2", "3", "4", "9", "200"])],
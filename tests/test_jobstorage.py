@@ -1,10 +1,13 @@
 import datetime
+import threading
+from types import SimpleNamespace
 
+from twisted.internet.defer import inlineCallbacks
 from zope.interface.verify import verifyObject
 
 from scrapyd.config import Config
 from scrapyd.interfaces import IJobStorage
-from scrapyd.jobstorage import Job, MemoryJobStorage, SqliteJobStorage
+from scrapyd.jobstorage import Job, MemoryJobStorage, SqliteJobStorage, ThreadedSqliteJobStorage
 
 job1 = Job("p1", "s1", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 7))
 job2 = Job("p2", "s2", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 8))
@@ -58,3 +61,127 @@ class TestJobStorage:
         assert len(jobstorage) == 2
         assert actual == list(jobstorage)
         assert actual == [job3, job2]
+
+    def test_add_many(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+        job4 = Job("p4", "s4", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 10), outcome="expired")
+
+        jobstorage.add_many([job1, job2, job3, job4])
+
+        assert len(jobstorage) == 3
+        assert jobstorage.list() == [job4, job3, job2]
+        assert jobstorage.list()[0].outcome == "expired"
+
+    def test_add_many_expired(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+        expired = [
+            Job("p1", "s1", job=f"e{i}", end_time=datetime.datetime(2001, 2, 3, 4, 5, 7, i), outcome="expired")
+            for i in range(5)
+        ]
+
+        jobstorage.add_many([job1, job2])
+        jobstorage.add_many(expired)
+
+        # The last jobs of each outcome are kept, so that expired jobs don't remove the jobs that ran.
+        assert jobstorage.list() == [expired[4], expired[3], job2, job1]
+        assert jobstorage.count() == 4
+        assert jobstorage.count("finished") == 2
+        assert jobstorage.count("expired") == 2
+        assert jobstorage.list_page(outcome="finished") == ([job2, job1], None)
+        assert jobstorage.list_page(1, outcome="expired")[0] == [expired[4]]
+
+    def test_count_get_job(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+        job4 = Job("p1", "s4", job="j1", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 10))
+        job5 = Job("p2", "s5", job="j1", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 11))
+
+        assert jobstorage.count() == 0
+        assert jobstorage.get_job("j1") is None
+
+        jobstorage.add_many([job4, job5])
+
+        assert jobstorage.count() == 2
+        assert jobstorage.get_job("j1") == job5
+        assert jobstorage.get_job("j1", "p1") == job4
+        assert jobstorage.get_job("j1", "p3") is None
+
+    def test_list_page(self, cls, tmpdir):
+        jobstorage = cls(Config(values={"dbs_dir": tmpdir, "finished_to_keep": "4"}))
+        job4 = Job("p1", "s2", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 10))
+
+        jobstorage.add_many([job1, job2, job3, job4])
+        jobs, after = jobstorage.list_page(3)
+
+        assert jobs == [job4, job3, job2]
+
+        jobstorage.add(Job("p5", "s5", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 11)))  # removes job1
+        jobs, after = jobstorage.list_page(3, after)
+
+        assert jobs == []
+        assert after is None
+        assert jobstorage.list_page(project="p1") == ([job4], None)
+        assert jobstorage.list_page(spider="s3") == ([job3], None)
+        assert jobstorage.list_page(
+            since=datetime.datetime(2001, 2, 3, 4, 5, 6, 9), until=datetime.datetime(2001, 2, 3, 4, 5, 6, 11)
+        ) == ([job4, job3], None)
+
+
+class TestThreadedJobStorage:
+    scenarios = (("threaded", ThreadedSqliteJobStorage),)
+
+    def test_interface(self, cls, tmpdir):
+        verifyObject(IJobStorage, cls(config(tmpdir)))
+
+    @inlineCallbacks
+    def test_add(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+
+        yield jobstorage.add(job1)
+        yield jobstorage.add(job2)
+        yield jobstorage.add(job3)
+
+        assert (yield jobstorage.list()) == [job3, job2]
+
+    @inlineCallbacks
+    def test_add_many(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+
+        yield jobstorage.add_many([job1, job2, job3])
+
+        assert (yield jobstorage.list()) == [job3, job2]
+
+    @inlineCallbacks
+    def test_list_page(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+
+        yield jobstorage.add_many([job1, job2, job3])
+
+        assert (yield jobstorage.list_page(1)) == ([job3], [str(job3.end_time), 3])
+
+    @inlineCallbacks
+    def test_count_get_job(self, cls, tmpdir):
+        jobstorage = cls(config(tmpdir))
+        job4 = Job("p1", "s4", job="j1", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 10))
+
+        yield jobstorage.add_many([job1, job4])
+
+        assert (yield jobstorage.count()) == 2
+        assert (yield jobstorage.get_job("j1", "p1")) == job4
+
+    @inlineCallbacks
+    def test_len_iter(self, cls, tmpdir, monkeypatch):
+        jobstorage = cls(config(tmpdir))
+        yield jobstorage.add_many([job1, job2])
+        threads = []
+        execute = jobstorage.jobs.conn.execute
+        monkeypatch.setattr(
+            jobstorage.jobs,
+            "conn",
+            SimpleNamespace(execute=lambda *args: threads.append(threading.current_thread()) or execute(*args)),
+        )
+
+        assert len(jobstorage) == 2
+        assert list(jobstorage) == [job2, job1]
+        # The SQL statements run in the SQLite thread, not in the reactor thread.
+        assert threads
+        assert threading.current_thread() not in threads
@@ -8,8 +8,9 @@ from twisted.python import failure
 
 from scrapyd import __version__
 from scrapyd.config import Config
-from scrapyd.interfaces import IEnvironment
-from scrapyd.launcher import Launcher, get_crawl_args
+from scrapyd.interfaces import IEnvironment, IPoller
+from scrapyd.launcher import Launcher, ScrapyProcessProtocol, get_crawl_args
+from scrapyd.spiderqueue import SqliteSpiderQueue
 from tests import has_settings
 
 
@@ -108,6 +109,63 @@ def test_spawn_process(launcher, message, expected):
         assert "SCRAPY_SETTINGS_MODULE" not in process.env
 
 
+def test_spawn_process_latency(launcher, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 12.5)
+
+    with capturedLogs() as captured:
+        launcher._spawn_process({"_project": "p1", "_spider": "s1", "_job": "j1", "_scheduled": 10.0}, 0)  # noqa: SLF001
+
+    process = launcher.processes[0]
+
+    assert process.latency == 2.5
+    assert not any("_scheduled" in arg for arg in process.args)
+    assert captured[-1]["log_level"] == LogLevel.info
+    assert (
+        message(captured[-1:])
+        == "[Launcher] Process spawned 2.500s after scheduling: project='p1' spider='s1' job='j1'"
+    )
+
+
+def test_spawn_process_latency_unknown(process):
+    assert process.latency is None
+
+
+def test_process_finished(app, launcher, monkeypatch):
+    polls = []
+    monkeypatch.setattr(app.getComponent(IPoller), "poll", lambda: polls.append(None))
+    # The process isn't spawned, so that the callback runs once, when the deferred fires.
+    process = ScrapyProcessProtocol("p1", "s1", "j1", {}, [])
+    process.deferred.addBoth(launcher._process_finished, 0)  # noqa: SLF001
+    launcher.processes[0] = process
+
+    process.deferred.callback(process)
+
+    assert launcher.processes == {}
+    assert process.end_time is not None
+    assert polls == [None]  # the freed slot is filled without waiting for the timer
+
+
+def test_expire(app, launcher, monkeypatch):
+    config = Config()
+    queues = {"p1": SqliteSpiderQueue(config, "p1"), "p2": SqliteSpiderQueue(config, "p2")}
+    monkeypatch.setattr(app.getComponent(IPoller), "queues", queues)
+    monkeypatch.setattr("time.time", lambda: 100)
+    queues["p1"].add("s1", _job="j1", _expires=90)
+    queues["p1"].add("s2", _job="j2", _expires=110)
+    queues["p2"].add("s3", _job="j3")
+
+    with capturedLogs() as captured:
+        launcher.expire()
+
+    assert queues["p1"].list() == [{"name": "s2", "_job": "j2", "_expires": 110}]
+    assert queues["p2"].count() == 1
+    assert [(job.project, job.spider, job.job, job.outcome) for job in launcher.finished] == [
+        ("p1", "s1", "j1", "expired")
+    ]
+    assert len(captured) == 1
+    assert message(captured) == "[Launcher] Expired 1 pending jobs: project='p1' jobs=['j1']"
+
+
 def test_out_received(process):
     with capturedLogs() as captured:
         process.outReceived(b"out\n")
@@ -0,0 +1,374 @@
+import errno
+import os
+
+import pytest
+from twisted.internet.defer import inlineCallbacks
+
+from scrapyd.config import Config
+from scrapyd.memory import JournaledPriorityQueue, initialize
+
+
+def messages(q):
+    return list(q)
+
+
+def fill(q):
+    q.put({"name": "s1", "_job": "j1"}, priority=1)
+    q.put_many([({"name": "s2", "_job": "j2"}, 5), ({"name": "s3", "_job": "j3"}, 0), ("message", 5)])
+    q.put({"name": "s4", "_job": "j4"}, priority=1)
+    assert q.pop() == {"name": "s2", "_job": "j2"}
+    assert q.remove_job("j3") == 1
+    assert q.remove(lambda message: message == "message") == 1
+    q.put({"name": "s5", "_job": "j1"}, priority=2)
+
+
+expected = [({"name": "s5", "_job": "j1"}, 2), ({"name": "s1", "_job": "j1"}, 1), ({"name": "s4", "_job": "j4"}, 1)]
+
+
+@pytest.fixture()
+def directory(tmpdir):
+    return str(tmpdir)
+
+
+def test_initialize_shared(tmpdir):
+    config = Config(values={"dbs_dir": str(tmpdir)})
+
+    assert initialize(config, "p1") is initialize(config, "p1")
+    assert initialize(config, "p1") is not initialize(config, "p2")
+
+
+def test_memory():
+    q = JournaledPriorityQueue()
+    fill(q)
+
+    assert messages(q) == expected
+    assert len(q) == 3
+    assert q.next_priority() == 2
+    assert q.get_job("j1") == {"name": "s1", "_job": "j1"}
+    assert q.get_job("j2") is None
+
+
+def test_order():
+    q = JournaledPriorityQueue()
+    q.put_many([(i, i % 3) for i in range(9)])
+
+    assert q.pop_many(9) == [2, 5, 8, 1, 4, 7, 0, 3, 6]
+
+
+def test_pop_skip():
+    q = JournaledPriorityQueue()
+    q.put_many([({"name": "s1", "_job": "j1"}, 1), ({"name": "s2", "_job": "j2"}, 1), ({"name": "s1"}, 0)])
+
+    assert q.pop_many(3, lambda spider, max_proc: spider == "s1") == [{"name": "s2", "_job": "j2"}]
+    assert messages(q) == [({"name": "s1", "_job": "j1"}, 1), ({"name": "s1"}, 0)]
+
+
+def test_dedupe():
+    q = JournaledPriorityQueue()
+
+    assert q.put_many([({"_job": "j1", "_dedupe": "k1"}, 1), ({"_job": "j2", "_dedupe": "k1"}, 0), ("m", 1)]) == [
+        "j1",
+        "j1",
+        None,
+    ]
+    assert q.put({"_job": "j3", "_dedupe": "k1"}, priority=2) == "j1"  # the priority is raised
+
+    assert messages(q) == [({"_job": "j1", "_dedupe": "k1"}, 2), ("m", 1)]
+    assert q.next_priority() == 2
+
+    # The outdated heap item isn't popped, even if the message is skipped.
+    assert q.pop_many(2, lambda spider, max_proc: spider is None) == []
+    assert q.pop_many(3) == [{"_job": "j1", "_dedupe": "k1"}, "m"]
+    assert q.put({"_job": "j4", "_dedupe": "k1"}) == "j4"
+
+
+def test_recover_dedupe(directory):
+    q = JournaledPriorityQueue(directory)
+    q.put({"_job": "j1", "_dedupe": "k1"})
+    q.put("m", priority=1)
+    q.put({"_job": "j2", "_dedupe": "k1"}, priority=2)
+    q.sync()
+
+    recovered = JournaledPriorityQueue(directory)
+
+    assert messages(recovered) == [({"_job": "j1", "_dedupe": "k1"}, 2), ("m", 1)]
+    assert recovered.put({"_job": "j3", "_dedupe": "k1"}) == "j1"
+
+
+def test_expires(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JournaledPriorityQueue()
+    q.put_many(
+        [
+            ({"_job": "j1", "_expires": 110}, 5),
+            ({"_job": "j2", "_expires": 150, "_dedupe": "k"}, 1),
+            ({"_job": "j3"}, 0),
+            ({"_job": "j4", "_expires": 120}, 0),
+        ]
+    )
+    q.put({"_job": "j5", "_expires": 200, "_dedupe": "k"})  # extends the expiry
+    q.put({"_job": "j6", "_expires": 120, "_dedupe": "k"})  # doesn't shorten the expiry
+    q.remove_job("j4")
+
+    assert q.remove_expired() == []
+
+    monkeypatch.setattr("time.time", lambda: 160)
+
+    assert len(q) == 3
+    assert q.next_priority() == 1
+    assert q.remove_expired() == [{"_job": "j1", "_expires": 110}]
+    assert len(q) == 2
+    assert q.pop_many(3) == [{"_job": "j2", "_expires": 200, "_dedupe": "k"}, {"_job": "j3"}]
+
+
+def test_recover_expires(directory, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JournaledPriorityQueue(directory)
+    q.put({"_job": "j1", "_expires": 110, "_dedupe": "k"})
+    q.put({"_job": "j2", "_expires": 150, "_dedupe": "k"})
+    q.put({"_job": "j3", "_expires": 120})
+    q.sync()
+
+    recovered = JournaledPriorityQueue(directory)
+    monkeypatch.setattr("time.time", lambda: 130)
+
+    assert recovered.remove_expired() == [{"_job": "j3", "_expires": 120}]
+    assert messages(recovered) == [({"_job": "j1", "_expires": 150, "_dedupe": "k"}, 0)]
+
+
+def test_not_before(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JournaledPriorityQueue()
+    q.put_many(
+        [
+            ({"_job": "j1", "_not_before": 150}, 5),
+            ({"_job": "j2", "_not_before": 100}, 1),
+            ({"_job": "j3", "_not_before": 120, "_dedupe": "k"}, 3),
+            ({"_job": "j4", "_not_before": 130}, 0),
+            ({"_job": "j5"}, 0),
+        ]
+    )
+    q.put({"_job": "j6", "_dedupe": "k"}, priority=4)  # raises the priority of a delayed message
+    q.remove_job("j4")
+
+    assert len(q) == 4
+    assert q.next_priority() == 1
+    assert q.next_due() == 120
+    assert q.pop_many(5) == [{"_job": "j2", "_not_before": 100}, {"_job": "j5"}]
+    assert q.next_priority() is None
+
+    monkeypatch.setattr("time.time", lambda: 140)
+
+    assert q.next_due() == 150
+    assert q.next_priority() == 4
+    assert q.pop_many(5) == [{"_job": "j3", "_not_before": 120, "_dedupe": "k"}]
+
+    monkeypatch.setattr("time.time", lambda: 150)
+
+    assert q.next_due() is None
+    assert q.pop_many(5) == [{"_job": "j1", "_not_before": 150}]
+
+
+def test_aging(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JournaledPriorityQueue(aging=10)
+    q.put("low", priority=0)
+    q.put({"_job": "delayed", "_not_before": 150}, priority=1)
+
+    monkeypatch.setattr("time.time", lambda: 125)
+    q.put("high", priority=2)  # 2 buckets later, the same effective priority as "low"
+    q.put("higher", priority=3)
+
+    assert q.next_priority() == 3
+    assert [message for message, _ in q][:3] == ["higher", "low", "high"]
+    assert [priority for _, priority in q] == [3, 0, 2, 1]  # the priorities don't change
+    assert q.list_page(2) == (["higher", "low"], [10, 0])
+    assert q.list_page(2, after=[10, 0]) == (["high", {"_job": "delayed", "_not_before": 150}], None)
+    assert q.pop_many(3) == ["higher", "low", "high"]
+
+    monkeypatch.setattr("time.time", lambda: 150)
+
+    # The delayed message ages from the time at which it's due.
+    assert q.next_priority() == 1
+    q.put({"_job": "j1", "_dedupe": "k"}, priority=0)
+    q.put({"_job": "j2", "_dedupe": "k"}, priority=5)  # the rank is raised as much as the priority
+
+    assert q.next_priority() == 5
+    assert q.pop_many(2) == [{"_job": "j1", "_dedupe": "k"}, {"_job": "delayed", "_not_before": 150}]
+
+
+def test_recover_aging_changed(directory, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JournaledPriorityQueue(directory, aging=10)
+    q.put("low", priority=0)
+    monkeypatch.setattr("time.time", lambda: 200)
+    q.put("high", priority=5)
+    q.sync()
+
+    assert [message for message, _ in JournaledPriorityQueue(directory, aging=10)] == ["low", "high"]
+    assert [message for message, _ in JournaledPriorityQueue(directory)] == ["high", "low"]  # without aging
+    assert [message for message, _ in JournaledPriorityQueue(directory, aging=100)] == ["high", "low"]
+
+
+def test_recover(directory):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+    q.sync()
+
+    recovered = JournaledPriorityQueue(directory)
+
+    assert messages(recovered) == expected
+    assert recovered.get_job("j1") == {"name": "s1", "_job": "j1"}
+    assert recovered.get_job("j3") is None
+    assert recovered.next_priority() == 2
+
+    # New messages are added after the recovered messages.
+    recovered.put("new", priority=1)
+
+    assert recovered.pop_many(4) == [
+        {"name": "s5", "_job": "j1"},
+        {"name": "s1", "_job": "j1"},
+        {"name": "s4", "_job": "j4"},
+        "new",
+    ]
+
+
+def test_recover_twice(directory):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+    q.sync()
+
+    recovered = JournaledPriorityQueue(directory)
+    recovered.pop()
+    recovered.put("new")
+    recovered.sync()
+
+    assert messages(JournaledPriorityQueue(directory)) == [*expected[1:], ("new", 0)]
+
+
+def test_recover_clear(directory):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+    q.clear()
+    q.put("message")
+    q.sync()
+
+    assert messages(JournaledPriorityQueue(directory)) == [("message", 0)]
+
+
+def test_recover_partial_record(directory):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+    q.sync()
+    # The process crashed while writing a record.
+    with open(os.path.join(directory, "queue.journal.0"), "a") as f:
+        f.write('[["+",99,0,{"na')
+
+    recovered = JournaledPriorityQueue(directory)
+
+    assert messages(recovered) == expected
+
+    recovered.put("new")
+    recovered.sync()
+
+    # The new record isn't appended after the partial record.
+    assert messages(JournaledPriorityQueue(directory)) == [*expected, ("new", 0)]
+
+
+def test_buffer(directory):
+    q = JournaledPriorityQueue(directory)
+    q.put("message")
+
+    # The record is encoded and written at the next sync.
+    assert q.buffer == [["+", 0, 0, "message", q.messages[0][2]]]
+    assert os.listdir(directory) == []
+
+    q.sync()
+
+    assert q.buffer == []
+    assert messages(JournaledPriorityQueue(directory)) == [("message", 0)]
+
+
+def test_recover_unsynced(directory):
+    q = JournaledPriorityQueue(directory)
+    q.put("synced")
+    q.sync()
+    q.journal.write('[["+",1,0,"unsynced",0]]\n')  # buffered, not written, when the machine crashes
+
+    assert messages(JournaledPriorityQueue(directory)) == [("synced", 0)]
+
+
+def test_recover_files(directory):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+    q.sync()
+
+    JournaledPriorityQueue(directory)
+
+    # The journal is replaced by a snapshot.
+    assert sorted(os.listdir(directory)) == ["queue.snapshot"]
+
+
+def test_no_directory(directory):
+    q = JournaledPriorityQueue(None)
+    fill(q)
+    q.sync()
+
+    assert q.journal is None
+    assert os.listdir(directory) == []
+
+
+@inlineCallbacks
+def test_compact(directory):
+    q = JournaledPriorityQueue(directory)
+    q.compact_records = 4
+    fill(q)
+
+    assert q.compacting is not None
+
+    yield q.compacting
+    q.sync()
+
+    assert q.generation == 1
+    assert sorted(os.listdir(directory)) == ["queue.journal.1", "queue.snapshot"]
+    assert messages(JournaledPriorityQueue(directory)) == expected
+
+
+@inlineCallbacks
+def test_compact_snapshot_error(directory, monkeypatch):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+
+    def write_snapshot(generation, messages):
+        with open(os.path.join(directory, "queue.snapshot.tmp"), "w") as f:
+            f.write("[1]\n[0,")
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(q, "_write_snapshot", write_snapshot)
+    yield q.compact()
+    q.put("new")
+    q.sync()
+
+    assert q.compacting is None
+    # The process crashed while writing the snapshot. The previous journal is kept.
+    assert sorted(os.listdir(directory)) == ["queue.journal.0", "queue.journal.1", "queue.snapshot.tmp"]
+    assert messages(JournaledPriorityQueue(directory)) == [*expected, ("new", 0)]
+
+
+@inlineCallbacks
+def test_compact_remove_journals_error(directory, monkeypatch):
+    q = JournaledPriorityQueue(directory)
+    fill(q)
+
+    # The process crashed after writing the snapshot, before removing the previous journal.
+    monkeypatch.setattr(q, "_remove_journals", lambda generation: None)
+    yield q.compact()
+    q.pop()
+    q.sync()
+
+    assert sorted(os.listdir(directory)) == ["queue.journal.0", "queue.journal.1", "queue.snapshot"]
+
+    recovered = JournaledPriorityQueue(directory)
+
+    assert messages(recovered) == expected[1:]
+    assert sorted(os.listdir(directory)) == ["queue.snapshot"]
@@ -0,0 +1,48 @@
+import os
+import sys
+
+from scrapyd.config import Config
+from scrapyd.migrate import main
+from scrapyd.spiderqueue import SharedSqliteSpiderQueue, SqliteSpiderQueue
+
+
+def test_import(chdir, capsys, monkeypatch):
+    config = Config()
+    for project in ("p1", "p2"):
+        os.makedirs(os.path.join("eggs", project))
+    SqliteSpiderQueue(config, "p1").add_many([("s1", 0, {"_job": "j1"}), ("s2", 1, {"_job": "j2"})])
+    monkeypatch.setattr(sys, "argv", ["scrapyd.migrate"])
+
+    main()
+
+    assert capsys.readouterr().out == "p1: 2 pending jobs moved\n"
+    assert SharedSqliteSpiderQueue(config, "p1").count() == 2
+
+
+def test_reencode(chdir, capsys, monkeypatch):
+    config = Config()
+    for project in ("p1", "p2"):
+        os.makedirs(os.path.join("eggs", project))
+    queue = SqliteSpiderQueue(config, "p1")
+    queue.add_many([("s1", 0, {"_job": "j1"}), ("s2", 1, {"_job": "j2"})])
+    monkeypatch.setattr(sys, "argv", ["scrapyd.migrate", "--reencode"])
+
+    main()
+
+    assert capsys.readouterr().out == "p1: 2 pending jobs encoded\np2: 0 pending jobs encoded\n"
+    # The codec setting is json, in the current directory.
+    assert all(message[:1] == b"{" for (message,) in queue.q.conn.execute("SELECT message FROM spider_queue"))
+
+
+def test_reencode_unpickle(chdir, capsys, monkeypatch):
+    config = Config()
+    os.makedirs(os.path.join("eggs", "p1"))
+    SqliteSpiderQueue(Config(values={"sqlite_codec": "pickle"}), "p1").add("s1", _job="j1")
+    queue = SqliteSpiderQueue(config, "p1")
+    monkeypatch.setattr(sys, "argv", ["scrapyd.migrate", "--reencode", "--unpickle"])
+
+    main()
+
+    assert capsys.readouterr().out == "p1: 1 pending jobs encoded\n"
+    assert [message[:1] for (message,) in queue.q.conn.execute("SELECT message FROM spider_queue")] == [b"{"]
+    assert queue.list() == [{"name": "s1", "_job": "j1"}]
@@ -1,25 +1,41 @@
 import os
+from collections import Counter
+from random import Random
+from types import SimpleNamespace
 
 import pytest
+from twisted.internet import task
 from twisted.internet.defer import Deferred
 from zope.interface.verify import verifyObject
 
 from scrapyd.config import Config
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.interfaces import IPoller
 from scrapyd.poller import QueuePoller
+from scrapyd.scheduler import SpiderScheduler
 from scrapyd.utils import get_spider_queues
 
 
 @pytest.fixture()
-def poller(tmpdir):
+def config(tmpdir):
     eggs_dir = os.path.join(tmpdir, "eggs")
     dbs_dir = os.path.join(tmpdir, "dbs")
-    config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
     os.makedirs(os.path.join(eggs_dir, "mybot1"))
     os.makedirs(os.path.join(eggs_dir, "mybot2"))
+    return Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
+
+
+@pytest.fixture()
+def poller(config):
     return QueuePoller(config)
 
 
+def get_messages(poller, n):
+    deferreds = [poller.next() for _ in range(n)]
+    poller.poll()
+    return [(d.result["_project"], d.result["_spider"]) for d in deferreds if hasattr(d, "result")]
+
+
 def test_interface(poller):
     verifyObject(IPoller, poller)
 
@@ -80,3 +96,427 @@ def test_poll_empty(poller):
     assert hasattr(value, "result")
     assert getattr(value, "called", False)
     assert value.result is None
+
+
+def test_dispatch_policy_invalid(config):
+    config.cp.set(Config.SECTION, "dispatch_policy", "nonexistent")
+
+    with pytest.raises(InvalidOptionError) as exc:
+        QueuePoller(config)
+
+    assert str(exc.value) == (
+        "The `dispatch_policy` option must be one of project, priority, fair, not 'nonexistent'. Check and update the "
+        "Scrapyd configuration file."
+    )
+
+
+def test_poll_priority(config):
+    config.cp.set(Config.SECTION, "dispatch_policy", "priority")
+    poller = QueuePoller(config)
+    queues = get_spider_queues(config)
+
+    queues["mybot1"].add_many([("s1", 0, {}), ("s2", 0, {}), ("s3", 5, {})])
+    queues["mybot2"].add_many([("s4", 10, {}), ("s5", 5, {}), ("s6", 0, {})])
+
+    assert get_messages(poller, 2) == [("mybot2", "s4"), ("mybot1", "s3")]
+    # The projects take turns among messages with the same priority.
+    assert get_messages(poller, 10) == [("mybot2", "s5"), ("mybot1", "s1"), ("mybot2", "s6"), ("mybot1", "s2")]
+    assert get_messages(poller, 1) == []
+
+
+def test_poll_priority_heap(chdir, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    config = Config()
+    config.cp.set(Config.SECTION, "dispatch_policy", "priority")
+    for project in ("p1", "p2", "p3"):
+        os.makedirs(os.path.join("eggs", project))
+    poller = QueuePoller(config)
+    scheduler = SpiderScheduler(config)
+    scheduler.poller = poller
+    poller.active = scheduler.active
+    queried = []
+    for project, queue in poller.queues.items():
+        next_priority = queue.next_priority
+        queue.next_priority = lambda next_priority=next_priority, project=project: (
+            queried.append(project) or next_priority()
+        )
+    queues = get_spider_queues(config)
+    queues["p1"].add_many([("s1", 5, {}), ("s2", 0, {})])
+    queues["p2"].add_many([("s3", 3, {}), ("s4", 1, {})])
+
+    # The heap is built on the first poll.
+    assert get_messages(poller, 1) == [("p1", "s1")]
+    assert sorted(queried) == ["p1", "p1", "p2", "p3"]
+
+    # A freed slot queries only the next priority of the popped project.
+    queried.clear()
+
+    assert get_messages(poller, 1) == [("p2", "s3")]
+    assert queried == ["p2"]
+
+    # Scheduling a job queries only the next priority of its project.
+    queried.clear()
+    deferred = poller.next()
+    scheduler.schedule("p3", "s5", priority=2)
+
+    assert deferred.result["_spider"] == "s5"
+    assert queried == ["p3", "p3"]
+
+    queried.clear()
+
+    assert get_messages(poller, 3) == [("p2", "s4"), ("p1", "s2")]
+    assert queried == ["p2", "p1"]
+
+    # The heap is rebuilt once the poll rescan interval elapses.
+    queried.clear()
+    now[0] += 60
+
+    assert get_messages(poller, 1) == []
+    assert sorted(queried) == ["p1", "p2", "p3"]
+
+
+def test_poll_project(poller):
+    queues = get_spider_queues(poller.config)
+    first, second = poller.queues  # os.listdir() in FilesystemEggStorage.list_projects() uses an arbitrary order.
+
+    queues[first].add_many([("s1", 0, {}), ("s2", 0, {})])
+    queues[second].add_many([("s3", 10, {})])
+
+    # The first project is drained before the second, regardless of priority.
+    assert get_messages(poller, 2) == [(first, "s1"), (first, "s2")]
+    assert get_messages(poller, 2) == [(second, "s3")]
+
+
+def test_poll_fair_simulation(chdir):
+    weights = {"p1": 3, "p2": 2, "p3": 1}
+    max_proc = 12
+
+    config = Config()
+    config.cp.set(Config.SECTION, "dispatch_policy", "fair")
+    config.cp.add_section("project_weights")
+    for project, weight in weights.items():
+        os.makedirs(os.path.join("eggs", project))
+        config.cp.set("project_weights", project, str(weight))
+        get_spider_queues(config)[project].add_many([("s", 0, {}) for _ in range(1000)])
+
+    poller = QueuePoller(config)
+    random = Random(0)  # noqa: S311
+    occupancy = Counter()
+    ends = {}
+    deferreds = {slot: poller.next() for slot in range(max_proc)}
+    for tick in range(1000):
+        poller.poll()
+        for slot, deferred in deferreds.items():
+            if hasattr(deferred, "result"):
+                poller.processes[slot] = SimpleNamespace(project=deferred.result["_project"], spider="s")
+                ends[slot] = tick + random.randint(1, 20)  # jobs have different durations
+                deferreds[slot] = None
+
+        occupancy.update(process.project for process in poller.processes.values())
+
+        for slot, end in list(ends.items()):
+            if end == tick:
+                del poller.processes[slot]
+                del ends[slot]
+                deferreds[slot] = poller.next()
+        deferreds = {slot: deferred for slot, deferred in deferreds.items() if deferred is not None}
+
+    total = sum(occupancy.values())
+    for project, weight in weights.items():
+        assert occupancy[project] / total == pytest.approx(weight / sum(weights.values()), abs=0.01)
+
+
+def test_poll_fair_weight_zero(chdir):
+    config = Config()
+    config.cp.set(Config.SECTION, "dispatch_policy", "fair")
+    config.cp.add_section("project_weights")
+    config.cp.set("project_weights", "p1", "0")
+    for project in ("p1", "p2"):
+        os.makedirs(os.path.join("eggs", project))
+        get_spider_queues(config)[project].add_many([("s", 0, {}) for _ in range(2)])
+
+    poller = QueuePoller(config)
+
+    assert get_messages(poller, 3) == [("p2", "s"), ("p2", "s"), ("p1", "s")]
+
+
+@pytest.mark.parametrize("dispatch_policy", ["project", "priority", "fair"])
+def test_poll_max_proc(chdir, dispatch_policy):
+    config = Config()
+    config.cp.set(Config.SECTION, "dispatch_policy", dispatch_policy)
+    config.cp.add_section("project_max_proc")
+    config.cp.set("project_max_proc", "p2", "1")
+    config.cp.add_section("spider_max_proc")
+    config.cp.set("spider_max_proc", "P1.S1", "1")  # case-insensitive
+    for project in ("P1", "p2"):
+        os.makedirs(os.path.join("eggs", project))
+    queues = get_spider_queues(config)
+    queues["P1"].add_many([("S1", 1, {"_job": "j1"}), ("S1", 1, {"_job": "j2"}), ("s2", 0, {"_job": "j3"})])
+    queues["p2"].add_many([("s1", 0, {"_job": "j4"}), ("s1", 0, {"_job": "j5"})])
+
+    poller = QueuePoller(config)
+    deferreds = [poller.next() for _ in range(10)]
+
+    def get_fired():
+        fired = sorted((d.result["_project"], d.result["_spider"]) for d in deferreds if hasattr(d, "result"))
+        deferreds[:] = [d for d in deferreds if not hasattr(d, "result")]
+        return fired
+
+    poller.poll()
+
+    assert get_fired() == [("P1", "S1"), ("P1", "s2"), ("p2", "s1")]
+    assert [message["_job"] for message in queues["P1"].list()] == ["j2"]
+    assert [message["_job"] for message in queues["p2"].list()] == ["j5"]
+
+    # The running jobs count towards the limits.
+    poller.processes = {0: SimpleNamespace(project="P1", spider="S1"), 1: SimpleNamespace(project="p2", spider="s1")}
+    poller.poll()
+
+    assert get_fired() == []
+
+    poller.processes = {}
+    poller.poll()
+
+    assert get_fired() == [("P1", "S1"), ("p2", "s1")]
+
+
+def test_poll_max_proc_job(poller):
+    queues = get_spider_queues(poller.config)
+    queues["mybot1"].add("s1", _job="j1", _max_proc=2, _dedupe="k")
+    queues["mybot1"].add("s1", _job="j2", _max_proc=2)
+    queues["mybot1"].add("s1", _job="j3", _max_proc=1)
+    queues["mybot1"].add("s1", _job="j4")
+    poller.processes = {0: SimpleNamespace(project="mybot1", spider="s1")}
+
+    deferreds = [poller.next() for _ in range(10)]
+    poller.poll()
+    messages = [deferred.result for deferred in deferreds if hasattr(deferred, "result")]
+
+    # The job's limit and deduplication key aren't passed to the spider.
+    assert messages == [
+        {"_project": "mybot1", "_spider": "s1", "_job": "j1"},
+        {"_project": "mybot1", "_spider": "s1", "_job": "j4"},
+    ]
+    assert [message["_job"] for message in queues["mybot1"].list()] == ["j2", "j3"]
+
+
+def test_poll_no_capacity(poller):
+    queues = get_spider_queues(poller.config)
+    queues["mybot1"].add("spider1")
+
+    value = poller.poll()
+
+    assert hasattr(value, "result")
+    assert value.result is None
+    assert queues["mybot1"].count() == 1
+
+
+def test_poll_schedule(poller):
+    scheduler = SpiderScheduler(poller.config)
+    scheduler.poller = poller
+    deferred = poller.next()
+
+    scheduler.schedule("mybot1", "spider1", _job="j1")
+
+    assert deferred.result["_job"] == "j1"  # the job is dispatched without waiting for the timer
+
+
+def test_poll_pop_many(poller):
+    queues = get_spider_queues(poller.config)
+    queues["mybot1"].add_many([("spider1", 0, {}) for _ in range(3)])
+    queues["mybot2"].add_many([("spider2", 0, {}) for _ in range(3)])
+    calls = []
+    for project in ("mybot1", "mybot2"):
+        queue = poller.queues[project]
+        pop_many = queue.pop_many
+        queue.pop_many = lambda n, skip=None, pop_many=pop_many, project=project: (
+            calls.append((project, n)) or pop_many(n, skip)
+        )
+
+    first, second = poller.queues
+
+    assert len(get_messages(poller, 5)) == 5
+    # Each project's queue is popped once, for the number of free slots.
+    assert calls == [(first, 5), (second, 2)]
+    assert queues[first].count() == 0
+    assert queues[second].count() == 1
+
+
+def test_poll_serialized(poller):
+    queues = get_spider_queues(poller.config)
+    queues["mybot1"].add_many([("spider1", 0, {}) for _ in range(3)])
+    pops = []
+    queue = poller.queues["mybot1"]
+    pop_many = queue.pop_many
+    queue.pop_many = lambda n, skip=None: pops.append(Deferred()) or pops[-1].addCallback(lambda _: pop_many(n, skip))
+    for project in poller.queues:
+        if project != "mybot1":
+            poller.queues[project].pop_many = lambda n, skip=None: []
+    deferreds = [poller.next() for _ in range(2)]
+
+    poller.poll()
+    poller.poll()  # the queue returns a deferred that hasn't fired yet
+
+    assert len(pops) == 1
+
+    pops[0].callback(None)
+
+    # The second poll ran after the first, and found no free slots, instead of popping messages for the same slots.
+    assert len(pops) == 1
+    assert [d.result["_project"] for d in deferreds] == ["mybot1", "mybot1"]
+    assert queues["mybot1"].count() == 1
+
+
+@pytest.mark.parametrize("dispatch_policy", ["project", "priority", "fair"])
+def test_poll_active(chdir, monkeypatch, dispatch_policy):
+    now = [100.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    config = Config()
+    config.cp.set("scrapyd", "dispatch_policy", dispatch_policy)
+    for project in ("mybot1", "mybot2"):
+        os.makedirs(os.path.join("eggs", project))
+    poller = QueuePoller(config)
+    scheduler = SpiderScheduler(config)
+    scheduler.poller = poller
+    poller.active = scheduler.active
+    queried = []
+    for project, queue in poller.queues.items():
+        next_priority = queue.next_priority
+        queue.next_priority = lambda next_priority=next_priority, project=project: (
+            queried.append(project) or next_priority()
+        )
+
+    scheduler.schedule("mybot1", "spider1")
+    scheduler.schedule("mybot1", "spider1")
+
+    assert get_messages(poller, 1) == [("mybot1", "spider1")]
+    # All projects are polled the first time, and those without pending jobs are no longer active.
+    assert "mybot2" in queried
+    assert poller.ready == {"mybot1"}
+
+    queried.clear()
+    deferred = poller.next()
+    poller.poll()
+
+    assert deferred.result["_project"] == "mybot1"
+    assert "mybot2" not in queried
+
+    deferred = poller.next()
+    poller.poll()
+
+    assert not hasattr(deferred, "result")
+    assert "mybot2" not in queried
+    assert poller.ready == set()
+
+    # Scheduling a job makes its project active.
+    scheduler.schedule("mybot2", "spider2")
+
+    assert deferred.result["_project"] == "mybot2"
+
+    # A job added by other means is found once the poll rescan interval elapses.
+    get_spider_queues(config)["mybot1"].add("spider1")
+
+    deferred = poller.next()
+    poller.poll()
+
+    assert not hasattr(deferred, "result")
+
+    now[0] += 60
+    poller.poll()
+
+    assert deferred.result["_project"] == "mybot1"
+
+
+@pytest.mark.parametrize("dispatch_policy", ["project", "priority", "fair"])
+def test_poll_timer_idle(chdir, monkeypatch, dispatch_policy):
+    now = [100.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    config = Config()
+    config.cp.set("scrapyd", "dispatch_policy", dispatch_policy)
+    config.cp.set("scrapyd", "poll_rescan_interval", "30")
+    projects = [f"mybot{i}" for i in range(10)]
+    for project in projects:
+        os.makedirs(os.path.join("eggs", project))
+    poller = QueuePoller(config)
+    queried = []
+    for project, queue in poller.queues.items():
+        for method in ("next_priority", "pop_many"):
+            function = getattr(queue, method)
+            setattr(
+                queue,
+                method,
+                lambda *args, function=function, project=project, **kwargs: (
+                    queried.append(project) or function(*args, **kwargs)
+                ),
+            )
+    # The "project" policy visits the projects in order, until there are no free slots.
+    busy = list(poller.queues)[-1]
+    get_spider_queues(config)[busy].add_many([("spider1", 0, {}) for _ in range(10)])
+    deferreds = [poller.next() for _ in range(2)]
+
+    # The first tick checks all projects.
+    poller.poll()
+
+    assert {d.result["_project"] for d in deferreds} == {busy}
+    assert set(queried) == set(projects)
+
+    # The next ticks, every poll_interval, check only the project with pending jobs.
+    for _ in range(5):
+        queried.clear()
+        now[0] += 5
+        deferred = poller.next()
+        poller.poll()
+
+        assert deferred.result["_project"] == busy
+        assert set(queried) == {busy}
+
+    # Once the poll rescan interval elapses, a tick checks all projects.
+    queried.clear()
+    now[0] += 5
+    for _ in range(10):
+        poller.next()
+    poller.poll()
+
+    assert set(queried) == set(projects)
+
+
+@pytest.mark.parametrize("dispatch_policy", ["project", "priority", "fair"])
+def test_poll_not_before(chdir, monkeypatch, dispatch_policy):
+    now = [100.0]
+    monkeypatch.setattr("time.time", lambda: now[0])
+    clock = task.Clock()
+    monkeypatch.setattr("scrapyd.poller.reactor", clock)
+    config = Config()
+    config.cp.set("scrapyd", "dispatch_policy", dispatch_policy)
+    for project in ("mybot1", "mybot2"):
+        os.makedirs(os.path.join("eggs", project))
+    poller = QueuePoller(config)
+    queues = get_spider_queues(config)
+    queues["mybot1"].add("spider1", _job="j1", _not_before=130, _scheduled=90)
+    queues["mybot2"].add("spider2", _job="j2", _not_before=110)
+    queues["mybot2"].add("spider2", _job="j3", _not_before=90)
+
+    deferreds = [poller.next() for _ in range(3)]
+    poller.poll()
+
+    # A job that's due is popped. The poller wakes up when the next delayed job is due.
+    assert deferreds[0].result == {"_project": "mybot2", "_spider": "spider2", "_job": "j3"}
+    assert poller.due == {"mybot1": 130, "mybot2": 110}
+    assert poller.ready == set()
+    assert [call.getTime() for call in clock.getDelayedCalls()] == [10]
+
+    now[0] = 110
+    clock.advance(10)
+
+    assert deferreds[1].result == {"_project": "mybot2", "_spider": "spider2", "_job": "j2"}
+    assert poller.due == {"mybot1": 130}
+    assert [call.getTime() for call in clock.getDelayedCalls()] == [30]
+
+    now[0] = 130
+    clock.advance(20)
+
+    # The time between scheduling and starting a delayed job is measured from when it's due.
+    assert deferreds[2].result == {"_project": "mybot1", "_spider": "spider1", "_job": "j1", "_scheduled": 130}
+    assert poller.due == {}
+    assert clock.getDelayedCalls() == []
@@ -1,16 +1,20 @@
 import os
+from types import SimpleNamespace
 
 import pytest
 from zope.interface.verify import verifyObject
 
 from scrapyd.config import Config
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.interfaces import ISpiderScheduler
 from scrapyd.scheduler import SpiderScheduler
 from scrapyd.utils import get_spider_queues
+from tests import get_result
 
 
 @pytest.fixture()
-def scheduler(tmpdir):
+def scheduler(tmpdir, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1.5)
     eggs_dir = os.path.join(tmpdir, "eggs")
     dbs_dir = os.path.join(tmpdir, "dbs")
     config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
@@ -48,6 +52,94 @@ def test_schedule(scheduler):
     scheduler.schedule("mybot2", "myspider2", 1, c="d")
     scheduler.schedule("mybot2", "myspider3", 10, e="f")
 
-    assert mybot1_queue.pop() == {"name": "myspider1", "a": "b"}
-    assert mybot2_queue.pop() == {"name": "myspider3", "e": "f"}
-    assert mybot2_queue.pop() == {"name": "myspider2", "c": "d"}
+    assert mybot1_queue.pop() == {"name": "myspider1", "a": "b", "_scheduled": 1.5}
+    assert mybot2_queue.pop() == {"name": "myspider3", "e": "f", "_scheduled": 1.5}
+    assert mybot2_queue.pop() == {"name": "myspider2", "c": "d", "_scheduled": 1.5}
+
+
+def test_schedule_scheduled(scheduler):
+    queue = get_spider_queues(scheduler.config)["mybot1"]
+
+    scheduler.schedule("mybot1", "myspider1", _scheduled="abc")
+
+    assert queue.pop() == {"name": "myspider1", "_scheduled": 1.5}
+
+
+def test_schedule_many(scheduler):
+    queue = get_spider_queues(scheduler.config)["mybot1"]
+
+    scheduler.schedule_many("mybot1", [("myspider1", 2, {"a": "b"}), ("myspider2", 10, {"c": "d"})])
+
+    assert queue.count() == 2
+    assert queue.pop() == {"name": "myspider2", "c": "d", "_scheduled": 1.5}
+    assert queue.pop() == {"name": "myspider1", "a": "b", "_scheduled": 1.5}
+
+
+def test_schedule_poll(scheduler):
+    polls = []
+    scheduler.poller = SimpleNamespace(poll=lambda: polls.append(None))
+
+    scheduler.schedule("mybot1", "myspider1")
+
+    assert len(polls) == 1
+    assert scheduler.active == {"mybot1"}
+
+    scheduler.schedule_many("mybot2", [("myspider1", 0, {}), ("myspider2", 0, {})])
+
+    assert len(polls) == 2
+    assert scheduler.active == {"mybot1", "mybot2"}
+
+
+def test_schedule_dedupe(chdir):
+    config = Config()
+    config.cp.add_section("project_dedupe")
+    config.cp.set("project_dedupe", "MyBot1", "spider_args")  # case-insensitive
+    for project in ("mybot1", "mybot2"):
+        os.makedirs(os.path.join("eggs", project))
+    scheduler = SpiderScheduler(config)
+    queue = get_spider_queues(config)["mybot1"]
+
+    assert get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j1", a="b")) == "j1"
+    assert get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j2", a="c")) == "j2"
+    assert get_result(scheduler.schedule("mybot1", "myspider2", 0, _job="j3", a="b")) == "j3"
+    assert get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j4", a="b", _max_proc=1)) == "j1"
+    assert get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j5", a="b", _dedupe="k")) == "j5"
+    assert get_result(scheduler.schedule_many("mybot1", [("myspider1", 0, {"_job": "j6", "a": "c"})])) == ["j2"]
+    assert get_result(scheduler.schedule("mybot2", "myspider1", 0, _job="j7", a="b")) == "j7"
+    assert get_result(scheduler.schedule("mybot2", "myspider1", 0, _job="j8", a="b")) == "j8"
+
+    assert [message["_job"] for message in queue.list()] == ["j1", "j2", "j3", "j5"]
+
+
+def test_schedule_dedupe_invalid(chdir):
+    config = Config()
+    config.cp.add_section("project_dedupe")
+    config.cp.set("project_dedupe", "mybot1", "spider")
+
+    with pytest.raises(InvalidOptionError) as exc:
+        SpiderScheduler(config)
+
+    assert str(exc.value) == (
+        "The `project_dedupe.mybot1` option must be one of off, spider_args, not 'spider'. Check and update the "
+        "Scrapyd configuration file."
+    )
+
+
+def test_schedule_expires_after(chdir, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    config = Config()
+    config.cp.add_section("project_expires_after")
+    config.cp.set("project_expires_after", "MyBot1", "60")  # case-insensitive
+    for project in ("mybot1", "mybot2"):
+        os.makedirs(os.path.join("eggs", project))
+    scheduler = SpiderScheduler(config)
+    queues = get_spider_queues(config)
+
+    get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j1"))
+    get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j2", _not_before=200))
+    get_result(scheduler.schedule("mybot1", "myspider1", 0, _job="j3", _expires=120))
+    get_result(scheduler.schedule_many("mybot1", [("myspider1", 0, {"_job": "j4"})]))
+    get_result(scheduler.schedule("mybot2", "myspider1", 0, _job="j5"))
+
+    assert [message.get("_expires") for message in queues["mybot1"].list()] == [160, 260, 120, 160]
+    assert [message.get("_expires") for message in queues["mybot2"].list()] == [None]
@@ -69,6 +69,7 @@ def test_error():
         ("daemonstatus", "GET"),
         ("addversion", "POST"),
         ("schedule", "POST"),
+        ("schedulebatch", "POST"),
         ("cancel", "POST"),
         ("status", "GET"),
         ("listprojects", "GET"),
@@ -1,10 +1,20 @@
+import os
+
 import pytest
 from twisted.internet.defer import inlineCallbacks, maybeDeferred
 from zope.interface.verify import verifyObject
 
 from scrapyd.config import Config
+from scrapyd.exceptions import UntrustedCodecError
 from scrapyd.interfaces import ISpiderQueue
-from scrapyd.spiderqueue import SqliteSpiderQueue
+from scrapyd.spiderqueue import (
+    MemorySpiderQueue,
+    SharedSqliteSpiderQueue,
+    SqliteSpiderQueue,
+    ThreadedSqliteSpiderQueue,
+    import_spider_queues,
+    reencode_spider_queues,
+)
 
 spider_args = {
     "arg1": "val1",
@@ -15,9 +25,12 @@ expected = spider_args.copy()
 expected["name"] = "spider1"
 
 
-@pytest.fixture()
-def spiderqueue():
-    return SqliteSpiderQueue(Config(values={"dbs_dir": ":memory:"}), "quotesbot")
+@pytest.fixture(params=[SqliteSpiderQueue, SharedSqliteSpiderQueue, ThreadedSqliteSpiderQueue, MemorySpiderQueue])
+def spiderqueue(request, tmpdir):
+    if request.param is SqliteSpiderQueue:
+        return SqliteSpiderQueue(Config(values={"dbs_dir": ":memory:"}), "quotesbot")
+    # A shared in-memory database (or a memory queue) would be shared across tests.
+    return request.param(Config(values={"dbs_dir": str(tmpdir)}), "quotesbot")
 
 
 def test_interface(spiderqueue):
@@ -37,6 +50,85 @@ def test_pop(spiderqueue):
     assert (yield maybeDeferred(spiderqueue.count)) == 2
 
 
+@inlineCallbacks
+def test_pop_many(spiderqueue):
+    yield maybeDeferred(spiderqueue.add_many, [("spider0", 5, {}), ("spider1", 10, spider_args), ("spider2", 0, {})])
+
+    assert (yield maybeDeferred(spiderqueue.pop_many, 2)) == [expected, {"name": "spider0"}]
+    assert (yield maybeDeferred(spiderqueue.pop_many, 2)) == [{"name": "spider2"}]
+    assert (yield maybeDeferred(spiderqueue.pop_many, 2)) == []
+
+
+@inlineCallbacks
+def test_add_many(spiderqueue):
+    yield maybeDeferred(spiderqueue.add_many, [("spider0", 5, {}), ("spider1", 10, spider_args), ("spider1", 0, {})])
+
+    assert (yield maybeDeferred(spiderqueue.count)) == 3
+
+    assert (yield maybeDeferred(spiderqueue.pop)) == expected
+
+
+@inlineCallbacks
+def test_add_dedupe(spiderqueue):
+    assert (yield maybeDeferred(spiderqueue.add, "spider1", 0, _job="j1", _dedupe="k")) == "j1"
+    assert (yield maybeDeferred(spiderqueue.add, "spider2", 0, _job="j2")) == "j2"
+    assert (yield maybeDeferred(spiderqueue.add, "spider1", 5, _job="j3", _dedupe="k")) == "j1"
+    assert (yield maybeDeferred(spiderqueue.add_many, [("spider1", 1, {"_job": "j4", "_dedupe": "k"})])) == ["j1"]
+
+    assert (yield maybeDeferred(spiderqueue.count)) == 2
+    assert (yield maybeDeferred(spiderqueue.pop)) == {"name": "spider1", "_job": "j1", "_dedupe": "k"}
+
+    # A job can be added again once the duplicate job is no longer pending.
+    assert (yield maybeDeferred(spiderqueue.add, "spider1", 0, _job="j5", _dedupe="k")) == "j5"
+
+
+@inlineCallbacks
+def test_next_due(spiderqueue, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+
+    assert (yield maybeDeferred(spiderqueue.next_due)) is None
+
+    yield maybeDeferred(spiderqueue.add, "spider1", 0, _not_before=150)
+    yield maybeDeferred(spiderqueue.add, "spider2", 5, _not_before=120)
+    yield maybeDeferred(spiderqueue.add, "spider3", 0)
+
+    assert (yield maybeDeferred(spiderqueue.next_due)) == 120
+    assert (yield maybeDeferred(spiderqueue.next_priority)) == 0
+    assert (yield maybeDeferred(spiderqueue.pop_many, 3)) == [{"name": "spider3"}]
+
+
+@inlineCallbacks
+def test_remove_expired(spiderqueue, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+
+    yield maybeDeferred(spiderqueue.add, "spider1", 5, _job="j1", _expires=150)
+    yield maybeDeferred(spiderqueue.add, "spider2", 0, _job="j2", _expires=120)
+    yield maybeDeferred(spiderqueue.add, "spider3", 0, _job="j3")
+
+    assert (yield maybeDeferred(spiderqueue.remove_expired)) == []
+
+    monkeypatch.setattr("time.time", lambda: 130)
+
+    assert (yield maybeDeferred(spiderqueue.remove_expired)) == [{"name": "spider2", "_job": "j2", "_expires": 120}]
+    assert (yield maybeDeferred(spiderqueue.count)) == 2
+
+    monkeypatch.setattr("time.time", lambda: 150)
+
+    # An expired job isn't popped, even before it's removed.
+    assert (yield maybeDeferred(spiderqueue.pop_many, 3)) == [{"name": "spider3", "_job": "j3"}]
+    assert (yield maybeDeferred(spiderqueue.remove_expired)) == [{"name": "spider1", "_job": "j1", "_expires": 150}]
+
+
+@inlineCallbacks
+def test_next_priority(spiderqueue):
+    assert (yield maybeDeferred(spiderqueue.next_priority)) is None
+
+    yield maybeDeferred(spiderqueue.add, "spider0", 5)
+    yield maybeDeferred(spiderqueue.add, "spider1", 10, **spider_args)
+
+    assert (yield maybeDeferred(spiderqueue.next_priority)) == 10
+
+
 @inlineCallbacks
 def test_list(spiderqueue):
     assert (yield maybeDeferred(spiderqueue.list)) == []
@@ -47,6 +139,31 @@ def test_list(spiderqueue):
     assert (yield maybeDeferred(spiderqueue.list)) == [expected, expected]
 
 
+@inlineCallbacks
+def test_list_page(spiderqueue):
+    for i in range(5):
+        yield maybeDeferred(spiderqueue.add, f"spider{i % 2}", i // 2, _job=f"j{i}", _scheduled=i)
+
+    messages, after = yield maybeDeferred(spiderqueue.list_page, 3)
+
+    assert [message["_job"] for message in messages] == ["j4", "j2", "j3"]
+
+    messages, after = yield maybeDeferred(spiderqueue.list_page, 3, after)
+
+    assert [message["_job"] for message in messages] == ["j0", "j1"]
+    assert after is None
+
+    messages, after = yield maybeDeferred(spiderqueue.list_page, 1, None, "spider1", 0, 4)
+
+    assert messages == [{"name": "spider1", "_job": "j3", "_scheduled": 3}]
+
+    messages, after = yield maybeDeferred(spiderqueue.list_page, 1, after, "spider1", 0, 4)
+
+    assert messages == [{"name": "spider1", "_job": "j1", "_scheduled": 1}]
+    assert after is None
+    assert (yield maybeDeferred(spiderqueue.count)) == 5
+
+
 @inlineCallbacks
 def test_remove(spiderqueue):
     yield maybeDeferred(spiderqueue.add, "spider0", 5)
@@ -60,6 +177,20 @@ def test_remove(spiderqueue):
     assert (yield maybeDeferred(spiderqueue.count)) == 1
 
 
+@inlineCallbacks
+def test_get_job_remove_job(spiderqueue):
+    yield maybeDeferred(spiderqueue.add, "spider0", 5, _job="j0")
+    yield maybeDeferred(spiderqueue.add, "spider1", 10, _job="j1", **spider_args)
+
+    assert (yield maybeDeferred(spiderqueue.get_job, "j1")) == {"_job": "j1", **expected}
+    assert (yield maybeDeferred(spiderqueue.get_job, "j2")) is None
+
+    assert (yield maybeDeferred(spiderqueue.remove_job, "j1")) == 1
+
+    assert (yield maybeDeferred(spiderqueue.get_job, "j1")) is None
+    assert (yield maybeDeferred(spiderqueue.count)) == 1
+
+
 @inlineCallbacks
 def test_clear(spiderqueue):
     assert (yield maybeDeferred(spiderqueue.count)) == 0
@@ -72,3 +203,124 @@ def test_clear(spiderqueue):
     yield maybeDeferred(spiderqueue.clear)
 
     assert (yield maybeDeferred(spiderqueue.count)) == 0
+
+
+def test_shared(tmpdir):
+    config = Config(values={"dbs_dir": str(tmpdir)})
+    queue1 = SharedSqliteSpiderQueue(config, "p1")
+    queue2 = SharedSqliteSpiderQueue(config, "p2")
+
+    queue1.add("spider1", _job="j1")
+    queue2.add("spider2", _job="j1")
+
+    assert queue1.q.conn is queue2.q.conn
+    assert [name for name in os.listdir(tmpdir) if name.endswith(".db")] == ["spiderqueue.db"]
+    assert queue1.list() == [{"name": "spider1", "_job": "j1"}]
+    assert queue2.list() == [{"name": "spider2", "_job": "j1"}]
+
+    assert queue1.remove_job("j1") == 1
+    assert queue1.count() == 0
+    assert queue2.count() == 1
+
+
+@pytest.mark.parametrize("cls", [SqliteSpiderQueue, SharedSqliteSpiderQueue, MemorySpiderQueue])
+def test_priority_aging(cls, tmpdir, monkeypatch):
+    config = Config(values={"dbs_dir": str(tmpdir), "sqlite_priority_aging": "60"})
+    queue = cls(config, "p1")
+    monkeypatch.setattr("time.time", lambda: 0)
+    queue.add("spider1", 0)
+    monkeypatch.setattr("time.time", lambda: 600)
+    queue.add("spider2", 9)
+
+    assert queue.next_priority() == 10
+    assert queue.pop() == {"name": "spider1"}
+
+
+def test_import_spider_queues(tmpdir, monkeypatch):
+    eggs_dir = os.path.join(tmpdir, "eggs")
+    dbs_dir = os.path.join(tmpdir, "dbs")
+    config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir, "sqlite_priority_aging": "60"})
+    for project in ("p1", "p2", "p3"):
+        os.makedirs(os.path.join(eggs_dir, project))
+
+    monkeypatch.setattr("time.time", lambda: 0)
+    SqliteSpiderQueue(config, "p1").add_many([("s1", 0, {"_job": "j1"}), ("s2", 1, {"_job": "j2"})])
+    SqliteSpiderQueue(config, "p2").add("s3", _job="j3")
+    monkeypatch.setattr("time.time", lambda: 600)
+    SharedSqliteSpiderQueue(config, "p2").add("s4", 5, _job="j4")
+
+    assert import_spider_queues(config) == {"p1": 2, "p2": 1}
+
+    assert SqliteSpiderQueue(config, "p1").count() == 0
+    assert SqliteSpiderQueue(config, "p2").count() == 0
+    assert SharedSqliteSpiderQueue(config, "p1").list() == [{"name": "s2", "_job": "j2"}, {"name": "s1", "_job": "j1"}]
+    # The moved job aged from the time at which it was scheduled: its effective priority is 0 + 600 / 60.
+    assert SharedSqliteSpiderQueue(config, "p2").next_priority() == 10
+    assert SharedSqliteSpiderQueue(config, "p2").list() == [{"name": "s3", "_job": "j3"}, {"name": "s4", "_job": "j4"}]
+    assert SharedSqliteSpiderQueue(config, "p3").list() == []
+
+    # Running the import again moves nothing.
+    assert import_spider_queues(config) == {"p1": 0, "p2": 0}
+
+
+def test_import_spider_queues_interrupted(tmpdir):
+    eggs_dir = os.path.join(tmpdir, "eggs")
+    dbs_dir = os.path.join(tmpdir, "dbs")
+    config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
+    os.makedirs(os.path.join(eggs_dir, "p1"))
+
+    SqliteSpiderQueue(config, "p1").add_many([("s1", 0, {"_job": "j1"}), ("s2", 0, {"_job": "j2", "_dedupe": "d"})])
+    # The jobs were copied, but the source database wasn't cleared.
+    SharedSqliteSpiderQueue(config, "p1").add_many(
+        [("s1", 0, {"_job": "j1"}), ("s2", 0, {"_job": "j3", "_dedupe": "d"})]
+    )
+
+    assert import_spider_queues(config) == {"p1": 2}
+
+    assert SqliteSpiderQueue(config, "p1").count() == 0
+    assert SharedSqliteSpiderQueue(config, "p1").list() == [
+        {"name": "s1", "_job": "j1"},
+        {"name": "s2", "_job": "j3", "_dedupe": "d"},
+    ]
+
+
+def test_import_spider_queues_shared_database_name(tmpdir):
+    eggs_dir = os.path.join(tmpdir, "eggs")
+    dbs_dir = os.path.join(tmpdir, "dbs")
+    config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
+    for project in ("p1", "spiderqueue"):
+        os.makedirs(os.path.join(eggs_dir, project))
+
+    # The project's database is the shared database.
+    SqliteSpiderQueue(config, "spiderqueue").add("s1", _job="j1")
+    SharedSqliteSpiderQueue(config, "p1").add("s2", _job="j2")
+
+    assert import_spider_queues(config) == {"spiderqueue": 1}
+
+    assert SqliteSpiderQueue(config, "spiderqueue").count() == 0
+    assert SharedSqliteSpiderQueue(config, "spiderqueue").list() == [{"name": "s1", "_job": "j1"}]
+    assert SharedSqliteSpiderQueue(config, "p1").list() == [{"name": "s2", "_job": "j2"}]
+
+
+def test_reencode_spider_queues(tmpdir):
+    eggs_dir = os.path.join(tmpdir, "eggs")
+    dbs_dir = os.path.join(tmpdir, "dbs")
+    config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir})
+    for project in ("p1", "p2"):
+        os.makedirs(os.path.join(eggs_dir, project))
+
+    SqliteSpiderQueue(config, "p1").add_many(
+        [("s1", 0, {"_job": "j1", "a": "\N{SNOWMAN}"}), ("s2", 1, {"_job": "j2"})]
+    )
+
+    pickle_config = Config(values={"eggs_dir": eggs_dir, "dbs_dir": dbs_dir, "sqlite_codec": "pickle"})
+
+    assert reencode_spider_queues(pickle_config) == {"p1": 2, "p2": 0}
+
+    queue = SqliteSpiderQueue(pickle_config, "p1")
+
+    assert all(message[:2] == b"\x80\x04" for (message,) in queue.q.conn.execute("SELECT message FROM spider_queue"))
+    assert queue.list() == [{"name": "s2", "_job": "j2"}, {"name": "s1", "_job": "j1", "a": "\N{SNOWMAN}"}]
+    # A pickled job isn't decoded, unless the codec is pickle.
+    with pytest.raises(UntrustedCodecError):
+        SqliteSpiderQueue(config, "p1").list()
@@ -1,9 +1,12 @@
 import datetime
+import sqlite3
 
 import pytest
+from twisted.logger import capturedLogs
 
+from scrapyd.exceptions import InvalidMessageError, InvalidOptionError, UntrustedCodecError
 from scrapyd.jobstorage import Job
-from scrapyd.sqlite import JsonSqlitePriorityQueue, SqliteFinishedJobs
+from scrapyd.sqlite import JsonSqlitePriorityQueue, SqliteFinishedJobs, SqliteSpiderLists
 
 
 @pytest.fixture()
@@ -136,9 +139,793 @@ def test_sqlitefinishedjobs_clear_keep_2(sqlitefinishedjobs):
     assert len(sqlitefinishedjobs) == 2
 
 
+def test_sqlitefinishedjobs_outcome(tmpdir):
+    database = str(tmpdir.join("jobs.db"))
+    conn = sqlite3.connect(database)
+    conn.execute(
+        "CREATE TABLE finished_jobs "
+        "(id integer PRIMARY KEY, project text, spider text, job text, start_time datetime, end_time datetime)"
+    )
+    conn.execute(
+        "INSERT INTO finished_jobs (project, spider, job, start_time, end_time) VALUES (?, ?, ?, ?, ?)",
+        ("p1", "s1", "j1", "2001-02-03 04:05:06.000007", "2001-02-03 04:05:06.000007"),
+    )
+    conn.commit()
+    conn.close()
+
+    q = SqliteFinishedJobs(database)
+    q.add_many([Job("p2", "s2", "j2", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 8), outcome="expired")])
+
+    assert [(row[2], row[5]) for row in q] == [("j2", "expired"), ("j1", "finished")]
+
+
+def test_sqlitefinishedjobs_list_page(sqlitefinishedjobs):
+    sqlitefinishedjobs.add(Job("p1", "s3", end_time=datetime.datetime(2001, 2, 3, 4, 5, 6, 8)))
+
+    rows, after = sqlitefinishedjobs.list_page(2)
+
+    assert [row[:2] for row in rows] == [("p3", "s3"), ("p1", "s3")]  # the last job added is listed first, on a tie
+
+    rows, after = sqlitefinishedjobs.list_page(2, after)
+
+    assert [row[:2] for row in rows] == [("p2", "s2"), ("p1", "s1")]
+    assert after is None
+
+    assert [row[:2] for row in sqlitefinishedjobs.list_page(project="p1")[0]] == [("p1", "s3"), ("p1", "s1")]
+    assert [row[:2] for row in sqlitefinishedjobs.list_page(spider="s3")[0]] == [("p3", "s3"), ("p1", "s3")]
+    assert [
+        row[:2]
+        for row in sqlitefinishedjobs.list_page(
+            since=datetime.datetime(2001, 2, 3, 4, 5, 6, 8), until=datetime.datetime(2001, 2, 3, 4, 5, 6, 9)
+        )[0]
+    ] == [("p1", "s3"), ("p2", "s2")]
+
+
+@pytest.mark.parametrize(
+    ("query", "index"),
+    [
+        (
+            "SELECT id FROM {table} WHERE end_time <= ? AND (end_time < ? OR id < ?) ORDER BY end_time DESC, id DESC "
+            "LIMIT ?",
+            "end_time",
+        ),
+        ("SELECT id FROM {table} WHERE project = ? ORDER BY end_time DESC, id DESC LIMIT ?", "project_end_time"),
+    ],
+)
+def test_sqlitefinishedjobs_index(sqlitefinishedjobs, query, index):
+    table = sqlitefinishedjobs.table
+    query = query.format(table=table)
+    plan = " ".join(
+        row[-1] for row in sqlitefinishedjobs.conn.execute(f"EXPLAIN QUERY PLAN {query}", ("x",) * query.count("?"))
+    )
+
+    assert f"INDEX {table}_{index} " in plan
+    assert "TEMP B-TREE" not in plan
+
+
 def test_sqlitefinishedjobs__iter__(sqlitefinishedjobs):
     actual = list(sqlitefinishedjobs)
 
     assert (actual[0][0], actual[0][1]) == ("p3", "s3")
     assert (actual[1][0], actual[1][1]) == ("p2", "s2")
     assert (actual[2][0], actual[2][1]) == ("p1", "s1")
+
+
+def test_jsonsqlitepriorityqueue_pop_concurrent(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database, journal_mode="wal")
+    q2 = JsonSqlitePriorityQueue(database, journal_mode="wal")
+    for i in range(10):
+        q1.put(i)
+
+    out = []
+    while (message := q1.pop()) is not None:
+        out.append(message)
+        if (message := q2.pop()) is not None:
+            out.append(message)
+
+    assert sorted(out) == list(range(10))
+    assert len(q1) == len(q2) == 0
+
+
+def test_jsonsqlitepriorityqueue_pop_locked(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database)
+    q2 = JsonSqlitePriorityQueue(database)
+    q2.conn.execute("PRAGMA busy_timeout = 0")
+    q1.put("message")
+
+    q1.conn.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError, match="database is locked"):
+        q2.pop()
+    q1.conn.rollback()
+
+    assert q2.pop() == "message"
+
+
+@pytest.mark.parametrize(
+    ("journal_mode", "synchronous", "expected"),
+    [
+        (None, None, ("delete", 2)),
+        ("wal", "normal", ("wal", 1)),
+        ("TRUNCATE", "OFF", ("truncate", 0)),
+    ],
+)
+def test_sqlitemixin_pragmas(tmpdir, journal_mode, synchronous, expected):
+    q = JsonSqlitePriorityQueue(str(tmpdir.join("queue.db")), journal_mode=journal_mode, synchronous=synchronous)
+
+    assert q.conn.execute("PRAGMA journal_mode").fetchone()[0] == expected[0]
+    assert q.conn.execute("PRAGMA synchronous").fetchone()[0] == expected[1]
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "message"),
+    [
+        ({"journal_mode": "wal; DROP TABLE queue"}, "`sqlite_journal_mode` option must be one of delete, "),
+        ({"synchronous": "sometimes"}, "`sqlite_synchronous` option must be one of off, normal, full, extra, not "),
+    ],
+)
+def test_sqlitemixin_pragmas_invalid(kwargs, message):
+    with pytest.raises(InvalidOptionError, match=message):
+        JsonSqlitePriorityQueue(**kwargs)
+
+
+def test_jsonsqlitepriorityqueue_fifo(jsonsqlitepriorityqueue):
+    for i in range(5):
+        jsonsqlitepriorityqueue.put(f"low {i}", priority=1.0)
+        jsonsqlitepriorityqueue.put(f"high {i}", priority=2.0)
+
+    expected = [f"high {i}" for i in range(5)] + [f"low {i}" for i in range(5)]
+
+    assert [message for message, _ in jsonsqlitepriorityqueue] == expected
+    assert [jsonsqlitepriorityqueue.pop() for _ in range(10)] == expected
+
+
+@pytest.mark.parametrize(
+    ("query", "index"),
+    [
+        (
+            "SELECT id, message FROM {table} WHERE project IS ? ORDER BY rank DESC, id LIMIT 1",
+            "project_rank_id",
+        ),
+        (
+            "SELECT id, message FROM {table} WHERE project IS ? AND (not_before IS NULL OR not_before <= ?) "
+            "ORDER BY rank DESC, id LIMIT 1",
+            "project_rank_id",
+        ),
+        (
+            "SELECT rank FROM {table} WHERE project IS ? AND (not_before IS NULL OR not_before <= ?) "
+            "AND (expires IS NULL OR expires > ?) ORDER BY rank DESC, id LIMIT 1",
+            "project_rank_id",
+        ),
+        ("SELECT min(not_before) FROM {table} WHERE project IS ? AND not_before > ?", "project_not_before"),
+        ("SELECT 1 FROM {table} WHERE project IS ? AND expires <= ? LIMIT 1", "project_expires"),
+        ("SELECT message FROM {table} WHERE project IS ? AND expires <= ? ORDER BY expires, id", "project_expires"),
+        ("DELETE FROM {table} WHERE project IS ? AND expires <= ?", "project_expires"),
+        ("SELECT message FROM {table} WHERE job = ? AND project IS ? LIMIT 1", "job_project"),
+        ("DELETE FROM {table} WHERE job = ? AND project IS ?", "job_project"),
+        ("SELECT id, job FROM {table} WHERE ifnull(project, '') = ? AND dedupe = ?", "project_dedupe"),
+        (
+            "SELECT id, rank, message FROM {table} WHERE project IS ? AND rank <= ? AND (rank < ? OR id > ?) "
+            "ORDER BY rank DESC, id LIMIT ?",
+            "project_rank_id",
+        ),
+        (
+            "SELECT id, rank, message FROM {table} WHERE project IS ? AND spider = ? ORDER BY rank DESC, id LIMIT ?",
+            "project_spider_rank_id",
+        ),
+    ],
+)
+def test_jsonsqlitepriorityqueue_index(jsonsqlitepriorityqueue, query, index):
+    table = jsonsqlitepriorityqueue.table
+    query = query.format(table=table)
+    plan = " ".join(
+        row[-1]
+        for row in jsonsqlitepriorityqueue.conn.execute(f"EXPLAIN QUERY PLAN {query}", ("x",) * query.count("?"))
+    )
+
+    assert f"INDEX {table}_{index} " in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_jsonsqlitepriorityqueue_migrate(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE queue (id integer PRIMARY KEY, priority real key, message blob)")
+    conn.execute("INSERT INTO queue (priority, message) VALUES (1, ?)", (b'"existing"',))
+    conn.execute(
+        "INSERT INTO queue (priority, message) VALUES (0, ?)",
+        (b'{"name": "s1", "_job": "j1", "_max_proc": 2, "_version": "r1"}',),
+    )
+    conn.commit()
+    conn.close()
+
+    q = JsonSqlitePriorityQueue(database)
+
+    assert sorted(q.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")) == [
+        ("queue_job_project",),
+        ("queue_project_dedupe",),
+        ("queue_project_expires",),
+        ("queue_project_not_before",),
+        ("queue_project_rank_id",),
+        ("queue_project_spider_rank_id",),
+        ("queue_spider",),
+    ]
+    assert q.conn.execute("SELECT job, spider, max_proc, version FROM queue ORDER BY id").fetchall() == [
+        (None, None, None, None),
+        ("j1", "s1", 2, "r1"),
+    ]
+    assert q.get_job("j1") == {"name": "s1", "_job": "j1", "_max_proc": 2, "_version": "r1"}
+    assert q.pop() == "existing"
+
+    # The migration runs once.
+    JsonSqlitePriorityQueue(database)
+
+
+def test_jsonsqlitepriorityqueue_migrate_rank(tmpdir, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    database = str(tmpdir.join("queue.db"))
+    conn = sqlite3.connect(database)
+    conn.execute(
+        "CREATE TABLE queue (id integer PRIMARY KEY, priority real key, message blob, job text, spider text, "
+        "project text, max_proc integer, version text, dedupe text, not_before real, expires real)"
+    )
+    conn.execute("CREATE INDEX queue_project_priority_id ON queue (project, priority DESC, id)")
+    conn.execute("INSERT INTO queue (priority, message) VALUES (1, ?)", (b'"low"',))
+    conn.execute("INSERT INTO queue (priority, message, job) VALUES (2, ?, 'j1')", (b'{"_job":"j1","_scheduled":5}',))
+    conn.commit()
+    conn.close()
+
+    q = JsonSqlitePriorityQueue(database, aging=30)
+
+    assert ("queue_project_priority_id",) not in q.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    assert q.conn.execute("SELECT enqueued, rank, scheduled FROM queue ORDER BY id").fetchall() == [
+        (100, -2, None),
+        (100, -1, 5),
+    ]
+    assert q.pop_many(2) == [{"_job": "j1", "_scheduled": 5}, "low"]
+
+
+def test_jsonsqlitepriorityqueue_migrate_aging(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    JsonSqlitePriorityQueue(database, aging=10).put("message")
+
+    # If the schema and aging interval are unchanged, the queue is constructed without taking the write lock.
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    q = JsonSqlitePriorityQueue(database, aging=10)
+    conn.execute("ROLLBACK")
+
+    assert q.conn.execute("SELECT key, value FROM queue_meta").fetchall() == [("aging", 10)]
+
+    q = JsonSqlitePriorityQueue(database)
+
+    assert q.conn.execute("SELECT key, value FROM queue_meta").fetchall() == [("aging", 0)]
+
+
+def test_jsonsqlitepriorityqueue_migrate_version(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    conn = sqlite3.connect(database)
+    conn.execute(
+        "CREATE TABLE queue (id integer PRIMARY KEY, priority real key, message blob, job text, spider text, "
+        "project text, max_proc integer)"
+    )
+    conn.execute(
+        "INSERT INTO queue (priority, message, job, spider) VALUES (0, ?, 'j1', 's1')",
+        (b'{"name": "s1", "_job": "j1", "_version": "r1"}',),
+    )
+    conn.commit()
+    conn.close()
+
+    q = JsonSqlitePriorityQueue(database)
+
+    assert q.conn.execute("SELECT job, spider, max_proc, version FROM queue").fetchall() == [("j1", "s1", None, "r1")]
+
+
+def test_jsonsqlitepriorityqueue_put_many(jsonsqlitepriorityqueue):
+    jsonsqlitepriorityqueue.put_many([("message 1", 1.0), ("message 2", 2.0), ("message 3", 1.0)])
+
+    assert list(jsonsqlitepriorityqueue) == [("message 2", 2.0), ("message 1", 1.0), ("message 3", 1.0)]
+
+
+def test_jsonsqlitepriorityqueue_get_job_remove_job(jsonsqlitepriorityqueue):
+    jsonsqlitepriorityqueue.put({"name": "s1", "_job": "j1", "a": "b"})
+    jsonsqlitepriorityqueue.put({"name": "s1", "_job": "j2"})
+    jsonsqlitepriorityqueue.put({"name": "s2", "_job": "j1"}, priority=1.0)
+    jsonsqlitepriorityqueue.put("j1")
+
+    assert jsonsqlitepriorityqueue.get_job("j1") in (
+        {"name": "s1", "_job": "j1", "a": "b"},
+        {"name": "s2", "_job": "j1"},
+    )
+    assert jsonsqlitepriorityqueue.get_job("j2") == {"name": "s1", "_job": "j2"}
+    assert jsonsqlitepriorityqueue.get_job("nonexistent") is None
+
+    assert jsonsqlitepriorityqueue.remove_job("j1") == 2
+    assert jsonsqlitepriorityqueue.remove_job("j1") == 0
+
+    assert jsonsqlitepriorityqueue.get_job("j1") is None
+    assert list(jsonsqlitepriorityqueue) == [({"name": "s1", "_job": "j2"}, 0.0), ("j1", 0.0)]
+
+
+def test_jsonsqlitepriorityqueue_project(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database, project="p1", shared=True)
+    q2 = JsonSqlitePriorityQueue(database, project="p2", shared=True)
+    q = JsonSqlitePriorityQueue(database, shared=True)
+
+    assert q1.conn is q2.conn is q.conn
+
+    q1.put({"name": "s1", "_job": "j1"})
+    q2.put_many([({"name": "s2", "_job": "j1"}, 1.0), ({"name": "s2", "_job": "j2"}, 2.0)])
+
+    assert len(q1) == 1
+    assert len(q2) == 2
+    assert len(q) == 0
+    assert list(q1) == [({"name": "s1", "_job": "j1"}, 0.0)]
+    assert q1.get_job("j2") is None
+    assert q2.get_job("j2") == {"name": "s2", "_job": "j2"}
+
+    assert q1.remove_job("j1") == 1
+    assert len(q2) == 2
+
+    assert q2.remove(lambda message: message["_job"] == "j1") == 1
+    assert q2.pop() == {"name": "s2", "_job": "j2"}
+    assert q1.pop() is None
+
+    q1.put("message")
+    q2.clear()
+
+    assert len(q1) == 1
+
+
+def test_jsonsqlitepriorityqueue_next_priority(jsonsqlitepriorityqueue):
+    assert jsonsqlitepriorityqueue.next_priority() is None
+
+    jsonsqlitepriorityqueue.put("message 1", priority=1.0)
+    jsonsqlitepriorityqueue.put("message 2", priority=5.0)
+
+    assert jsonsqlitepriorityqueue.next_priority() == 5.0
+
+    jsonsqlitepriorityqueue.pop()
+
+    assert jsonsqlitepriorityqueue.next_priority() == 1.0
+
+
+def test_jsonsqlitepriorityqueue_pop_skip(jsonsqlitepriorityqueue):
+    jsonsqlitepriorityqueue.put({"name": "s1", "_job": "j1"}, priority=1.0)
+    jsonsqlitepriorityqueue.put({"name": "s2", "_job": "j2", "_max_proc": 1})
+    jsonsqlitepriorityqueue.put({"name": "s1", "_job": "j3"})
+    jsonsqlitepriorityqueue.put({"name": "s3", "_job": "j4", "_max_proc": 2})
+    calls = []
+
+    def skip(spider, max_proc):
+        calls.append((spider, max_proc))
+        return spider == "s1" or max_proc == 1
+
+    assert jsonsqlitepriorityqueue.pop(skip) == {"name": "s3", "_job": "j4", "_max_proc": 2}
+    assert calls == [("s1", None), ("s2", 1), ("s1", None), ("s3", 2)]
+    assert jsonsqlitepriorityqueue.pop(skip) is None
+    assert [message["_job"] for message, _ in jsonsqlitepriorityqueue] == ["j1", "j2", "j3"]
+    assert jsonsqlitepriorityqueue.pop(lambda spider, max_proc: False) == {"name": "s1", "_job": "j1"}
+
+
+def test_jsonsqlitepriorityqueue_pop_many(jsonsqlitepriorityqueue):
+    jsonsqlitepriorityqueue.put_many([(f"message {i}", i % 2) for i in range(6)])
+
+    assert jsonsqlitepriorityqueue.pop_many(0) == []
+    assert jsonsqlitepriorityqueue.pop_many(4) == ["message 1", "message 3", "message 5", "message 0"]
+    assert jsonsqlitepriorityqueue.pop_many(4) == ["message 2", "message 4"]
+    assert jsonsqlitepriorityqueue.pop_many(4) == []
+
+
+def test_jsonsqlitepriorityqueue_pop_many_skip(jsonsqlitepriorityqueue):
+    jsonsqlitepriorityqueue.put_many([({"name": name, "_job": str(i)}, 0) for i, name in enumerate("aabaab")])
+    taken = []
+
+    # Like the poller, count the messages that aren't skipped.
+    def skip(spider, max_proc):
+        if taken.count(spider) >= 2:
+            return True
+        taken.append(spider)
+        return False
+
+    assert [message["_job"] for message in jsonsqlitepriorityqueue.pop_many(10, skip)] == ["0", "1", "2", "5"]
+    assert [message["_job"] for message, _ in jsonsqlitepriorityqueue] == ["3", "4"]
+
+
+def test_jsonsqlitepriorityqueue_len_cached(jsonsqlitepriorityqueue):
+    statements = []
+    jsonsqlitepriorityqueue.conn.set_trace_callback(statements.append)
+
+    assert len(jsonsqlitepriorityqueue) == 0
+    assert sum("COUNT(*)" in statement for statement in statements) == 1
+
+    jsonsqlitepriorityqueue.put_many([({"name": "s1", "_job": "j1"}, 0), ({"name": "s1", "_job": "j2"}, 0)])
+    jsonsqlitepriorityqueue.put({"name": "s2", "_job": "j3"})
+    jsonsqlitepriorityqueue.put("message")
+
+    assert len(jsonsqlitepriorityqueue) == 4
+
+    jsonsqlitepriorityqueue.pop()
+
+    assert len(jsonsqlitepriorityqueue) == 3
+
+    jsonsqlitepriorityqueue.remove_job("j2")
+
+    assert len(jsonsqlitepriorityqueue) == 2
+
+    jsonsqlitepriorityqueue.remove(lambda message: message == "message")
+
+    assert len(jsonsqlitepriorityqueue) == 1
+
+    jsonsqlitepriorityqueue.clear()
+
+    assert len(jsonsqlitepriorityqueue) == 0
+    assert sum("COUNT(*)" in statement for statement in statements) == 1
+
+    statements.clear()
+
+    assert jsonsqlitepriorityqueue.pop_many(2) == []
+    assert jsonsqlitepriorityqueue.next_priority() is None
+    # An empty queue takes no lock and scans no rows.
+    assert statements == ["PRAGMA data_version", "PRAGMA data_version"]
+
+
+def test_jsonsqlitepriorityqueue_len_other_connection(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database)
+    q2 = JsonSqlitePriorityQueue(database)
+
+    assert len(q1) == len(q2) == 0
+
+    q2.put("message1")
+    q2.put("message2")
+
+    assert len(q1) == len(q2) == 2
+
+    assert q1.pop() == "message1"
+
+    assert len(q1) == len(q2) == 1
+
+    q2.clear()
+
+    assert len(q1) == len(q2) == 0
+    assert q1.pop_many(1) == []
+
+
+def test_jsonsqlitepriorityqueue_len_shared(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database, project="p1", shared=True)
+    q2 = JsonSqlitePriorityQueue(database, project="p1", shared=True)
+
+    assert len(q1) == len(q2) == 0
+
+    # The instances share a connection, so the data version doesn't change, but they share the cache, too.
+    q1.put("message")
+
+    assert len(q1) == len(q2) == 1
+
+    q2.pop()
+
+    assert len(q1) == len(q2) == 0
+
+
+message = {"name": "s1", "_job": "j1", "_version": "r1", "_max_proc": 2, "arg": "\N{SNOWMAN}", "settings": {"A": "1"}}
+
+
+@pytest.mark.parametrize(
+    ("codec", "expected"),
+    [
+        (
+            "json",
+            b'{"name": "s1", "_job": "j1", "_version": "r1", "_max_proc": 2, "arg": "\\u2603", "settings": {"A": "1"}}',
+        ),
+        ("pickle", b"\x80\x04"),
+    ],
+)
+def test_jsonsqlitepriorityqueue_codec(codec, expected):
+    q = JsonSqlitePriorityQueue(codec=codec)
+    q.put(message)
+    q.put("message", priority=1)
+    q.put({"name": "s2"})
+
+    blob = q.conn.execute("SELECT message FROM queue WHERE spider = 's1'").fetchone()[0]
+    if codec == "json":
+        assert blob == expected
+    else:
+        assert blob.startswith(expected)
+        # The keys that are stored in columns aren't encoded.
+        assert b"s1" not in blob
+        assert b"j1" not in blob
+        assert len(blob) < len(q.encode(message))
+
+    assert list(q) == [("message", 1), (message, 0), ({"name": "s2"}, 0)]
+    assert q.get_job("j1") == message
+    assert q.remove(lambda m: m == {"name": "s2"}) == 1
+    assert q.pop_many(2) == ["message", message]
+
+
+def test_jsonsqlitepriorityqueue_codec_mixed(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    JsonSqlitePriorityQueue(database).put({"name": "s1", "_job": "j1"})
+    q = JsonSqlitePriorityQueue(database, codec="pickle")
+    q.put({"name": "s2", "_job": "j2"})
+
+    assert [m for m, _ in q] == [{"name": "s1", "_job": "j1"}, {"name": "s2", "_job": "j2"}]
+
+    assert q.reencode() == 2
+    assert [blob[:2] for (blob,) in q.conn.execute("SELECT message FROM queue")] == [b"\x80\x04", b"\x80\x04"]
+
+    # Messages that are encoded with pickle aren't decoded, unless the codec is pickle.
+    q = JsonSqlitePriorityQueue(database)
+
+    with pytest.raises(UntrustedCodecError):
+        list(q)
+    with pytest.raises(UntrustedCodecError):
+        q.get_job("j2")
+    with pytest.raises(UntrustedCodecError):
+        q.reencode()
+
+    assert q.reencode(unpickle=True) == 2
+    assert [blob[:1] for (blob,) in q.conn.execute("SELECT message FROM queue")] == [b"{", b"{"]
+    assert [m for m, _ in q] == [{"name": "s1", "_job": "j1"}, {"name": "s2", "_job": "j2"}]
+
+
+def test_jsonsqlitepriorityqueue_codec_untrusted(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    JsonSqlitePriorityQueue(database, codec="pickle").put_many(
+        [({"name": "s1", "_job": "j1", "_expires": 1}, 0), ({"name": "s2", "_job": "j2"}, 0)]
+    )
+    q = JsonSqlitePriorityQueue(database)
+    q.put({"name": "s3", "_job": "j3", "_expires": 1})
+    q.put({"name": "s4", "_job": "j4"})
+
+    # A pickled message is removed, instead of blocking the queue. The other messages are returned.
+    with capturedLogs() as captured:
+        assert q.remove_expired() == [{"name": "s3", "_job": "j3", "_expires": 1}]
+        assert q.pop_many(2) == [{"name": "s4", "_job": "j4"}]
+
+    assert len(q) == 0
+    assert [event["job"] for event in captured] == ["j1", "j2"]
+
+
+def test_sqlitemixin_codec_invalid():
+    with pytest.raises(InvalidOptionError, match="`sqlite_codec` option must be one of json, pickle, not 'marshal'"):
+        JsonSqlitePriorityQueue(codec="marshal")
+
+
+def test_jsonsqlitepriorityqueue_dedupe():
+    q = JsonSqlitePriorityQueue()
+
+    assert q.put_many(
+        [
+            ({"_job": "j1", "_dedupe": "k1"}, 1),
+            ({"_job": "j2"}, 1),
+            ("message", 1),
+            ({"_job": "j3", "_dedupe": "k1"}, 0),  # a duplicate in the same call
+            ({"_job": "j4", "_dedupe": "k2"}, 0),
+        ]
+    ) == ["j1", "j2", None, "j1", "j4"]
+    assert q.put({"_job": "j5", "_dedupe": "k2"}, priority=2) == "j4"  # the priority is raised
+    assert q.put({"_job": "j6", "_dedupe": "k1"}, priority=0) == "j1"  # the priority isn't lowered
+
+    assert len(q) == 4
+    assert list(q) == [
+        ({"_job": "j4", "_dedupe": "k2"}, 2),
+        ({"_job": "j1", "_dedupe": "k1"}, 1),
+        ({"_job": "j2"}, 1),
+        ("message", 1),
+    ]
+
+
+@pytest.mark.parametrize("max_proc", ["x", "2", 0, 1.5, True])
+def test_jsonsqlitepriorityqueue_max_proc_invalid(max_proc):
+    q = JsonSqlitePriorityQueue()
+
+    with pytest.raises(InvalidMessageError):
+        q.put_many([({"_job": "j1"}, 0), ({"_job": "j2", "_max_proc": max_proc}, 0)])
+
+    assert len(q) == 0
+    assert list(q) == []
+
+
+def test_jsonsqlitepriorityqueue_dedupe_project(tmpdir):
+    database = str(tmpdir.join("queue.db"))
+    q1 = JsonSqlitePriorityQueue(database, project="p1")
+    q2 = JsonSqlitePriorityQueue(database, project="p2")
+    q3 = JsonSqlitePriorityQueue(database)
+
+    # Keys are unique per project.
+    assert q1.put({"_job": "j1", "_dedupe": "k"}) == "j1"
+    assert q2.put({"_job": "j2", "_dedupe": "k"}) == "j2"
+    assert q3.put({"_job": "j3", "_dedupe": "k"}) == "j3"
+    assert q3.put({"_job": "j4", "_dedupe": "k"}) == "j3"
+
+    assert (len(q1), len(q2), len(q3)) == (1, 1, 1)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        q3.conn.execute("INSERT INTO queue (priority, message, dedupe) VALUES (0, '1', 'k')")
+
+
+def test_jsonsqlitepriorityqueue_not_before(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JsonSqlitePriorityQueue(codec="pickle")
+    q.put_many(
+        [
+            ({"_job": "j1", "_not_before": 150}, 5),
+            ({"_job": "j2", "_not_before": 100}, 1),
+            ({"_job": "j3", "_not_before": 120}, 3),
+            ({"_job": "j4"}, 0),
+        ]
+    )
+
+    assert len(q) == 4
+    assert q.next_priority() == 1
+    assert q.next_due() == 120
+    assert q.pop_many(4) == [{"_job": "j2", "_not_before": 100}, {"_job": "j4"}]
+    assert q.next_priority() is None
+    assert q.next_due() == 120
+
+    monkeypatch.setattr("time.time", lambda: 120)
+
+    assert q.next_priority() == 3
+    assert q.next_due() == 150
+    assert q.pop() == {"_job": "j3", "_not_before": 120}
+    assert q.next_due() == 150
+    assert [message for message, _ in q] == [{"_job": "j1", "_not_before": 150}]  # a delayed message is listed
+
+    monkeypatch.setattr("time.time", lambda: 150)
+
+    assert q.next_due() is None
+    assert q.pop() == {"_job": "j1", "_not_before": 150}
+
+
+def test_jsonsqlitepriorityqueue_expires(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JsonSqlitePriorityQueue(codec="pickle")
+    q.put_many(
+        [
+            ({"_job": "j1", "_expires": 110}, 5),
+            ({"_job": "j2", "_expires": 150, "_dedupe": "k"}, 1),
+            ({"_job": "j3"}, 0),
+        ]
+    )
+    q.put({"_job": "j4", "_expires": 200, "_dedupe": "k"})  # extends the expiry
+    q.put({"_job": "j5", "_expires": 120, "_dedupe": "k"})  # doesn't shorten the expiry
+    q.put({"_job": "j6", "_dedupe": "k"})  # doesn't remove the expiry
+
+    assert q.remove_expired() == []
+
+    monkeypatch.setattr("time.time", lambda: 160)
+
+    assert len(q) == 3
+    assert q.next_priority() == 1
+    assert q.remove_expired() == [{"_job": "j1", "_expires": 110}]
+    assert len(q) == 2
+    assert q.pop_many(3) == [{"_job": "j2", "_expires": 200, "_dedupe": "k"}, {"_job": "j3"}]
+
+
+def test_jsonsqlitepriorityqueue_remove_expired_lock(tmpdir, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    database = str(tmpdir.join("queue.db"))
+    q = JsonSqlitePriorityQueue(database)
+    q.put({"_job": "j1", "_expires": 110})
+
+    # If no message has expired, the write lock isn't taken.
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+
+    assert q.remove_expired() == []
+
+    conn.execute("ROLLBACK")
+    monkeypatch.setattr("time.time", lambda: 110)
+
+    assert q.remove_expired() == [{"_job": "j1", "_expires": 110}]
+
+
+def test_jsonsqlitepriorityqueue_expires_pop(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JsonSqlitePriorityQueue()
+    q.put({"_job": "j1", "_expires": 100}, priority=1)
+    q.put({"_job": "j2"})
+
+    # An expired message isn't popped.
+    assert q.next_priority() == 0
+    assert q.pop_many(2) == [{"_job": "j2"}]
+    assert q.remove_expired() == [{"_job": "j1", "_expires": 100}]
+    assert len(q) == 0
+
+
+def test_jsonsqlitepriorityqueue_aging(monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    q = JsonSqlitePriorityQueue(aging=10)
+    q.put("low", priority=0)
+    q.put({"_job": "delayed", "_not_before": 150}, priority=1)
+
+    monkeypatch.setattr("time.time", lambda: 125)
+    q.put("high", priority=2)  # 2 buckets later, the same effective priority as "low"
+    q.put("higher", priority=3)
+
+    assert q.next_priority() == 3
+    assert [message for message, _ in q][:3] == ["higher", "low", "high"]
+    assert [priority for _, priority in q] == [3, 0, 2, 1]  # the priorities don't change
+    assert q.pop_many(3) == ["higher", "low", "high"]
+
+    monkeypatch.setattr("time.time", lambda: 150)
+
+    # The delayed message ages from the time at which it's due.
+    assert q.next_priority() == 1
+    q.put({"_job": "j1", "_dedupe": "k"}, priority=0)
+    q.put({"_job": "j2", "_dedupe": "k"}, priority=5)  # the rank is raised as much as the priority
+
+    assert q.next_priority() == 5
+    assert q.pop_many(2) == [{"_job": "j1", "_dedupe": "k"}, {"_job": "delayed", "_not_before": 150}]
+
+
+def test_jsonsqlitepriorityqueue_aging_changed(tmpdir, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 100)
+    database = str(tmpdir.join("queue.db"))
+    q = JsonSqlitePriorityQueue(database, aging=10)
+    q.put("low", priority=0)
+    monkeypatch.setattr("time.time", lambda: 200)
+    q.put("high", priority=5)
+    q.conn.close()
+
+    assert [message for message, _ in JsonSqlitePriorityQueue(database, aging=10)] == ["low", "high"]
+    assert [message for message, _ in JsonSqlitePriorityQueue(database)] == ["high", "low"]  # without aging
+    assert [message for message, _ in JsonSqlitePriorityQueue(database, aging=100)] == ["high", "low"]
+
+
+def test_jsonsqlitepriorityqueue_list_page(monkeypatch):
+    q = JsonSqlitePriorityQueue()
+    for i in range(5):
+        q.put({"name": "s1" if i % 2 else "s2", "_job": f"j{i}", "_scheduled": i}, priority=i // 2)
+
+    messages, after = q.list_page(2)
+
+    assert [message["_job"] for message in messages] == ["j4", "j2"]
+
+    messages, after = q.list_page(2, after)
+
+    assert [message["_job"] for message in messages] == ["j3", "j0"]
+
+    messages, after = q.list_page(2, after)
+
+    assert [message["_job"] for message in messages] == ["j1"]
+    assert after is None
+    assert [message["_job"] for message in q.list_page()[0]] == ["j4", "j2", "j3", "j0", "j1"]
+    assert [message["_job"] for message in q.list_page(spider="s1")[0]] == ["j3", "j1"]
+    assert [message["_job"] for message in q.list_page(since=1, until=4)[0]] == ["j2", "j3", "j1"]
+    assert len(q) == 5
+
+
+def test_sqlitespiderlists(tmpdir):
+    database = str(tmpdir / "spiderlists.db")
+    store = SqliteSpiderLists(database)
+    store.set("p1", "r1", "d1", "scrapyd.runner", ["s1", "s2"])
+    store.set("p1", "r2", "d2", "scrapyd.runner", ["s3"])
+    store.set("p2", "r1", "d1", "scrapyd.runner", ["s1", "s2"])
+
+    # The cache is persistent.
+    store = SqliteSpiderLists(database)
+
+    assert store.get("p1", "r1", "d1", "scrapyd.runner") == ["s1", "s2"]
+    # The egg or the runner changed.
+    assert store.get("p1", "r1", "d2", "scrapyd.runner") is None
+    assert store.get("p1", "r1", "d1", "myrunner") is None
+
+    store.set("p1", "r1", "d3", "scrapyd.runner", ["s4"])
+
+    assert store.get("p1", "r1", "d1", "scrapyd.runner") is None
+    assert store.get("p1", "r1", "d3", "scrapyd.runner") == ["s4"]
+
+    store.delete("p1", "r1")
+
+    assert store.get("p1", "r1", "d3", "scrapyd.runner") is None
+    assert store.get("p1", "r2", "d2", "scrapyd.runner") == ["s3"]
+
+    store.delete("p1")
+
+    assert store.get("p1", "r2", "d2", "scrapyd.runner") is None
+    assert store.get("p2", "r1", "d1", "scrapyd.runner") == ["s1", "s2"]
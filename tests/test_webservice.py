@@ -1,19 +1,25 @@
 import datetime
 import io
+import json
 import os
 import re
 import sys
-from unittest.mock import MagicMock, call
+from unittest.mock import ANY, MagicMock, call
 
 import pytest
-from twisted.web import error
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, inlineCallbacks, maybeDeferred
+from twisted.internet.error import ConnectionDone, ProcessDone
+from twisted.python.failure import Failure
+from twisted.web import error, server
 
 from scrapyd.exceptions import DirectoryTraversalError, RunnerError
 from scrapyd.interfaces import IEggStorage
 from scrapyd.jobstorage import Job
 from scrapyd.launcher import ScrapyProcessProtocol
-from scrapyd.webservice import spider_list
-from tests import get_egg_data, has_settings, root_add_version
+from scrapyd.sqlite import SqliteSpiderLists
+from scrapyd.webservice import ListJobs, spider_list
+from tests import get_egg_data, get_result, has_settings, root_add_version
 
 job1 = Job(
     project="p1",
@@ -40,80 +46,213 @@ def add_test_version(app, project, version, basename):
     app.getComponent(IEggStorage).put(io.BytesIO(get_egg_data(basename)), project, version)
 
 
+@inlineCallbacks
 def assert_content(txrequest, root, method, basename, args, expected):
     txrequest.args = args.copy()
-    content = getattr(root.children[b"%b.json" % basename.encode()], f"render_{method}")(txrequest)
+    content = yield maybeDeferred(
+        getattr(root.children[b"%b.json" % basename.encode()], f"render_{method}"), txrequest
+    )
 
     assert content.pop("node_name")
     assert content == {"status": "ok", **expected}
 
 
+@inlineCallbacks
 def assert_error(txrequest, root, method, basename, args, message):
     txrequest.args = args.copy()
     with pytest.raises(error.Error) as exc:
-        getattr(root.children[b"%b.json" % basename.encode()], f"render_{method}")(txrequest)
+        yield maybeDeferred(getattr(root.children[b"%b.json" % basename.encode()], f"render_{method}"), txrequest)
 
     assert exc.value.status == b"200"
     assert exc.value.message == message
 
 
+@inlineCallbacks
 def test_spider_list(app):
     add_test_version(app, "myproject", "r1", "mybot")
-    spiders = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myproject", None, runner="scrapyd.runner")
     assert sorted(spiders) == ["spider1", "spider2"]
 
     # Use the cache.
     add_test_version(app, "myproject", "r2", "mybot2")
-    spiders = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myproject", None, runner="scrapyd.runner")
     assert sorted(spiders) == ["spider1", "spider2"]  # mybot2 has 3 spiders, but the cache wasn't evicted
 
     # Clear the cache.
     spider_list.delete("myproject")
-    spiders = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myproject", None, runner="scrapyd.runner")
     assert sorted(spiders) == ["spider1", "spider2", "spider3"]
 
     # Re-add the 2-spider version and clear the cache.
     add_test_version(app, "myproject", "r3", "mybot")
     spider_list.delete("myproject")
-    spiders = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myproject", None, runner="scrapyd.runner")
     assert sorted(spiders) == ["spider1", "spider2"]
 
     # Re-add the 3-spider version and clear the cache, but use a lower version number.
     add_test_version(app, "myproject", "r1a", "mybot2")
     spider_list.delete("myproject")
-    spiders = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myproject", None, runner="scrapyd.runner")
     assert sorted(spiders) == ["spider1", "spider2"]
 
 
+@inlineCallbacks
 def test_spider_list_log_stdout(app):
     add_test_version(app, "logstdout", "logstdout", "logstdout")
-    spiders = spider_list.get("logstdout", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("logstdout", None, runner="scrapyd.runner")
 
     assert sorted(spiders) == ["spider1", "spider2"]  # [] if LOG_STDOUT were enabled
 
 
+@inlineCallbacks
 def test_spider_list_unicode(app):
     add_test_version(app, "myprojectunicode", "r1", "mybotunicode")
-    spiders = spider_list.get("myprojectunicode", None, runner="scrapyd.runner")
+    spiders = yield spider_list.get("myprojectunicode", None, runner="scrapyd.runner")
 
     assert sorted(spiders) == ["araña1", "araña2"]
 
 
+@inlineCallbacks
 def test_spider_list_error(app):
     # mybot3.settings contains "raise Exception('This should break the `scrapy list` command')".
     add_test_version(app, "myproject3", "r1", "mybot3")
     with pytest.raises(RunnerError) as exc:
-        spider_list.get("myproject3", None, runner="scrapyd.runner")
+        yield spider_list.get("myproject3", None, runner="scrapyd.runner")
 
     assert re.search(f"Exception: This should break the `scrapy list` command{os.linesep}$", str(exc.value))
 
 
+@inlineCallbacks
+def test_spider_list_concurrent(app, monkeypatch):
+    add_test_version(app, "myproject", "r1", "mybot")
+    spawn = MagicMock(wraps=reactor.spawnProcess)
+    monkeypatch.setattr(reactor, "spawnProcess", spawn)
+
+    first = spider_list.get("myproject", None, runner="scrapyd.runner")
+    second = spider_list.get("myproject", None, runner="scrapyd.runner")
+
+    # The reactor isn't blocked while the process runs.
+    assert not first.called
+    assert not second.called
+    assert sorted((yield first)) == ["spider1", "spider2"]
+    assert sorted((yield second)) == ["spider1", "spider2"]
+    assert spawn.call_count == 1
+
+    # Use the cache.
+    assert sorted((yield spider_list.get("myproject", None, runner="scrapyd.runner"))) == ["spider1", "spider2"]
+    assert spawn.call_count == 1
+
+
+@inlineCallbacks
+def test_spider_list_delete_running(app):
+    add_test_version(app, "myproject", "r1", "mybot")
+    deferred = spider_list.get("myproject", None, runner="scrapyd.runner")
+    spider_list.delete("myproject")
+
+    assert sorted((yield deferred)) == ["spider1", "spider2"]
+    # The cache was evicted while the process ran.
+    assert spider_list.cache == {}
+    assert spider_list.running == {}
+
+
+@inlineCallbacks
+def test_spider_list_store(txrequest, root, monkeypatch):
+    root_add_version(root, "myproject", "r1", "mybot")
+    root_add_version(root, "myproject", "r2", "mybot2")
+    root.update_projects()
+    spawn = MagicMock(wraps=reactor.spawnProcess)
+    monkeypatch.setattr(reactor, "spawnProcess", spawn)
+
+    def list_spiders(spiders, **args):
+        args = {b"project": [b"myproject"], **{f"_{k}".encode(): [v.encode()] for k, v in args.items()}}
+        return assert_content(txrequest, root, "GET", "listspiders", args, {"spiders": spiders})
+
+    yield list_spiders(["spider1", "spider2"], version="r1")
+    yield list_spiders(["spider1", "spider2", "spider3"])
+
+    assert spawn.call_count == 2
+    assert len(root.spider_lists) == 2  # the default version is stored as r2
+
+    # Restart.
+    spider_list.cache.clear()
+    root.spider_lists = SqliteSpiderLists(root.spider_lists.database)
+
+    yield list_spiders(["spider1", "spider2"], version="r1")
+    yield list_spiders(["spider1", "spider2", "spider3"], version="r2")
+    yield list_spiders(["spider1", "spider2", "spider3"])
+
+    assert spawn.call_count == 2
+
+    # Replace the egg.
+    spider_list.cache.clear()
+    root_add_version(root, "myproject", "r1", "mybot2")
+
+    yield list_spiders(["spider1", "spider2", "spider3"], version="r1")
+
+    assert spawn.call_count == 3
+
+    yield assert_content(txrequest, root, "POST", "delversion", {b"project": [b"myproject"], b"version": [b"r2"]}, {})
+
+    assert len(root.spider_lists) == 1
+
+    yield assert_content(txrequest, root, "POST", "delproject", {b"project": [b"myproject"]}, {})
+
+    assert len(root.spider_lists) == 0
+
+
+@inlineCallbacks
+def test_spider_list_store_sanitized_version(txrequest, root):
+    root_add_version(root, "myproject", "1.0", "mybot")
+    root.update_projects()
+
+    # The default version's output is stored under the version in the egg's file name.
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"myproject"]}, {"spiders": ANY})
+
+    assert [row[0] for row in root.spider_lists.conn.execute("SELECT version FROM spider_lists")] == ["1_0"]
+
+    yield assert_content(txrequest, root, "POST", "delversion", {b"project": [b"myproject"], b"version": [b"1.0"]}, {})
+
+    assert len(root.spider_lists) == 0
+
+
+@inlineCallbacks
+def test_spider_list_lru(monkeypatch):
+    def spawn(process, executable, args, env):
+        process.outReceived(f"{env['SCRAPY_PROJECT']}-{env.get('SCRAPYD_EGG_VERSION')}\n".encode())
+        process.processEnded(Failure(ProcessDone(0)))
+
+    monkeypatch.setattr(reactor, "spawnProcess", spawn)
+    monkeypatch.setattr(spider_list, "maxsize", 2)
+
+    def get(version):
+        return spider_list.get("p1", version, runner="scrapyd.runner")
+
+    assert (yield get("r1")) == ["p1-r1"]
+    assert (yield get("r2")) == ["p1-r2"]
+    assert (yield get("r1")) == ["p1-r1"]
+    # r2 is the least recently used.
+    assert (yield get("r3")) == ["p1-r3"]
+
+    assert list(spider_list.cache) == [("p1", "r1"), ("p1", "r3")]
+    assert spider_list.info() == {"size": 2, "maxsize": 2, "hits": 1, "misses": 3, "evictions": 1}
+
+    assert (yield get("r2")) == ["p1-r2"]
+
+    assert list(spider_list.cache) == [("p1", "r3"), ("p1", "r2")]
+    assert spider_list.info() == {"size": 2, "maxsize": 2, "hits": 1, "misses": 4, "evictions": 2}
+
+    spider_list.delete("p1", "r3")
+
+    assert list(spider_list.cache) == [("p1", "r2")]
+
+
 @pytest.mark.parametrize(
     ("method", "basename", "param", "args"),
     [
         ("POST", "schedule", "project", {}),
         ("POST", "schedule", "project", {b"spider": [b"scrapy-css"]}),
         ("POST", "schedule", "spider", {b"project": [b"quotesbot"]}),
+        ("POST", "schedulebatch", "jobs", {}),
         ("POST", "cancel", "project", {}),
         ("POST", "cancel", "project", {b"job": [b"aaa"]}),
         ("POST", "cancel", "job", {b"project": [b"quotesbot"]}),
@@ -129,21 +268,24 @@ def test_spider_list_error(app):
         ("POST", "delversion", "version", {b"project": [b"quotesbot"]}),
     ],
 )
+@inlineCallbacks
 def test_required(txrequest, root_with_egg, method, basename, param, args):
     message = b"'%b' parameter is required" % param.encode()
-    assert_error(txrequest, root_with_egg, method, basename, args, message)
+    yield assert_error(txrequest, root_with_egg, method, basename, args, message)
 
 
+@inlineCallbacks
 def test_invalid_utf8(txrequest, root):
     args = {b"project": [b"\xc3\x28"]}
     message = b"project is invalid: 'utf-8' codec can't decode byte 0xc3 in position 0: invalid continuation byte"
-    assert_error(txrequest, root, "GET", "listversions", args, message)
+    yield assert_error(txrequest, root, "GET", "listversions", args, message)
 
 
+@inlineCallbacks
 def test_invalid_type(txrequest, root):
     args = {b"project": [b"p"], b"spider": [b"s"], b"priority": [b"x"]}
     message = b"priority is invalid: could not convert string to float: b'x'"
-    assert_error(txrequest, root, "POST", "schedule", args, message)
+    yield assert_error(txrequest, root, "POST", "schedule", args, message)
 
 
 def test_debug(txrequest, root):
@@ -159,21 +301,81 @@ def test_debug(txrequest, root):
     )
 
 
-def test_daemonstatus(txrequest, root_with_egg, scrapy_process):
-    expected = {"running": 0, "pending": 0, "finished": 0}
-    assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
+def test_deferred(txrequest, root_with_egg):
+    deferred = Deferred()
+    root_with_egg.poller.queues["quotesbot"].count = lambda: deferred
+
+    transport = txrequest.channel.transport
+    txrequest.channel.requests.append(txrequest)  # as if the channel had received the request
+    txrequest.method = "GET"
+    txrequest.args = {}
+    content = root_with_egg.children[b"daemonstatus.json"].render(txrequest)
+
+    assert content == server.NOT_DONE_YET
+    assert not txrequest.finished
+
+    deferred.callback(3)
+
+    assert txrequest.finished
+    assert b'"pending": 3' in transport.written.getvalue()
+
+
+def test_deferred_error(txrequest, root_with_egg):
+    deferred = Deferred()
+    root_with_egg.poller.queues["quotesbot"].count = lambda: deferred
+
+    transport = txrequest.channel.transport
+    txrequest.channel.requests.append(txrequest)  # as if the channel had received the request
+    txrequest.method = "GET"
+    txrequest.args = {}
+    root_with_egg.children[b"daemonstatus.json"].render(txrequest)
+    deferred.errback(ValueError("x"))
+
+    assert txrequest.finished
+    assert b'"message": "ValueError: x"' in transport.written.getvalue()
+
+
+@inlineCallbacks
+def test_list_spiders_not_done_yet(txrequest, root_with_egg):
+    transport = txrequest.channel.transport
+    txrequest.channel.requests.append(txrequest)  # as if the channel had received the request
+    txrequest.method = "GET"
+    txrequest.args = {b"project": [b"quotesbot"]}
+    finished = txrequest.notifyFinish()
+    content = root_with_egg.children[b"listspiders.json"].render(txrequest)
+
+    assert content == server.NOT_DONE_YET
+    assert not txrequest.finished
+
+    yield finished
+
+    assert b'"spiders": ["toscrape-css", "toscrape-xpath"]' in transport.written.getvalue()
+
+
+@inlineCallbacks
+def test_daemonstatus(txrequest, root_with_egg, scrapy_process, monkeypatch):
+    # The finished jobs are counted, instead of listed.
+    monkeypatch.setattr(root_with_egg.launcher.finished, "list", MagicMock(side_effect=AssertionError))
+    expected = {
+        "running": 0,
+        "pending": 0,
+        "finished": 0,
+        "spider_list_cache": {"size": 0, "maxsize": 1000, "hits": 0, "misses": 0, "evictions": 0},
+    }
+    yield assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
 
     root_with_egg.launcher.finished.add(job1)
+    root_with_egg.launcher.finished.add(Job("p1", "s1", "j2", outcome="expired"))  # not counted
     expected["finished"] += 1
-    assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
 
     root_with_egg.launcher.processes[0] = scrapy_process
     expected["running"] += 1
-    assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
 
     root_with_egg.poller.queues["quotesbot"].add("quotesbot")
     expected["pending"] += 1
-    assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "daemonstatus", {}, expected)
 
 
 @pytest.mark.parametrize(
@@ -184,6 +386,7 @@ def test_daemonstatus(txrequest, root_with_egg, scrapy_process):
         ({b"project": [b"localproject"]}, ["example"], True),
     ],
 )
+@inlineCallbacks
 def test_list_spiders(txrequest, root, args, spiders, run_only_if_has_settings):
     if run_only_if_has_settings and not has_settings():
         pytest.skip("[settings] section is not set")
@@ -193,7 +396,7 @@ def test_list_spiders(txrequest, root, args, spiders, run_only_if_has_settings):
     root.update_projects()
 
     expected = {"spiders": spiders}
-    assert_content(txrequest, root, "GET", "listspiders", args, expected)
+    yield assert_content(txrequest, root, "GET", "listspiders", args, expected)
 
 
 @pytest.mark.parametrize(
@@ -204,6 +407,7 @@ def test_list_spiders(txrequest, root, args, spiders, run_only_if_has_settings):
         ({b"project": [b"localproject"], b"_version": [b"nonexistent"]}, "version", True),
     ],
 )
+@inlineCallbacks
 def test_list_spiders_nonexistent(txrequest, root, args, param, run_only_if_has_settings):
     if run_only_if_has_settings and not has_settings():
         pytest.skip("[settings] section is not set")
@@ -212,31 +416,38 @@ def test_list_spiders_nonexistent(txrequest, root, args, param, run_only_if_has_
     root_add_version(root, "myproject", "r2", "mybot2")
     root.update_projects()
 
-    assert_error(txrequest, root, "GET", "listspiders", args, b"%b 'nonexistent' not found" % param.encode())
+    yield assert_error(txrequest, root, "GET", "listspiders", args, b"%b 'nonexistent' not found" % param.encode())
 
 
+@inlineCallbacks
 def test_list_versions(txrequest, root_with_egg):
     expected = {"versions": ["0_1"]}
-    assert_content(txrequest, root_with_egg, "GET", "listversions", {b"project": [b"quotesbot"]}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "listversions", {b"project": [b"quotesbot"]}, expected)
 
 
+@inlineCallbacks
 def test_list_versions_nonexistent(txrequest, root):
     expected = {"versions": []}
-    assert_content(txrequest, root, "GET", "listversions", {b"project": [b"localproject"]}, expected)
+    yield assert_content(txrequest, root, "GET", "listversions", {b"project": [b"localproject"]}, expected)
 
 
+@inlineCallbacks
 def test_list_projects(txrequest, root_with_egg):
     expected = {"projects": ["quotesbot", *get_local_projects(root_with_egg)]}
-    assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
 
 
+@inlineCallbacks
 def test_list_projects_empty(txrequest, root):
     expected = {"projects": get_local_projects(root)}
-    assert_content(txrequest, root, "GET", "listprojects", {}, expected)
+    yield assert_content(txrequest, root, "GET", "listprojects", {}, expected)
 
 
 @pytest.mark.parametrize("args", [{}, {b"project": [b"p1"]}])
-def test_status(txrequest, root, scrapy_process, args):
+@inlineCallbacks
+def test_status(txrequest, root, scrapy_process, args, monkeypatch):
+    # The finished job is looked up by ID, instead of listing the finished jobs.
+    monkeypatch.setattr(root.launcher.finished, "list", MagicMock(side_effect=AssertionError))
     root_add_version(root, "p1", "r1", "mybot")
     root_add_version(root, "p2", "r2", "mybot2")
     root.update_projects()
@@ -247,30 +458,32 @@ def test_status(txrequest, root, scrapy_process, args):
         root.poller.queues["p2"].add("s2", _job="j1")
 
     expected = {"currstate": None}
-    assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
+    yield assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
 
     root.poller.queues["p1"].add("s1", _job="j1")
 
     expected["currstate"] = "pending"
-    assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
+    yield assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
 
     root.launcher.processes[0] = scrapy_process
 
     expected["currstate"] = "running"
-    assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
+    yield assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
 
     root.launcher.finished.add(job1)
 
     expected["currstate"] = "finished"
-    assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
+    yield assert_content(txrequest, root, "GET", "status", {b"job": [b"j1"], **args}, expected)
 
 
+@inlineCallbacks
 def test_status_nonexistent(txrequest, root):
     args = {b"job": [b"aaa"], b"project": [b"nonexistent"]}
-    assert_error(txrequest, root, "GET", "status", args, b"project 'nonexistent' not found")
+    yield assert_error(txrequest, root, "GET", "status", args, b"project 'nonexistent' not found")
 
 
 @pytest.mark.parametrize("args", [{}, {b"project": [b"p1"]}])
+@inlineCallbacks
 def test_list_jobs(txrequest, root, scrapy_process, args):
     root_add_version(root, "p1", "r1", "mybot")
     root_add_version(root, "p2", "r2", "mybot2")
@@ -281,8 +494,8 @@ def test_list_jobs(txrequest, root, scrapy_process, args):
         root.launcher.processes[0] = ScrapyProcessProtocol("p2", "s2", "j2", {}, [])
         root.poller.queues["p2"].add("s2", _job="j2")
 
-    expected = {"pending": [], "running": [], "finished": []}
-    assert_content(txrequest, root, "GET", "listjobs", args, expected)
+    expected = {"pending": [], "running": [], "finished": [], "expired": []}
+    yield assert_content(txrequest, root, "GET", "listjobs", args, expected)
 
     root.launcher.finished.add(job1)
 
@@ -297,7 +510,7 @@ def test_list_jobs(txrequest, root, scrapy_process, args):
             "log_url": "/logs/p1/s1/j1.log",
         },
     )
-    assert_content(txrequest, root, "GET", "listjobs", args, expected)
+    yield assert_content(txrequest, root, "GET", "listjobs", args, expected)
 
     root.launcher.processes[0] = scrapy_process
 
@@ -310,7 +523,7 @@ def test_list_jobs(txrequest, root, scrapy_process, args):
             "pid": None,
         }
     )
-    assert_content(txrequest, root, "GET", "listjobs", args, expected)
+    yield assert_content(txrequest, root, "GET", "listjobs", args, expected)
 
     root.poller.queues["p1"].add(
         "s1",
@@ -331,14 +544,235 @@ def test_list_jobs(txrequest, root, scrapy_process, args):
             "args": {"other": "one"},
         },
     )
-    assert_content(txrequest, root, "GET", "listjobs", args, expected)
+    yield assert_content(txrequest, root, "GET", "listjobs", args, expected)
+
+
+def test_list_jobs_page(txrequest, root):
+    root_add_version(root, "p1", "r1", "mybot")
+    root_add_version(root, "p2", "r2", "mybot2")
+    root.update_projects()
+    root.poller.queues["p2"].add("s1", priority=1, _job="j1", _scheduled=10)
+    root.poller.queues["p1"].add("s2", _job="j2", _scheduled=20)
+    root.poller.queues["p1"].add("s1", priority=1, _job="j3", _scheduled=30)
+    for slot, (spider, job, second) in enumerate((("s1", "j5", 2), ("s2", "j4", 1))):
+        root.launcher.processes[slot] = ScrapyProcessProtocol("p1", spider, job, {}, [])
+        root.launcher.processes[slot].start_time = datetime.datetime(2001, 2, 3, 4, 5, second)
+    for spider, job, second in (("s1", "j6", 1), ("s2", "j7", 2)):
+        root.launcher.finished.add(Job("p2", spider, job, end_time=datetime.datetime(2001, 2, 3, 4, 5, second)))
+
+    def pages(args):
+        pages = []
+        args = {b"limit": [b"2"], **args}
+        while True:
+            txrequest.args = args.copy()
+            content = get_result(root.children[b"listjobs.json"].render_GET(txrequest))
+            pages.append(
+                [job["id"] for state in ("pending", "running", "finished", "expired") for job in content[state]]
+            )
+            if content["next_cursor"] is None:
+                return pages
+            args[b"cursor"] = [content["next_cursor"].encode()]
+
+    assert pages({}) == [["j3", "j2"], ["j1", "j4"], ["j5", "j7"], ["j6"]]
+    assert pages({b"state": [b"running"]}) == [["j4", "j5"]]
+    assert pages({b"state": [b"finished"], b"limit": [b"1"]}) == [["j7"], ["j6"]]
+    # A page can be empty, if the previous page ended at the end of a state.
+    assert pages({b"spider": [b"s1"]}) == [["j3", "j1"], ["j5", "j6"], []]
+    assert pages({b"project": [b"p1"]}) == [["j3", "j2"], ["j4", "j5"], []]
+    assert pages({b"since": [b"15"], b"until": [b"30"], b"state": [b"pending"]}) == [["j2"]]
+    assert pages({b"since": [b"2001-02-03T04:05:02"], b"state": [b"finished"]}) == [["j7"]]
+
+    txrequest.args = {b"state": [b"pending"], b"spider": [b"s2"]}
+    content = get_result(root.children[b"listjobs.json"].render_GET(txrequest))
+
+    assert "next_cursor" not in content
+    assert [job["id"] for job in content["pending"]] == ["j2"]
+    assert content["running"] == []
+    assert content["finished"] == []
+
+
+@pytest.mark.parametrize(
+    ("args", "message"),
+    [
+        ({b"state": [b"done"]}, b"state is invalid: done"),
+        ({b"limit": [b"0"]}, b"limit is invalid: 0"),
+        ({b"limit": [b"x"]}, b"limit is invalid: invalid literal for int() with base 10: b'x'"),
+        ({b"since": [b"yesterday"]}, b"since is invalid: Invalid isoformat string: 'yesterday'"),
+        ({b"until": [b"nan"]}, b"until is invalid: nan"),
+        ({b"cursor": [b"x"]}, b"cursor is invalid: x"),
+        (
+            {b"cursor": [b"WyJydW5uaW5nIiwgbnVsbCwgbnVsbF0="], b"state": [b"pending"]},
+            b"cursor is invalid: WyJydW5uaW5nIiwgbnVsbCwgbnVsbF0=",
+        ),
+    ],
+)
+@inlineCallbacks
+def test_list_jobs_invalid(txrequest, root, args, message):
+    yield assert_error(txrequest, root, "GET", "listjobs", args, message)
+
+
+# The position's shape depends on the state. A crafted position mustn't be compared with jobs.
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        ["done", None, None],
+        ["pending", None, 5],
+        ["pending", None, [1]],
+        ["pending", None, ["a", 1]],
+        ["running", None, [1, 2]],
+        ["finished", None, ["a", "b"]],
+        ["expired", None, True],
+        ["finished", 1, None],
+    ],
+)
+@inlineCallbacks
+def test_list_jobs_cursor_invalid(txrequest, root, cursor):
+    root_add_version(root, "p1", "r1", "mybot")
+    root.update_projects()
+    root.poller.queues["p1"].add("s1", _job="j1")
+    root.launcher.processes[0] = ScrapyProcessProtocol("p1", "s1", "j2", {}, [])
+    root.launcher.finished.add(job1)
+    encoded = ListJobs._encode_cursor(*cursor).encode()  # noqa: SLF001
+
+    yield assert_error(txrequest, root, "GET", "listjobs", {b"cursor": [encoded]}, b"cursor is invalid: %b" % encoded)
 
 
+@inlineCallbacks
 def test_list_jobs_nonexistent(txrequest, root):
     args = {b"project": [b"nonexistent"]}
-    assert_error(txrequest, root, "GET", "listjobs", args, b"project 'nonexistent' not found")
+    yield assert_error(txrequest, root, "GET", "listjobs", args, b"project 'nonexistent' not found")
+
+
+@pytest.fixture()
+def export(txrequest, root, monkeypatch):
+    root_add_version(root, "p1", "r1", "mybot")
+    root_add_version(root, "p2", "r2", "mybot2")
+    root.update_projects()
+    root.poller.queues["p2"].add("s1", priority=1, _job="j1", _scheduled=10)
+    root.poller.queues["p1"].add("s2", _job="j2", _scheduled=20)
+    root.poller.queues["p1"].add("s1", priority=1, _job="j3", _scheduled=30)
+    root.launcher.processes[0] = ScrapyProcessProtocol("p1", "s1", "j4", {}, [])
+    root.launcher.processes[0].start_time = datetime.datetime(2001, 2, 3, 4, 5, 1)
+    for spider, job, second in (("s1", "j5", 1), ("s2", "j6", 2)):
+        root.launcher.finished.add(Job("p2", spider, job, end_time=datetime.datetime(2001, 2, 3, 4, 5, second)))
+
+    resource = root.children[b"exportjobs.json"]
+    monkeypatch.setattr(resource, "chunk_size", 1)
+    written = []
+    monkeypatch.setattr(txrequest, "write", written.append)
+
+    def render(args):
+        txrequest.method = b"GET"
+        txrequest.args = args
+        assert resource.render(txrequest) == server.NOT_DONE_YET
+        return written
+
+    return render
+
+
+def exported(written):
+    return [(job["state"], job["id"]) for job in map(json.loads, b"".join(written).splitlines())]
+
+
+def test_export_jobs(txrequest, export):
+    written = export({})
+
+    assert txrequest.finished
+    assert txrequest.responseHeaders.getRawHeaders("Content-Type") == ["application/x-ndjson"]
+    assert not txrequest.responseHeaders.hasHeader("Content-Length")
+    # One chunk per job, and an empty write when the request finishes.
+    assert written.pop() == b""
+    assert len(written) == 6
+    assert exported(written) == [
+        ("pending", "j3"),
+        ("pending", "j2"),
+        ("pending", "j1"),
+        ("running", "j4"),
+        ("finished", "j6"),
+        ("finished", "j5"),
+    ]
+
+    line = json.loads(written[0])
+    assert line == {
+        "state": "pending",
+        "project": "p1",
+        "spider": "s1",
+        "id": "j3",
+        "version": None,
+        "settings": {},
+        "args": {},
+    }
+
+
+def test_export_jobs_filter(txrequest, export):
+    written = export({b"project": [b"p2"], b"spider": [b"s1"], b"until": [b"2001-02-03T04:05:02"]})
+
+    assert txrequest.finished
+    assert exported(written) == [("pending", "j1"), ("finished", "j5")]
+
+
+def test_export_jobs_expired(txrequest, root, export):
+    root.launcher.finished.add(
+        Job("p1", "s1", "j7", end_time=datetime.datetime(2001, 2, 3, 4, 5, 3), outcome="expired")
+    )
+    written = export({b"state": [b"expired"]})
+
+    assert txrequest.finished
+    assert [json.loads(line) for line in b"".join(written).splitlines()] == [
+        {"state": "expired", "project": "p1", "spider": "s1", "id": "j7", "end_time": "2001-02-03 04:05:03"}
+    ]
+
+
+def test_export_jobs_backpressure(txrequest, export):
+    written = []
+
+    def write(data):
+        written.append(data)
+        # Simulate a full write buffer.
+        txrequest.producer.pauseProducing()
 
+    txrequest.write = write
+    export({b"state": [b"pending"]})
 
+    assert exported(written) == [("pending", "j3")]
+    assert not txrequest.finished
+
+    txrequest.producer.resumeProducing()
+
+    assert exported(written) == [("pending", "j3"), ("pending", "j2")]
+    assert not txrequest.finished
+
+    # The client disconnects.
+    txrequest.connectionLost(Failure(ConnectionDone()))
+    txrequest.producer.resumeProducing()
+
+    assert exported(written) == [("pending", "j3"), ("pending", "j2")]
+
+
+def test_export_jobs_failure(txrequest, root, export):
+    root.launcher.finished.list_page = MagicMock(side_effect=ValueError("storage is unavailable"))
+    written = export({})
+
+    assert exported(written) == [("pending", "j3"), ("pending", "j2"), ("pending", "j1"), ("running", "j4")]
+    # The response isn't ended, so that the client doesn't mistake it for complete.
+    assert not txrequest.finished
+    assert txrequest.channel.transport.disconnected
+
+
+@pytest.mark.parametrize(
+    ("args", "message"),
+    [
+        ({b"project": [b"nonexistent"]}, b"project 'nonexistent' not found"),
+        ({b"state": [b"done"]}, b"state is invalid: done"),
+        ({b"since": [b"yesterday"]}, b"since is invalid: Invalid isoformat string: 'yesterday'"),
+    ],
+)
+@inlineCallbacks
+def test_export_jobs_invalid(txrequest, root, args, message):
+    yield assert_error(txrequest, root, "GET", "exportjobs", args, message)
+
+
+@inlineCallbacks
 def test_delete_version(txrequest, root):
     projects = get_local_projects(root)
 
@@ -348,32 +782,33 @@ def test_delete_version(txrequest, root):
 
     # Spiders (before).
     expected = {"spiders": ["spider1", "spider2", "spider3"]}
-    assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"myproject"]}, expected)
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"myproject"]}, expected)
 
     # Delete one version.
     args = {b"project": [b"myproject"], b"version": [b"r2"]}
-    assert_content(txrequest, root, "POST", "delversion", args, {"status": "ok"})
+    yield assert_content(txrequest, root, "POST", "delversion", args, {"status": "ok"})
     assert root.eggstorage.get("myproject", "r2") == (None, None)  # version is gone
 
     # Spiders (after) would contain "spider3" without cache eviction.
     expected = {"spiders": ["spider1", "spider2"]}
-    assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"myproject"]}, expected)
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"myproject"]}, expected)
 
     # Projects (before).
-    assert_content(txrequest, root, "GET", "listprojects", {}, {"projects": ["myproject", *projects]})
+    yield assert_content(txrequest, root, "GET", "listprojects", {}, {"projects": ["myproject", *projects]})
 
     # Delete another version.
     args = {b"project": [b"myproject"], b"version": [b"r1"]}
-    assert_content(txrequest, root, "POST", "delversion", args, {"status": "ok"})
+    yield assert_content(txrequest, root, "POST", "delversion", args, {"status": "ok"})
     assert root.eggstorage.get("myproject") == (None, None)  # project is gone
 
     # Projects (after) would contain "myproject" without root.update_projects().
-    assert_content(txrequest, root, "GET", "listprojects", {}, {"projects": [*projects]})
+    yield assert_content(txrequest, root, "GET", "listprojects", {}, {"projects": [*projects]})
 
 
+@inlineCallbacks
 def test_delete_version_uncached(txrequest, root_with_egg):
     args = {b"project": [b"quotesbot"], b"version": [b"0.1"]}
-    assert_content(txrequest, root_with_egg, "POST", "delversion", args, {"status": "ok"})
+    yield assert_content(txrequest, root_with_egg, "POST", "delversion", args, {"status": "ok"})
 
 
 @pytest.mark.parametrize(
@@ -383,82 +818,149 @@ def test_delete_version_uncached(txrequest, root_with_egg):
         ({b"project": [b"nonexistent"], b"version": [b"0.1"]}, b"version '0.1' not found"),
     ],
 )
+@inlineCallbacks
 def test_delete_version_nonexistent(txrequest, root_with_egg, args, message):
-    assert_error(txrequest, root_with_egg, "POST", "delversion", args, message)
+    yield assert_error(txrequest, root_with_egg, "POST", "delversion", args, message)
 
 
+@inlineCallbacks
 def test_delete_project(txrequest, root_with_egg):
     projects = get_local_projects(root_with_egg)
 
     # Spiders (before).
     expected = {"spiders": ["toscrape-css", "toscrape-xpath"]}
-    assert_content(txrequest, root_with_egg, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
 
     # Projects (before).
     expected = {"projects": ["quotesbot", *projects]}
-    assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
 
     # Delete the project.
     args = {b"project": [b"quotesbot"]}
-    assert_content(txrequest, root_with_egg, "POST", "delproject", args, {"status": "ok"})
+    yield assert_content(txrequest, root_with_egg, "POST", "delproject", args, {"status": "ok"})
     assert root_with_egg.eggstorage.get("quotesbot") == (None, None)  # project is gone
 
     # Spiders (after).
     args = {b"project": [b"quotesbot"]}
-    assert_error(txrequest, root_with_egg, "GET", "listspiders", args, b"project 'quotesbot' not found")
+    yield assert_error(txrequest, root_with_egg, "GET", "listspiders", args, b"project 'quotesbot' not found")
 
     # Projects (after) would contain "quotesbot" without root.update_projects().
     expected = {"projects": [*projects]}
-    assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
+    yield assert_content(txrequest, root_with_egg, "GET", "listprojects", {}, expected)
 
 
+@inlineCallbacks
 def test_delete_project_uncached(txrequest, root_with_egg):
     args = {b"project": [b"quotesbot"]}
-    assert_content(txrequest, root_with_egg, "POST", "delproject", args, {"status": "ok"})
+    yield assert_content(txrequest, root_with_egg, "POST", "delproject", args, {"status": "ok"})
 
 
+@inlineCallbacks
 def test_delete_project_nonexistent(txrequest, root):
     args = {b"project": [b"nonexistent"]}
-    assert_error(txrequest, root, "POST", "delproject", args, b"project 'nonexistent' not found")
+    yield assert_error(txrequest, root, "POST", "delproject", args, b"project 'nonexistent' not found")
 
 
+@inlineCallbacks
 def test_add_version(txrequest, root):
     assert root.eggstorage.get("quotesbot") == (None, None)
 
     # Add a version.
     args = {b"project": [b"quotesbot"], b"version": [b"0.1"], b"egg": [get_egg_data("quotesbot")]}
     expected = {"project": "quotesbot", "version": "0.1", "spiders": 2}
-    assert_content(txrequest, root, "POST", "addversion", args, expected)
+    yield assert_content(txrequest, root, "POST", "addversion", args, expected)
     assert root.eggstorage.list("quotesbot") == ["0_1"]
 
     # Spiders (before).
     expected = {"spiders": ["toscrape-css", "toscrape-xpath"]}
-    assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
 
     # Add the same version with a different egg.
     args = {b"project": [b"quotesbot"], b"version": [b"0.1"], b"egg": [get_egg_data("mybot2")]}
     expected = {"project": "quotesbot", "version": "0.1", "spiders": 3}  # 2 without cache eviction
-    assert_content(txrequest, root, "POST", "addversion", args, expected)
+    yield assert_content(txrequest, root, "POST", "addversion", args, expected)
     assert root.eggstorage.list("quotesbot") == ["0_1"]  # overwrite version
 
     # Spiders (after).
     expected = {"spiders": ["spider1", "spider2", "spider3"]}
-    assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
 
 
+@inlineCallbacks
 def test_add_version_settings(txrequest, root):
     if not has_settings():
         pytest.skip("[settings] section is not set")
 
     args = {b"project": [b"localproject"], b"version": [b"0.1"], b"egg": [get_egg_data("quotesbot")]}
     expected = {"project": "localproject", "spiders": 2, "version": "0.1"}
-    assert_content(txrequest, root, "POST", "addversion", args, expected)
+    yield assert_content(txrequest, root, "POST", "addversion", args, expected)
 
 
+@inlineCallbacks
 def test_add_version_invalid(txrequest, root):
     args = {b"project": [b"quotesbot"], b"version": [b"0.1"], b"egg": [b"invalid"]}
     message = b"egg is not a ZIP file (if using curl, use egg=@path not egg=path)"
-    assert_error(txrequest, root, "POST", "addversion", args, message)
+    yield assert_error(txrequest, root, "POST", "addversion", args, message)
+
+
+@inlineCallbacks
+def test_add_version_background(txrequest, root, monkeypatch):
+    root.spider_discovery = "background"
+    spawn = MagicMock(wraps=reactor.spawnProcess)
+    monkeypatch.setattr(reactor, "spawnProcess", spawn)
+
+    args = {b"project": [b"quotesbot"], b"version": [b"0.1"], b"egg": [get_egg_data("quotesbot")]}
+    expected = {"project": "quotesbot", "version": "0.1", "spiders": None, "discovery": "running"}
+    yield assert_content(txrequest, root, "POST", "addversion", args, expected)
+    assert root.eggstorage.list("quotesbot") == ["0_1"]
+
+    expected = {"versions": ["0_1"], "discovery": {"0.1": {"status": "running"}}}
+    yield assert_content(txrequest, root, "GET", "listversions", {b"project": [b"quotesbot"]}, expected)
+
+    # Wait for the process that is inspecting the version, instead of spawning another.
+    expected = {"spiders": ["toscrape-css", "toscrape-xpath"]}
+    yield assert_content(txrequest, root, "GET", "listspiders", {b"project": [b"quotesbot"]}, expected)
+    assert spawn.call_count == 1
+
+    expected = {"versions": ["0_1"], "discovery": {"0.1": {"status": "finished", "spiders": 2}}}
+    yield assert_content(txrequest, root, "GET", "listversions", {b"project": [b"quotesbot"]}, expected)
+
+
+@inlineCallbacks
+def test_add_version_background_error(txrequest, root):
+    root.spider_discovery = "background"
+
+    args = {b"project": [b"myproject3"], b"version": [b"r1"], b"egg": [get_egg_data("mybot3")]}
+    expected = {"project": "myproject3", "version": "r1", "spiders": None, "discovery": "running"}
+    yield assert_content(txrequest, root, "POST", "addversion", args, expected)
+
+    with pytest.raises(RunnerError):
+        yield spider_list.get("myproject3", "r1", runner="scrapyd.runner")
+
+    status = spider_list.discovered("myproject3")["r1"]
+    assert status["status"] == "failed"
+    assert "This should break the `scrapy list` command" in status["message"]
+
+
+@inlineCallbacks
+def test_spider_list_discover_workers(app, monkeypatch):
+    add_test_version(app, "myproject", "r1", "mybot")
+    add_test_version(app, "myproject2", "r1", "mybot2")
+    spawn = MagicMock(wraps=reactor.spawnProcess)
+    monkeypatch.setattr(reactor, "spawnProcess", spawn)
+    monkeypatch.setattr(spider_list, "workers", DeferredSemaphore(1))
+
+    first = spider_list.discover("myproject", "r1", runner="scrapyd.runner")
+    second = spider_list.discover("myproject2", "r1", runner="scrapyd.runner")
+
+    # The second process waits for a worker.
+    assert spawn.call_count == 1
+    assert spider_list.discovered("myproject2") == {"r1": {"status": "running"}}
+    assert sorted((yield first)) == ["spider1", "spider2"]
+    assert sorted((yield second)) == ["spider1", "spider2", "spider3"]
+    assert spawn.call_count == 2
+    assert spider_list.discovered("myproject") == {"r1": {"status": "finished", "spiders": 2}}
+    assert spider_list.discovered("myproject2") == {"r1": {"status": "finished", "spiders": 3}}
 
 
 # Like test_list_spiders.
@@ -470,7 +972,9 @@ def test_add_version_invalid(txrequest, root):
         ({b"project": [b"localproject"], b"spider": [b"example"]}, True),
     ],
 )
-def test_schedule(txrequest, root, args, run_only_if_has_settings):
+@inlineCallbacks
+def test_schedule(txrequest, root, args, run_only_if_has_settings, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1.5)
     if run_only_if_has_settings and not has_settings():
         pytest.skip("[settings] section is not set")
 
@@ -485,7 +989,7 @@ def test_schedule(txrequest, root, args, run_only_if_has_settings):
     assert root.poller.queues[project].list() == []
 
     txrequest.args = args.copy()
-    content = root.children[b"schedule.json"].render_POST(txrequest)
+    content = yield root.children[b"schedule.json"].render_POST(txrequest)
     jobid = content.pop("jobid")
 
     assert content.pop("node_name")
@@ -493,7 +997,7 @@ def test_schedule(txrequest, root, args, run_only_if_has_settings):
     assert re.search(r"^[a-z0-9]{32}$", jobid)
 
     jobs = root.poller.queues[project].list()
-    expected = {"name": spider, "_job": jobid, "settings": {}}
+    expected = {"name": spider, "_job": jobid, "_scheduled": 1.5, "settings": {}}
     if version:
         expected["_version"] = version
 
@@ -501,17 +1005,22 @@ def test_schedule(txrequest, root, args, run_only_if_has_settings):
     assert jobs[0] == expected
 
 
-def test_schedule_parameters(txrequest, root_with_egg):
+@inlineCallbacks
+def test_schedule_parameters(txrequest, root_with_egg, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1.5)
     txrequest.args = {
         b"project": [b"quotesbot"],
         b"spider": [b"toscrape-css"],
         b"_version": [b"0.1"],
         b"jobid": [b"aaa"],
         b"priority": [b"5"],
+        b"_max_proc": [b"2"],
         b"setting": [b"DOWNLOAD_DELAY=2", b"TRACK=Cause = Time"],
         b"other": [b"one", b"two"],
+        b"_scheduled": [b"abc"],  # reserved keys are ignored
+        b"_not_before": [b"abc"],
     }
-    content = root_with_egg.children[b"schedule.json"].render_POST(txrequest)
+    content = yield root_with_egg.children[b"schedule.json"].render_POST(txrequest)
 
     assert content.pop("node_name")
     assert content == {"status": "ok", "jobid": "aaa"}
@@ -523,6 +1032,9 @@ def test_schedule_parameters(txrequest, root_with_egg):
         "name": "toscrape-css",
         "_version": "0.1",
         "_job": "aaa",
+        "_max_proc": 2,
+        "_scheduled": 1.5,
+        "_dedupe": "aaa",  # an explicit job ID makes scheduling idempotent
         "settings": {
             "DOWNLOAD_DELAY": "2",
             "TRACK": "Cause = Time",
@@ -531,6 +1043,123 @@ def test_schedule_parameters(txrequest, root_with_egg):
     }
 
 
+@pytest.mark.parametrize(
+    ("args", "jobids", "pending"),
+    [
+        ({b"dedupe_key": [b"k"]}, ["first", "first", "first"], [("first", 5)]),
+        ({b"jobid": [b"aaa"]}, ["aaa", "aaa", "aaa"], [("aaa", 5)]),
+        ({b"jobid": [b"aaa"], b"dedupe_key": [b"k"]}, ["aaa", "aaa", "aaa"], [("aaa", 5)]),
+        ({}, ["first", "second", "third"], [("second", 5), ("first", 1), ("third", 0)]),
+    ],
+)
+@inlineCallbacks
+def test_schedule_dedupe(txrequest, root_with_egg, args, jobids, pending):
+    responses = []
+    for priority, jobid in ((b"1", b"first"), (b"5", b"second"), (b"0", b"third")):
+        txrequest.args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], b"priority": [priority]}
+        txrequest.args[b"jobid"] = [jobid]
+        txrequest.args.update(args)
+        responses.append((yield root_with_egg.children[b"schedule.json"].render_POST(txrequest))["jobid"])
+
+    assert responses == jobids
+    assert [(message["_job"], priority) for message, priority in root_with_egg.poller.queues["quotesbot"].q] == pending
+
+
+@pytest.mark.parametrize(
+    ("args", "expected"),
+    [
+        ({b"not_before": [b"60"]}, 1060),
+        ({b"not_before": [b"-1.5"]}, 998.5),
+        ({b"not_before": [b"1970-01-01T00:20:00Z"]}, 1200),
+        ({b"not_before": [b"1970-01-01T01:20:00+01:00"]}, 1200),
+        ({b"not_before": [b"60"], b"jitter": [b"10"]}, 1065),
+        ({b"jitter": [b"10"]}, 1005),
+        ({b"jitter": [b"0"]}, None),
+    ],
+)
+@inlineCallbacks
+def test_schedule_not_before(txrequest, root_with_egg, monkeypatch, args, expected):
+    monkeypatch.setattr("time.time", lambda: 1000)
+    monkeypatch.setattr("random.uniform", lambda a, b: (a + b) / 2)
+    txrequest.args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], **args}
+    (yield root_with_egg.children[b"schedule.json"].render_POST(txrequest))
+
+    assert root_with_egg.poller.queues["quotesbot"].list()[0].get("_not_before") == expected
+
+
+@pytest.mark.parametrize(
+    ("args", "message"),
+    [
+        ({b"not_before": [b"tomorrow"]}, b"not_before is invalid: Invalid isoformat string: 'tomorrow'"),
+        ({b"not_before": [b"inf"]}, b"not_before is invalid: inf"),
+        ({b"jitter": [b"-1"]}, b"jitter is invalid: -1.0"),
+        ({b"jitter": [b"x"]}, b"jitter is invalid: could not convert string to float: b'x'"),
+    ],
+)
+@inlineCallbacks
+def test_schedule_not_before_invalid(txrequest, root_with_egg, args, message):
+    args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], **args}
+
+    yield assert_error(txrequest, root_with_egg, "POST", "schedule", args, message)
+
+
+@pytest.mark.parametrize(
+    ("args", "expected"),
+    [
+        ({}, None),
+        ({b"expires_after": [b"60"]}, 1060),
+        ({b"expires_after": [b"60"], b"not_before": [b"30"]}, 1090),
+    ],
+)
+@inlineCallbacks
+def test_schedule_expires_after(txrequest, root_with_egg, monkeypatch, args, expected):
+    monkeypatch.setattr("time.time", lambda: 1000)
+    txrequest.args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], **args}
+    (yield root_with_egg.children[b"schedule.json"].render_POST(txrequest))
+
+    assert root_with_egg.poller.queues["quotesbot"].list()[0].get("_expires") == expected
+
+
+@pytest.mark.parametrize(
+    ("value", "message"),
+    [
+        (b"0", b"expires_after is invalid: 0.0"),
+        (b"nan", b"expires_after is invalid: nan"),
+        (b"x", b"expires_after is invalid: could not convert string to float: b'x'"),
+    ],
+)
+@inlineCallbacks
+def test_schedule_expires_after_invalid(txrequest, root_with_egg, value, message):
+    args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], b"expires_after": [value]}
+
+    yield assert_error(txrequest, root_with_egg, "POST", "schedule", args, message)
+
+
+@inlineCallbacks
+def test_list_jobs_expired(txrequest, root_with_egg, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1000)
+    txrequest.args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], b"expires_after": [b"60"]}
+    (yield root_with_egg.children[b"schedule.json"].render_POST(txrequest))
+
+    monkeypatch.setattr("time.time", lambda: 1060)
+    get_result(root_with_egg.launcher.expire())
+
+    txrequest.args = {}
+    content = get_result(root_with_egg.children[b"listjobs.json"].render_GET(txrequest))
+
+    assert content["pending"] == []
+    assert content["finished"] == []
+    # An expired job has no log or items.
+    assert content["expired"] == [
+        {"project": "quotesbot", "spider": "toscrape-css", "id": content["expired"][0]["id"], "end_time": ANY}
+    ]
+
+    txrequest.args = {b"job": [content["expired"][0]["id"].encode()]}
+    content = get_result(root_with_egg.children[b"status.json"].render_GET(txrequest))
+
+    assert content["currstate"] == "expired"
+
+
 # Like test_list_spiders_nonexistent.
 @pytest.mark.parametrize(
     ("args", "param", "run_only_if_has_settings"),
@@ -541,6 +1170,7 @@ def test_schedule_parameters(txrequest, root_with_egg):
         ({b"project": [b"localproject"], b"_version": [b"nonexistent"], b"spider": [b"example"]}, "version", True),
     ],
 )
+@inlineCallbacks
 def test_schedule_nonexistent(txrequest, root, args, param, run_only_if_has_settings):
     if run_only_if_has_settings and not has_settings():
         pytest.skip("[settings] section is not set")
@@ -549,10 +1179,150 @@ def test_schedule_nonexistent(txrequest, root, args, param, run_only_if_has_sett
     root_add_version(root, "myproject", "r2", "mybot2")
     root.update_projects()
 
-    assert_error(txrequest, root, "POST", "schedule", args, b"%b 'nonexistent' not found" % param.encode())
+    yield assert_error(txrequest, root, "POST", "schedule", args, b"%b 'nonexistent' not found" % param.encode())
+
+
+@pytest.mark.parametrize(
+    ("value", "message"),
+    [
+        (b"x", b"_max_proc is invalid: invalid literal for int() with base 10: b'x'"),
+        (b"0", b"_max_proc is invalid: 0"),
+    ],
+)
+@inlineCallbacks
+def test_schedule_max_proc_invalid(txrequest, root_with_egg, value, message):
+    args = {b"project": [b"quotesbot"], b"spider": [b"toscrape-css"], b"_max_proc": [value]}
+
+    yield assert_error(txrequest, root_with_egg, "POST", "schedule", args, message)
+    assert root_with_egg.poller.queues["quotesbot"].list() == []
+
+
+@inlineCallbacks
+def test_schedule_batch(txrequest, root, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1.5)
+    root_add_version(root, "myproject", "r1", "mybot")
+    root_add_version(root, "myproject", "r2", "mybot2")
+    root_add_version(root, "quotesbot", "0.1", "quotesbot")
+    root.update_projects()
+
+    jobs = [
+        {"project": "myproject", "spider": "spider3"},
+        {"project": "myproject", "spider": "spider1", "_version": "r1", "jobid": "aaa", "priority": 5},
+        {"project": "quotesbot", "spider": "toscrape-css", "settings": {"DOWNLOAD_DELAY": "2"}, "args": {"a": "b"}},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "bbb", "_max_proc": 1},
+    ]
+    txrequest.args = {b"jobs": [json.dumps(jobs).encode()]}
+    content = yield root.children[b"schedulebatch.json"].render_POST(txrequest)
+    jobids = content.pop("jobids")
+
+    assert content.pop("node_name")
+    assert content == {"status": "ok"}
+    assert len(jobids) == 4
+    assert re.search(r"^[a-z0-9]{32}$", jobids[0])
+    assert jobids[1] == "aaa"
+    assert re.search(r"^[a-z0-9]{32}$", jobids[2])
+
+    assert root.poller.queues["myproject"].list() == [
+        {"name": "spider1", "_job": "aaa", "_version": "r1", "_scheduled": 1.5, "_dedupe": "aaa", "settings": {}},
+        {"name": "spider3", "_job": jobids[0], "_scheduled": 1.5, "settings": {}},
+    ]
+    assert root.poller.queues["quotesbot"].list() == [
+        {"name": "toscrape-css", "_job": jobids[2], "_scheduled": 1.5, "settings": {"DOWNLOAD_DELAY": "2"}, "a": "b"},
+        {"name": "toscrape-css", "_job": "bbb", "_max_proc": 1, "_scheduled": 1.5, "_dedupe": "bbb", "settings": {}},
+    ]
+
+
+@inlineCallbacks
+def test_schedule_batch_not_before(txrequest, root_with_egg, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1000)
+    jobs = [
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "aaa", "not_before": 60},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "bbb", "not_before": "1970-01-01T00:20:00Z"},
+    ]
+    txrequest.args = {b"jobs": [json.dumps(jobs).encode()]}
+    (yield root_with_egg.children[b"schedulebatch.json"].render_POST(txrequest))
+
+    assert [message["_not_before"] for message in root_with_egg.poller.queues["quotesbot"].list()] == [1060, 1200]
+
+
+@inlineCallbacks
+def test_schedule_batch_expires_after(txrequest, root_with_egg, monkeypatch):
+    monkeypatch.setattr("time.time", lambda: 1000)
+    jobs = [
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "aaa", "expires_after": 60},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "bbb", "expires_after": 60, "not_before": 30},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "ccc"},
+    ]
+    txrequest.args = {b"jobs": [json.dumps(jobs).encode()]}
+    (yield root_with_egg.children[b"schedulebatch.json"].render_POST(txrequest))
+
+    assert [message.get("_expires") for message in root_with_egg.poller.queues["quotesbot"].list()] == [
+        1060,
+        1090,
+        None,
+    ]
+
+
+@inlineCallbacks
+def test_schedule_batch_dedupe(txrequest, root_with_egg):
+    jobs = [
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "aaa"},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "bbb", "dedupe_key": "k"},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "ccc", "dedupe_key": "k", "priority": 5},
+        {"project": "quotesbot", "spider": "toscrape-css", "jobid": "aaa"},
+    ]
+    txrequest.args = {b"jobs": [json.dumps(jobs).encode()]}
+    content = yield root_with_egg.children[b"schedulebatch.json"].render_POST(txrequest)
+
+    assert content["jobids"] == ["aaa", "bbb", "bbb", "aaa"]
+    assert [(message["_job"], priority) for message, priority in root_with_egg.poller.queues["quotesbot"].q] == [
+        ("bbb", 5),
+        ("aaa", 0),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("jobs", "message"),
+    [
+        (b"[", b"jobs is invalid: Expecting value: line 1 column 2 (char 1)"),
+        (b"{}", b"jobs is invalid: expected a JSON array of JSON objects"),
+        (b"[1]", b"jobs is invalid: expected a JSON array of JSON objects"),
+        (b'[{"spider": "spider1"}]', b"'project' key is required"),
+        (b'[{"project": "myproject"}]', b"'spider' key is required"),
+        (b'[{"project": ["myproject"], "spider": "spider1"}]', b'project is invalid: ["myproject"]'),
+        (b'[{"project": "myproject", "spider": "spider1", "priority": "5"}]', b'priority is invalid: "5"'),
+        (b'[{"project": "myproject", "spider": "spider1", "priority": true}]', b"priority is invalid: true"),
+        (b'[{"project": "myproject", "spider": "spider1", "args": []}]', b"args is invalid: []"),
+        (
+            b'[{"project": "myproject", "spider": "spider1", "args": {"_max_proc": "x"}}]',
+            b"args is invalid: '_max_proc' key is reserved",
+        ),
+        (b'[{"project": "myproject", "spider": "spider1", "_max_proc": 1.5}]', b"_max_proc is invalid: 1.5"),
+        (b'[{"project": "myproject", "spider": "spider1", "_max_proc": 0}]', b"_max_proc is invalid: 0"),
+        (b'[{"project": "myproject", "spider": "spider1", "not_before": [1]}]', b"not_before is invalid: [1]"),
+        (b'[{"project": "myproject", "spider": "spider1", "jitter": "1"}]', b'jitter is invalid: "1"'),
+        (b'[{"project": "nonexistent", "spider": "spider1"}]', b"project 'nonexistent' not found"),
+        (
+            b'[{"project": "myproject", "spider": "spider1", "_version": "nonexistent"}]',
+            b"version 'nonexistent' not found",
+        ),
+        (
+            b'[{"project": "myproject", "spider": "spider1"}, {"project": "myproject", "spider": "nonexistent"}]',
+            b"spider 'nonexistent' not found",
+        ),
+    ],
+)
+@inlineCallbacks
+def test_schedule_batch_invalid(txrequest, root, jobs, message):
+    root_add_version(root, "myproject", "r1", "mybot")
+    root.update_projects()
+
+    yield assert_error(txrequest, root, "POST", "schedulebatch", {b"jobs": [jobs]}, message)
+    assert root.poller.queues["myproject"].list() == []  # no job is scheduled if any job is invalid
 
 
 @pytest.mark.parametrize("args", [{}, {b"signal": [b"TERM"]}])
+@inlineCallbacks
 def test_cancel(txrequest, root, scrapy_process, args):
     signal = "TERM" if args else ("INT" if sys.platform != "win32" else "BREAK")
 
@@ -563,7 +1333,7 @@ def test_cancel(txrequest, root, scrapy_process, args):
     args = {b"project": [b"p1"], b"job": [b"j1"], **args}
 
     expected = {"prevstate": None}
-    assert_content(txrequest, root, "POST", "cancel", args, expected)
+    yield assert_content(txrequest, root, "POST", "cancel", args, expected)
 
     root.poller.queues["p1"].add("s1", _job="j1")
     root.poller.queues["p1"].add("s1", _job="j1")
@@ -571,7 +1341,7 @@ def test_cancel(txrequest, root, scrapy_process, args):
 
     assert root.poller.queues["p1"].count() == 3
     expected["prevstate"] = "pending"
-    assert_content(txrequest, root, "POST", "cancel", args, expected)
+    yield assert_content(txrequest, root, "POST", "cancel", args, expected)
     assert root.poller.queues["p1"].count() == 1
 
     root.launcher.processes[0] = scrapy_process
@@ -579,14 +1349,15 @@ def test_cancel(txrequest, root, scrapy_process, args):
     root.launcher.processes[2] = ScrapyProcessProtocol("p2", "s2", "j2", {}, [])
 
     expected["prevstate"] = "running"
-    assert_content(txrequest, root, "POST", "cancel", args, expected)
+    yield assert_content(txrequest, root, "POST", "cancel", args, expected)
     assert scrapy_process.transport.signalProcess.call_count == 2
     scrapy_process.transport.signalProcess.assert_has_calls([call(signal), call(signal)])
 
 
+@inlineCallbacks
 def test_cancel_nonexistent(txrequest, root):
     args = {b"project": [b"nonexistent"], b"job": [b"aaa"]}
-    assert_error(txrequest, root, "POST", "cancel", args, b"project 'nonexistent' not found")
+    yield assert_error(txrequest, root, "POST", "cancel", args, b"project 'nonexistent' not found")
 
 
 # ListSpiders, Schedule, Cancel, Status and ListJobs return "project '%b' not found" on directory traversal attempts.
@@ -601,8 +1372,9 @@ def test_cancel_nonexistent(txrequest, root):
         ("GET", "listjobs", {b"project": [b"../p"]}),
     ],
 )
+@inlineCallbacks
 def test_project_directory_traversal_notfound(txrequest, root, method, basename, args):
-    assert_error(txrequest, root, method, basename, args, b"project '../p' not found")
+    yield assert_error(txrequest, root, method, basename, args, b"project '../p' not found")
 
 
 @pytest.mark.parametrize(
@@ -621,7 +1393,7 @@ def test_project_directory_traversal(txrequest, root, endpoint, attach_egg, meth
         txrequest.args[b"egg"] = [get_egg_data("quotesbot")]
 
     with pytest.raises(DirectoryTraversalError) as exc:
-        getattr(root.children[endpoint], method)(txrequest)
+        get_result(getattr(root.children[endpoint], method)(txrequest))
 
     assert str(exc.value) == "../p"
 
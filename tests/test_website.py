@@ -1,11 +1,16 @@
 import os
 
+import pytest
 from twisted.web import resource
 from twisted.web.test._util import _render
 from twisted.web.test.requesthelper import DummyRequest
 
+from scrapyd.app import application
+from scrapyd.config import Config
+from scrapyd.exceptions import InvalidOptionError
 from scrapyd.jobstorage import Job
 from scrapyd.launcher import ScrapyProcessProtocol
+from scrapyd.website import Root
 from tests import has_settings
 
 
@@ -74,6 +79,15 @@ def test_render_jobs(txrequest, root_with_egg):
         assert b"display: none" in content
 
 
+def test_render_jobs_expired(txrequest, root_with_egg):
+    root_with_egg.launcher.finished.add(Job("p1", "s1", "j1", outcome="expired"))
+
+    content = root_with_egg.children[b"jobs"].render(txrequest)
+
+    assert b"<td>Expired</td>" in content
+    assert b"/logs/p1/s1/j1.log" not in content
+
+
 def test_render_home(txrequest, root_with_egg):
     content = root_with_egg.children[b""].render_GET(txrequest)
     expect_headers = {
@@ -91,3 +105,28 @@ def test_render_home(txrequest, root_with_egg):
         assert b"Items" in content
     else:
         assert b"Items" not in content
+
+
+def test_spider_lists_lazy(chdir):
+    config = Config()
+    root = Root(config, application(config))
+
+    # The database isn't created until the output of "scrapy list" is stored.
+    assert not os.path.exists(os.path.join(chdir, "dbs"))
+
+    root.spider_lists.set("p1", "r1", "digest", "scrapyd.runner", ["s1"])
+
+    assert os.path.exists(os.path.join(chdir, "dbs", "spiderlists.db"))
+
+
+def test_spider_discovery_invalid(chdir):
+    config = Config()
+    config.cp.set(Config.SECTION, "spider_discovery", "nonexistent")
+
+    with pytest.raises(InvalidOptionError) as exc:
+        Root(config, application(config))
+
+    assert str(exc.value) == (
+        "The `spider_discovery` option must be one of sync, background, not 'nonexistent'. Check and update the "
+        "Scrapyd configuration file."
+    )